@@ -0,0 +1,497 @@
+#!/usr/bin/env python
+
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from docopt import docopt
+
+import constants as C
+
+doc = """
+Usage:
+    benchmark.py format [--sizes=<mb>]
+    benchmark.py startup [--runs=<n>]
+    benchmark.py allocator [--blocks=<n>] [--memory]
+    benchmark.py scenarios [--runs=<n>]
+    benchmark.py cache [--cache=<mb>] [--clusters=<kb>]
+    benchmark.py accessor [--blocks=<n>]
+    benchmark.py readonly [--threads=<n>] [--size=<mb>]
+    benchmark.py read [--size=<mb>]
+    benchmark.py write [--size=<mb>]
+    benchmark.py import [--files=<n>] [--file-size=<kb>]
+
+Options:
+    -h, --help     Show this screen.
+    --sizes=<mb>   Comma separated image sizes in MB [default: 32,512,4096].
+    --runs=<n>     Number of fresh interpreters (startup) or scenarios to run [default: 7].
+    --memory       Use an in-memory image instead of a file.
+    --blocks=<n>   Number of blocks to allocate and release, or to read through the accessors [default: 500000].
+    --cache=<mb>   Size of the block cache in MB [default: 16].
+    --clusters=<kb>  Comma separated cluster sizes in KB to compare with the per-block cache [default: 8,64].
+    --size=<mb>    Size of the file to read or write, at most 16 MB [default: 16].
+    --threads=<n>  Comma separated numbers of reader threads [default: 1,2,4,8].
+    --files=<n>    Number of host files to import [default: 2000].
+    --file-size=<kb>  Size of each imported file in KB [default: 16].
+"""
+
+# 启动时间的预算（毫秒，取多次运行的中位数），超出时benchmark.py startup以非0状态退出
+IMPORT_BUDGET_MS = 100
+MOUNT_BUDGET_MS = 150
+
+# 在一个全新的解释器里计时挂载+卸载（包括挂载时才导入的模块）
+_MOUNT_SCRIPT = """
+import sys, time
+start = time.perf_counter()
+from disk import Disk
+disk = Disk(sys.argv[1])
+disk.mount()
+mounted = time.perf_counter()
+disk.unmount()
+print(mounted - start, time.perf_counter() - start)
+"""
+
+
+def bench_format(sizes: list[int]) -> None:
+    from format_disk import format_disk
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'bench.img')
+        for size in sizes:
+            disk_blocks = size * 1024 * 1024 // C.BLOCK_BYTES
+            start = time.perf_counter()
+            format_disk(path, init_params=True, disk_blocks=disk_blocks)
+            elapsed = time.perf_counter() - start
+            used = os.stat(path).st_blocks * 512
+            print(f"format {size:>6} MB: {elapsed:8.3f} s, {used / 1024 / 1024:8.2f} MB on host disk")
+            os.remove(path)
+
+
+def _run_python(*args: str) -> subprocess.CompletedProcess:
+    here = os.path.dirname(os.path.abspath(__file__))
+    return subprocess.run([sys.executable, *args], cwd=here, capture_output=True, text=True, check=True)
+
+
+# 在一个全新的解释器里读完整个文件，报告耗时和峰值内存（ru_maxrss，Linux下单位是KB）
+_READ_SCRIPT = """
+import resource, sys, time
+from disk import Disk
+disk = Disk(sys.argv[1])
+disk.mount()
+before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+start = time.perf_counter()
+if sys.argv[3] == 'iter':
+    total = sum(len(chunk) for chunk in disk.iter_file(sys.argv[2]))
+else:
+    total = len(disk.read_file(sys.argv[2], 0, -1))
+elapsed = time.perf_counter() - start
+print(total, elapsed, before, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+disk.unmount()
+"""
+
+
+def bench_read(size: int) -> None:
+    from disk import Disk
+    from inode import FILE_TYPE
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'bench.img')
+        disk = Disk.new(path)
+        disk.mount()
+        disk.create('/big', FILE_TYPE.FILE)
+        block = os.urandom(1024 * 1024)
+        for i in range(size):
+            disk.write_file('/big', i * len(block), block)
+        disk.unmount()
+
+        for mode in ('iter', 'read'):
+            total, elapsed, before, peak = _run_python('-c', _READ_SCRIPT, path, '/big', mode).stdout.split()
+            total, elapsed = int(total), float(elapsed)
+            print(f"{mode:<5}: {total / elapsed / 1024 / 1024:8.1f} MB/s, "
+                  f"peak RSS {int(peak) / 1024:7.1f} MB (+{(int(peak) - int(before)) / 1024:.1f} MB while reading)")
+
+
+# 在一个全新的解释器里把宿主机上的文件写进镜像，报告耗时和峰值内存
+_WRITE_SCRIPT = """
+import resource, shutil, sys, time
+from disk import Disk
+from inode import FILE_TYPE
+if sys.argv[3] == 'raw':
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    with open(sys.argv[2], 'rb') as source, open(sys.argv[1] + '.copy', 'wb') as target:
+        shutil.copyfileobj(source, target)
+else:
+    disk = Disk(sys.argv[1])
+    disk.mount()
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    if sys.argv[3] == 'writer':
+        with disk.open_writer('/big') as writer, open(sys.argv[2], 'rb') as source:
+            writer.write_from(source)
+    else:
+        with open(sys.argv[2], 'rb') as source:
+            disk.create('/big', FILE_TYPE.FILE)
+            disk.write_file('/big', 0, source.read())
+    disk.unmount()
+elapsed = time.perf_counter() - start
+print(elapsed, before, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+"""
+
+
+def bench_write(size: int) -> None:
+    from disk import Disk
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'bench.img')
+        source = os.path.join(directory, 'source.bin')
+        with open(source, 'wb') as f:
+            f.write(os.urandom(size * 1024 * 1024))
+
+        for mode in ('raw', 'writer', 'write_file'):
+            Disk.new(path)
+            elapsed, before, peak = _run_python('-c', _WRITE_SCRIPT, path, source, mode).stdout.split()
+            elapsed = float(elapsed)
+            print(f"{mode:<10}: {size / elapsed:8.1f} MB/s, "
+                  f"peak RSS {int(peak) / 1024:7.1f} MB (+{(int(peak) - int(before)) / 1024:.1f} MB while writing)")
+
+
+# FUSE每次write调用最多带这么多数据
+_FUSE_WRITE_BYTES = 128 * 1024
+
+
+def bench_import(files: int, file_size: int) -> None:
+    from disk import Disk
+    from import_tree import import_tree
+    from inode import FILE_TYPE
+
+    with tempfile.TemporaryDirectory() as directory:
+        host = os.path.join(directory, 'host')
+        for i in range(files):
+            sub = os.path.join(host, f'd{i // 100}')
+            os.makedirs(sub, exist_ok=True)
+            with open(os.path.join(sub, f'f{i}'), 'wb') as f:
+                f.write(os.urandom(file_size * 1024))
+        total = files * file_size * 1024
+        disk_blocks = total // C.BLOCK_BYTES * 2 + 65536
+        path = os.path.join(directory, 'bench.img')
+
+        # 逐个路径地创建、按FUSE的写入大小逐段写入，相当于挂载之后cp -r时FUSE对Disk的调用
+        disk = Disk.new(path, disk_blocks=disk_blocks)
+        disk.mount()
+        start = time.perf_counter()
+        disk.create('/imp', FILE_TYPE.DIR)
+        for root, dirs, names in os.walk(host):
+            target = '/imp' + root[len(host):]
+            for name in dirs:
+                disk.create(f'{target}/{name}', FILE_TYPE.DIR)
+            for name in names:
+                disk.create(f'{target}/{name}', FILE_TYPE.FILE)
+                with open(os.path.join(root, name), 'rb') as f:
+                    offset = 0
+                    while chunk := f.read(_FUSE_WRITE_BYTES):
+                        disk.write_file(f'{target}/{name}', offset, chunk)
+                        offset += len(chunk)
+        disk.unmount()
+        per_call = time.perf_counter() - start
+
+        disk = Disk.new(path, disk_blocks=disk_blocks)
+        disk.mount()
+        start = time.perf_counter()
+        import_tree(disk, host, '/imp')
+        disk.unmount()
+        imported = time.perf_counter() - start
+
+        for name, elapsed in (('per-call', per_call), ('import', imported)):
+            print(f"{name:<8}: {total / elapsed / 1024 / 1024:8.1f} MB/s, {files / elapsed:8.0f} files/s")
+
+
+def bench_startup(runs: int) -> bool:
+    from disk import Disk
+
+    import_times = []
+    for _ in range(runs):
+        result = _run_python('-X', 'importtime', '-c', 'import mount')
+        # -X importtime的每一行：import time: self | cumulative | name
+        match = re.search(r'^import time:\s*\d+ \|\s*(\d+) \| mount$', result.stderr, re.M)
+        assert match, result.stderr
+        import_times.append(int(match.group(1)) / 1000)
+
+    mount_times, total_times = [], []
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'bench.img')
+        Disk.new(path)
+        for _ in range(runs):
+            mounted, total = _run_python('-c', _MOUNT_SCRIPT, path).stdout.split()
+            mount_times.append(float(mounted) * 1000)
+            total_times.append(float(total) * 1000)
+
+    results = [
+        ("import mount.py", statistics.median(import_times), IMPORT_BUDGET_MS),
+        ("import + mount", statistics.median(mount_times), MOUNT_BUDGET_MS),
+        ("import + mount + unmount", statistics.median(total_times), None),
+    ]
+    ok = True
+    for name, value, budget in results:
+        if budget is None:
+            print(f"{name:<26}: {value:7.1f} ms")
+            continue
+        status = "ok" if value <= budget else "OVER BUDGET"
+        ok = ok and value <= budget
+        print(f"{name:<26}: {value:7.1f} ms (budget {budget} ms, {status})")
+    return ok
+
+
+def bench_allocator(blocks: int, memory: bool = False) -> None:
+    from disk import Disk
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = C.MEMORY_IMAGE_PREFIX + 'bench.img' if memory else os.path.join(directory, 'bench.img')
+        # 数据区比要分配的块数稍大一些
+        disk = Disk.new(path, inode_blocks=16, disk_blocks=blocks + 1024)
+        disk.mount()
+        superblock = disk.superblock
+
+        start = time.perf_counter()
+        allocated = [superblock.allocate_block() for _ in range(blocks)]
+        allocate_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for index in allocated:
+            superblock.release_block(index)
+        release_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        superblock.flush()
+        superblock.flush()  # 第二次没有改动，不应该再写
+        sync_time = time.perf_counter() - start
+        disk.unmount()
+
+    print(f"allocate_block: {blocks / allocate_time:12,.0f} blocks/s")
+    print(f"release_block : {blocks / release_time:12,.0f} blocks/s")
+    print(f"superblock sync: {sync_time * 1000:8.3f} ms")
+
+
+def _scenario(path: str, index: int) -> None:
+    # 一个独立的小场景：格式化、建目录和文件、写、改名、删除、重新挂载后读
+    from disk import Disk
+    from inode import FILE_TYPE
+
+    disk = Disk.new(path)
+    disk.mount()
+    disk.create('/d', FILE_TYPE.DIR)
+    disk.create_many([f'/d/f{i}' for i in range(20)], FILE_TYPE.FILE)
+    for i in range(20):
+        disk.write_file(f'/d/f{i}', 0, bytes([index % 256]) * (i * 700))
+    disk.rename('/d/f3', '/d/g')
+    disk.unlink_many([f'/d/f{i}' for i in range(10, 20)])
+    disk.unmount()
+    disk = Disk(path)
+    disk.mount()
+    assert disk.read_file('/d/g', 0, -1) == bytes([index % 256]) * 2100
+    disk.unmount()
+
+
+def bench_scenarios(runs: int) -> None:
+    """
+    同样的一批小场景分别在内存镜像和镜像文件上跑，内存镜像上测到的基本就是纯CPU开销
+    """
+    from memory_device import remove_memory_image
+
+    with tempfile.TemporaryDirectory() as directory:
+        for name, path in (('memory', C.MEMORY_IMAGE_PREFIX + 'bench.img'), ('file', os.path.join(directory, 'bench.img'))):
+            _scenario(path, 0)  # 先跑一次，把模块导入等一次性的开销排除在外
+            start, cpu = time.perf_counter(), time.process_time()
+            for i in range(runs):
+                _scenario(path, i)
+            elapsed, cpu = time.perf_counter() - start, time.process_time() - cpu
+            print(f"{name:<6}: {elapsed / runs * 1000:7.2f} ms per scenario ({cpu / runs * 1000:7.2f} ms CPU), "
+                  f"{runs / elapsed:7.1f} scenarios/s")
+        remove_memory_image(C.MEMORY_IMAGE_PREFIX + 'bench.img')
+
+
+def _cache_workload(device, blocks: int) -> dict[str, float]:
+    """
+    在缓存能放下的blocks个块上跑几种访问模式，返回每种模式每秒处理的块数
+    """
+    import random
+
+    rng = random.Random(0)
+    order = list(range(blocks))
+    rng.shuffle(order)
+    results = {}
+
+    start = time.perf_counter()
+    for i in range(blocks):
+        device.read_block(i)
+    results['cold sequential read'] = blocks / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for i in order:
+        device.read_block_bytes(i, 64, 32)
+    results['cached random read'] = blocks / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for i in order:
+        device.write_block_bytes(i, 128, b'x' * 32)
+    device.flush()
+    results['random write+flush'] = blocks / (time.perf_counter() - start)
+    return results
+
+
+def bench_cache(cache_mb: int, cluster_kbs: list[int]) -> None:
+    """
+    比较逐块缓存和按簇缓存：缓存装满之后每MB缓存数据实际占用的内存（tracemalloc），以及几种访问模式的吞吐量
+    """
+    import tracemalloc
+    from block_device import CachedBlockDevice, ClusteredBlockDevice
+
+    blocks = cache_mb * 1024 * 1024 // C.BLOCK_BYTES
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'bench.img')
+        with open(path, 'wb') as f:
+            f.write(os.urandom(blocks * C.BLOCK_BYTES))
+
+        configs = [('per-block', lambda: CachedBlockDevice(path))]
+        configs += [(f'{kb} KB cluster', lambda kb=kb: ClusteredBlockDevice(path, cluster_bytes=kb * 1024,
+                                                                            cache_bytes=cache_mb * 1024 * 1024))
+                    for kb in cluster_kbs]
+        for name, open_cache in configs:
+            tracemalloc.start()
+            device = open_cache()
+            if isinstance(device, CachedBlockDevice):
+                device.cache.capacity = blocks
+            baseline = tracemalloc.get_traced_memory()[0]
+            for i in range(blocks):
+                device.read_block(i)
+            used = tracemalloc.get_traced_memory()[0] - baseline
+            tracemalloc.stop()
+            device.close()
+
+            device = open_cache()
+            if isinstance(device, CachedBlockDevice):
+                device.cache.capacity = blocks
+            results = _cache_workload(device, blocks)
+            device.close()
+
+            print(f"{name:<14}: {used / cache_mb / 1024 / 1024:6.2f} MB of memory per cached MB")
+            for workload, rate in results.items():
+                print(f"    {workload:<22}: {rate:12,.0f} blocks/s")
+
+
+def bench_accessor(blocks: int) -> None:
+    """
+    ObjectAccessor里各个读写接口每个块（inode）的开销，与直接从块设备读比较
+    """
+    from disk import Disk
+    import disk_params as DiskParams
+
+    path = C.MEMORY_IMAGE_PREFIX + 'bench.img'
+    disk = Disk.new(path, inode_blocks=1024, disk_blocks=65536)
+    disk.mount()
+    accessor = disk.object_accessor
+    device = disk.block_device
+    # 在缓存能放下的一小段块上反复读，测到的是调用本身的开销
+    # 块号不连续，get_many只能逐块读
+    window = list(range(DiskParams.DATA_START, DiskParams.DATA_START + 2 * C.LRU_CACHE_LENGTH, 2))
+    indices = (window * (blocks // len(window) + 1))[:blocks]
+    inodes = [i % C.LRU_CACHE_LENGTH for i in range(blocks // 100)]
+
+    def measure(name: str, count: int, function) -> None:
+        # 取三次里最快的一次，减少别的进程的干扰
+        elapsed = float('inf')
+        for _ in range(3):
+            start = time.perf_counter()
+            function()
+            elapsed = min(elapsed, time.perf_counter() - start)
+        print(f"{name:<30}: {elapsed / count * 1e9:8.0f} ns per item")
+
+    def each(get):
+        return lambda: [get(i) for i in indices]
+
+    measure('block_device.read_block', blocks, each(device.read_block))
+    measure('file_blocks.get', blocks, each(accessor.file_blocks.get))
+    measure('file_blocks.get_many', blocks,
+            lambda: [accessor.file_blocks.get_many(window) for _ in range(blocks // len(window))])
+    measure('file_blocks.get_many (range)', blocks,
+            lambda: [accessor.file_blocks.get_many(list(range(i, i + 256))) for i in
+                     range(DiskParams.DATA_START, DiskParams.DATA_START + blocks, 256)])
+    measure('inodes.get', len(inodes), lambda: [accessor.inodes.get(i) for i in inodes])
+    measure('inodes.get_many', len(inodes), lambda: accessor.inodes.get_many(inodes))
+    disk.unmount()
+
+    from memory_device import remove_memory_image
+    remove_memory_image(path)
+
+
+def bench_readonly(size: int, thread_counts: list[int]) -> None:
+    """
+    只读挂载时，多个线程像FUSE那样按128KB一次同时读文件，每个线程读不同的文件。
+    每一轮之前先让宿主机丢掉镜像的页缓存，读的时候要真的去读磁盘
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from disk import Disk
+    from inode import FILE_TYPE
+
+    files = max(thread_counts)
+    file_size = size * 1024 * 1024 // files
+    request = 128 * 1024
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'bench.img')
+        disk = Disk.new(path)
+        disk.mount()
+        for i in range(files):
+            disk.create(f'/f{i}', FILE_TYPE.FILE)
+            disk.write_file(f'/f{i}', 0, os.urandom(file_size))
+        disk.unmount()
+
+        for threads in thread_counts:
+            with open(path, 'rb') as f:
+                os.fsync(f.fileno())
+                os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+            disk = Disk(path, readonly=True)
+            disk.mount()
+            inodes = [disk.open_inode(f'/f{i}') for i in range(files)]
+
+            def read_files(first: int) -> int:
+                total = 0
+                for inode in inodes[first::threads]:
+                    for offset in range(0, file_size, request):
+                        total += len(disk.read_inode(inode, offset, request))
+                return total
+
+            start = time.perf_counter()
+            with ThreadPoolExecutor(threads) as pool:
+                total = sum(pool.map(read_files, range(threads)))
+            elapsed = time.perf_counter() - start
+            disk.unmount()
+            print(f"{threads} threads: {total / elapsed / 1024 / 1024:8.1f} MB/s")
+
+
+if __name__ == '__main__':
+    args = docopt(doc)
+    if args['format']:
+        bench_format([int(size) for size in args['--sizes'].split(',')])
+    elif args['startup']:
+        if not bench_startup(int(args['--runs'])):
+            sys.exit(1)
+    elif args['allocator']:
+        bench_allocator(int(args['--blocks']), args['--memory'])
+    elif args['scenarios']:
+        bench_scenarios(int(args['--runs']))
+    elif args['readonly']:
+        bench_readonly(int(args['--size']), [int(n) for n in args['--threads'].split(',')])
+    elif args['accessor']:
+        bench_accessor(int(args['--blocks']))
+    elif args['cache']:
+        bench_cache(int(args['--cache']), [int(kb) for kb in args['--clusters'].split(',')])
+    elif args['read']:
+        bench_read(int(args['--size']))
+    elif args['write']:
+        bench_write(int(args['--size']))
+    elif args['import']:
+        bench_import(int(args['--files']), int(args['--file-size']))
@@ -0,0 +1,67 @@
+class Bitmap:
+    """
+    一个简单的位图，每一项占一个字节（0为空闲，非0为占用），
+    这样查找和计数都可以直接用bytearray自带的find/count，速度很快。
+    内部维护一个hint：小于hint的项一定都已被占用，查找空闲项时从hint开始
+    """
+    def __init__(self, length: int, data: bytes | None = None):
+        if data is None:
+            self.data = bytearray(length)
+        else:
+            assert len(data) == length
+            self.data = bytearray(data)
+        self.hint = 0
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def is_free(self, index: int) -> bool:
+        return self.data[index] == 0
+
+    def set(self, index: int) -> None:
+        self.data[index] = 1
+
+    def clear(self, index: int) -> None:
+        self.data[index] = 0
+        if index < self.hint:
+            self.hint = index
+
+    def clear_range(self, start: int, end: int) -> None:
+        self.data[start:end] = bytes(end - start)
+        if start < self.hint:
+            self.hint = start
+
+    def find_free(self, start: int = 0) -> int:
+        """
+        返回不小于start的第一个空闲项，没有则返回-1
+        """
+        start = max(start, self.hint)
+        index = self.data.find(0, start)
+        if start == self.hint:
+            self.hint = index if index != -1 else len(self.data)
+        return index
+
+    def find_free_run(self, count: int, start: int = 0) -> int:
+        """
+        返回不小于start的第一段连续count个空闲项的起点，没有则返回-1
+        """
+        return self.data.find(bytes(count), max(start, self.hint))
+
+    def take_free(self, count: int, start: int = 0) -> list[int]:
+        """
+        从start开始，按顺序找出至多count个空闲项（不会将它们标记为占用）
+        """
+        result = []
+        index = self.find_free(start)
+        while index != -1 and len(result) < count:
+            result.append(index)
+            index = self.data.find(0, index + 1)
+        return result
+
+    def count_free(self, start: int = 0, end: int | None = None) -> int:
+        if end is None:
+            end = len(self.data)
+        return self.data.count(0, start, end)
+
+    def to_bytes(self) -> bytes:
+        return bytes(self.data)
@@ -1,7 +1,44 @@
 from collections import OrderedDict
 from typing import Callable, TypeVar, Generic
+import functools
 import constants as C
+import ctypes
 import os
+import errno
+
+# 一次pwritev最多能写多少段
+_IOV_MAX = os.sysconf('SC_IOV_MAX') if hasattr(os, 'sysconf') else 1024
+
+# fallocate的标志位，见linux/falloc.h
+_FALLOC_FL_KEEP_SIZE = 0x01
+_FALLOC_FL_PUNCH_HOLE = 0x02
+
+
+def _load_fallocate():
+    # 只有Linux的libc里有fallocate，其它系统上打洞就什么都不做
+    try:
+        fallocate = ctypes.CDLL(None, use_errno=True).fallocate
+    except (OSError, AttributeError):
+        return None
+    fallocate.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_int64, ctypes.c_int64]
+    fallocate.restype = ctypes.c_int
+    return fallocate
+
+
+_fallocate = _load_fallocate()
+
+
+def _runs(flags: bytearray, start: int = 0, end: int | None = None):
+    """
+    flags里值为1的连续段：(起点, 终点)
+    """
+    end = len(flags) if end is None else end
+    first = flags.find(1, start, end)
+    while first != -1:
+        stop = flags.find(0, first, end)
+        stop = end if stop == -1 else stop
+        yield first, stop
+        first = flags.find(1, stop, end)
 
 class CacheBlock:
     """
@@ -59,6 +96,21 @@ class LRUCache(Generic[ItemType]):
 
     def __contains__(self, index: int) -> bool:
         return index in self.cache
+
+    def __len__(self) -> int:
+        return len(self.cache)
+
+    def peek(self, index: int) -> ItemType | None:
+        """
+        获取缓存项，但不改变它在LRU中的位置
+        """
+        return self.cache.get(index)
+
+    def keys(self):
+        return self.cache.keys()
+
+    def pop(self, index: int) -> ItemType | None:
+        return self.cache.pop(index, None)
     
     def perform_on_all(self, method_name: str) -> None:
         for item in self.cache.values():
@@ -66,27 +118,153 @@ class LRUCache(Generic[ItemType]):
 
 
 class BlockDevice:
-    def __init__(self, path_to_image: str):
+    def __init__(self, path_to_image: str, readonly: bool = False, discard: bool = False):
+        """
+        readonly: 以只读方式打开镜像，所有写操作都会抛出EROFS
+        discard: 被释放的块在flush时在镜像文件里打洞，还给宿主机；
+                 同时记录哪些块一定全是0（镜像文件里的洞），分配清零的块时就不用真的去写0了
+        """
         self.path_to_image = path_to_image
+        self.readonly = readonly
         self.image_size = os.path.getsize(path_to_image)
         assert self.image_size % C.BLOCK_BYTES == 0
-        self.image_file = open(path_to_image, "r+b")
+        self.image_file = open(path_to_image, "rb" if readonly else "r+b", buffering=0)
+        self.fd = self.image_file.fileno()
         self.block_count = self.image_size // C.BLOCK_BYTES
+        self.discard_enabled = discard and not readonly
+        # 每块一个字节：等着打洞的块、一定全是0的块
+        self.discards: bytearray | None = None
+        self.known_zero: bytearray | None = None
+        if self.discard_enabled:
+            self.discards = bytearray(self.block_count)
+            self.known_zero = self._scan_holes()
+
+    def _scan_holes(self) -> bytearray:
+        """
+        用SEEK_HOLE/SEEK_DATA找出镜像文件里的洞，洞里的块读出来全是0
+        """
+        zero = bytearray(self.block_count)
+        if not hasattr(os, 'SEEK_HOLE'):
+            return zero
+        offset = 0
+        try:
+            while offset < self.image_size:
+                hole = os.lseek(self.fd, offset, os.SEEK_HOLE)
+                if hole >= self.image_size:
+                    break
+                try:
+                    data = os.lseek(self.fd, hole, os.SEEK_DATA)
+                except OSError as e:
+                    if e.errno != errno.ENXIO:
+                        raise
+                    data = self.image_size  # 洞一直延续到文件末尾
+                start, end = -(-hole // C.BLOCK_BYTES), data // C.BLOCK_BYTES
+                if start < end:
+                    zero[start:end] = b"\x01" * (end - start)
+                offset = data
+        except OSError:
+            pass  # 文件系统不支持的话就当作没有洞
+        return zero
+
+    def _written(self, start: int, end: int) -> None:
+        # 写过的块不再全是0，也不能再打洞了
+        if self.discard_enabled:
+            self.discards[start:end] = bytes(end - start)
+            self.known_zero[start:end] = bytes(end - start)
+
+    def is_known_zero(self, block_number: int) -> bool:
+        return self.known_zero is not None and self.known_zero[block_number] == 1
+
+    def discard(self, start: int, end: int) -> None:
+        """
+        [start, end)里的块已经被释放，内容不再需要了，等到flush时再打洞
+        """
+        if self.discard_enabled:
+            self.discards[start:end] = b"\x01" * (end - start)
+
+    def _punch(self, start: int, end: int) -> bool:
+        """
+        在镜像文件里打洞，成功时返回True
+        """
+        if _fallocate is None:
+            return False
+        result = _fallocate(self.fd, _FALLOC_FL_PUNCH_HOLE | _FALLOC_FL_KEEP_SIZE,
+                            start * C.BLOCK_BYTES, (end - start) * C.BLOCK_BYTES)
+        return result == 0
+
+    def _punch_discards(self) -> None:
+        # 连续的块一次打完
+        for start, end in list(_runs(self.discards)):
+            if not self._punch(start, end):
+                # 不支持打洞（或者出错了），以后也不再尝试，但已经知道的洞仍然有效
+                self.discard_enabled = False
+                self.discards = bytearray(self.block_count)
+                return
+            self.known_zero[start:end] = b"\x01" * (end - start)
+        self.discards = bytearray(self.block_count)
         
+    # 读写都用pread/pwrite，不需要先seek
     def read_block(self, block_number: int) -> bytes:
-        self.image_file.seek(block_number * C.BLOCK_BYTES)
-        return self.image_file.read(C.BLOCK_BYTES)
+        return os.pread(self.fd, C.BLOCK_BYTES, block_number * C.BLOCK_BYTES)
     
+    def read_block_range(self, start: int, end: int) -> bytes:
+        """
+        左闭右开，从0开始
+        """
+        return os.pread(self.fd, (end - start) * C.BLOCK_BYTES, start * C.BLOCK_BYTES)
+
+    def check_writable(self) -> None:
+        if self.readonly:
+            raise OSError(errno.EROFS, os.strerror(errno.EROFS), self.path_to_image)
+
     def write_block(self, block_number: int, data: bytes) -> None:
-        self.image_file.seek(block_number * C.BLOCK_BYTES)
-        self.image_file.write(data)
+        self.check_writable()
+        os.pwrite(self.fd, data, block_number * C.BLOCK_BYTES)
+        self._written(block_number, block_number + 1)
+
+    def write_block_range(self, start: int, data: bytes) -> None:
+        """
+        从start开始连续写入，data的长度必须是BLOCK_SIZE的整数倍
+        """
+        assert len(data) % C.BLOCK_BYTES == 0
+        self.check_writable()
+        os.pwrite(self.fd, data, start * C.BLOCK_BYTES)
+        self._written(start, start + len(data) // C.BLOCK_BYTES)
+
+    def write_block_vectors(self, start: int, buffers: list) -> None:
+        """
+        把若干段数据依次拼起来，从start开始连续写入（pwritev，不需要先拼成一整段），
+        总长度必须是BLOCK_SIZE的整数倍
+        """
+        self.check_writable()
+        offset = start * C.BLOCK_BYTES
+        self._written(start, start + sum(len(buffer) for buffer in buffers) // C.BLOCK_BYTES)
+        for i in range(0, len(buffers), _IOV_MAX):
+            group = buffers[i : i + _IOV_MAX]
+            length = sum(len(buffer) for buffer in group)
+            written = os.pwritev(self.fd, group, offset)
+            if written != length:  # 一般不会发生，真发生了就把剩下的部分拼起来再写
+                os.pwrite(self.fd, b"".join(group)[written:], offset + written)
+            offset += length
+        assert offset % C.BLOCK_BYTES == 0
+
+    def flush(self) -> None:
+        # 写入都是直接写到镜像里的，只有攒着的打洞要做
+        if self.discard_enabled:
+            self._punch_discards()
         
+    def sync(self) -> None:
+        """
+        等之前的写入真正落盘之后再返回，用来给需要保证先后顺序的写入分段
+        """
+        os.fsync(self.fd)
+
     def close(self) -> None:
         self.image_file.close()
 
 class CachedBlockDevice(BlockDevice):
-    def __init__(self, path_to_image: str):
-        super().__init__(path_to_image)
+    def __init__(self, path_to_image: str, readonly: bool = False, discard: bool = False):
+        super().__init__(path_to_image, readonly, discard)
         self.cache = LRUCache[CacheBlock](C.LRU_CACHE_LENGTH)
     
     def _generate_writer(self, block_number: int) -> Callable[[bytes], None]:
@@ -107,16 +285,32 @@ class CachedBlockDevice(BlockDevice):
     def read_block(self, block_number: int) -> bytes:
         return self.read_block_bytes(block_number, 0, C.BLOCK_BYTES)
 
+    def _cached_in_range(self, start: int, end: int) -> list[int]:
+        if end - start <= len(self.cache):
+            return [i for i in range(start, end) if i in self.cache]
+        return [i for i in self.cache.keys() if start <= i < end]
+
     def read_block_range(self, start: int, end: int) -> bytes:
         """
         左闭右开，从0开始
+        直接从镜像中整段读取，再用缓存中的块覆盖（缓存里的可能还没写回），
+        读到的块不会被放进缓存，以免大范围的读取把缓存冲掉
         """
-        result = b""
-        for i in range(start, end):
-            result += self.read_block(i)
-        return result
+        data = super().read_block_range(start, end)
+        cached = self._cached_in_range(start, end)
+        if not cached:
+            return data
+        buffer = bytearray(data)
+        for i in cached:
+            position = (i - start) * C.BLOCK_BYTES
+            buffer[position : position + C.BLOCK_BYTES] = self.cache.peek(i).read_full()
+        return bytes(buffer)
 
     def write_block_bytes(self, block_number: int, start: int, data: bytes) -> None:
+        # 只读时不能让修改进到缓存里，否则之后读到的就不是镜像里的内容了
+        self.check_writable()
+        # 进到缓存里就算写过了，不用等到真正写回
+        self._written(block_number, block_number + 1)
         if block_number in self.cache:
             block = self.cache.get(block_number)
             block.modify_bytes(start, data)
@@ -135,16 +329,308 @@ class CachedBlockDevice(BlockDevice):
         """
         左闭右开，从0开始
         data的长度必须是BLOCK_SIZE的整数倍
+        直接整段写入镜像，已在缓存中的块会被一并更新（不会再被写回）
         """
         assert len(data) % C.BLOCK_BYTES == 0
-        data_chunks = [data[i : i + C.BLOCK_BYTES] for i in range(0, len(data), C.BLOCK_BYTES)]
-        for i, chunk in enumerate(data_chunks):
-            self.write_block(start + i, chunk)
+        super().write_block_range(start, data)
+        end = start + len(data) // C.BLOCK_BYTES
+        for i in self._cached_in_range(start, end):
+            position = (i - start) * C.BLOCK_BYTES
+            block = self.cache.peek(i)
+            block.data = bytes(data[position : position + C.BLOCK_BYTES])
+            block.dirty = False
             
+    def write_block_vectors(self, start: int, buffers: list) -> None:
+        """
+        直接写入镜像，写到的块如果在缓存里就直接丢掉（缓存里的已经过时了）
+        """
+        super().write_block_vectors(start, buffers)
+        end = start + sum(len(buffer) for buffer in buffers) // C.BLOCK_BYTES
+        for i in self._cached_in_range(start, end):
+            self.cache.pop(i)
+            
+    def discard(self, start: int, end: int) -> None:
+        # 被释放的块在缓存里的内容没用了，还没写回的也不用写了
+        if self.discard_enabled:
+            for i in self._cached_in_range(start, end):
+                self.cache.pop(i)
+        super().discard(start, end)
+
+    def _punch(self, start: int, end: int) -> bool:
+        # 释放之后可能又被读进了缓存，打完洞缓存里的就过时了
+        for i in self._cached_in_range(start, end):
+            self.cache.pop(i)
+        return super()._punch(start, end)
+
     def flush(self) -> None:
         self.cache.perform_on_all('flush')
+        super().flush()
+
+    def sync(self) -> None:
+        self.flush()
+        super().sync()
         
     def close(self) -> None:
         self.flush()
         super().close()
+
+
+class Cluster:
+    """
+    一个缓存簇：连续的若干块的数据，以及两个按块记录的位掩码：
+    valid表示这一块的数据已经在data里了，dirty表示这一块改过、还没写回
+    """
+    __slots__ = ('data', 'valid', 'dirty')
+
+    def __init__(self, size: int):
+        self.data = bytearray(size)
+        self.valid = 0
+        self.dirty = 0
+
+
+def _mask(start: int, end: int) -> int:
+    return ((1 << (end - start)) - 1) << start
+
+
+def _mask_runs(mask: int):
+    """
+    mask里连续为1的位：(起点, 终点)
+    """
+    position = 0
+    while mask:
+        skip = (mask & -mask).bit_length() - 1
+        mask >>= skip
+        position += skip
+        length = (mask ^ (mask + 1)).bit_length() - 1
+        yield position, position + length
+        mask >>= length
+        position += length
+
+
+class ClusteredBlockDevice(BlockDevice):
+    """
+    按簇缓存的块设备，对外的接口与CachedBlockDevice一样。
+    缓存的单位是对齐的一簇（cluster_bytes字节），读不在缓存里的块时整簇一次读进来；
+    写入只改缓存，在被挤出缓存、flush或sync时才把簇里改过的块按连续段写回。
+    每一簇只有一个Cluster对象，没有逐块的对象和闭包，缓存很大时额外开销也很小
+    """
+    def __init__(self, path_to_image: str, readonly: bool = False, discard: bool = False,
+                 cluster_bytes: int = 64 * 1024, cache_bytes: int = C.CLUSTER_CACHE_BYTES):
+        assert cluster_bytes > 0 and cluster_bytes % C.BLOCK_BYTES == 0
+        super().__init__(path_to_image, readonly, discard)
+        self.cluster_blocks = cluster_bytes // C.BLOCK_BYTES
+        self.capacity = max(cache_bytes // cluster_bytes, 1)
+        self.clusters: OrderedDict[int, Cluster] = OrderedDict()
+
+    def _bounds(self, index: int) -> tuple[int, int]:
+        # 簇的块号范围，最后一簇可能不满
+        first = index * self.cluster_blocks
+        return first, min(first + self.cluster_blocks, self.block_count)
+
+    def _cluster(self, index: int) -> Cluster:
+        cluster = self.clusters.get(index)
+        if cluster is not None:
+            self.clusters.move_to_end(index)
+            return cluster
+        first, last = self._bounds(index)
+        cluster = Cluster((last - first) * C.BLOCK_BYTES)
+        self.clusters[index] = cluster
+        if len(self.clusters) > self.capacity:
+            self._write_back(*self.clusters.popitem(last=False))
+        return cluster
+
+    def _fill(self, index: int, cluster: Cluster) -> None:
+        """
+        整簇读进来，已经在缓存里的块（可能改过）保持不变
+        """
+        first, last = self._bounds(index)
+        data = super().read_block_range(first, last)
+        if not cluster.valid:
+            cluster.data[:] = data
+        else:
+            missing = _mask(0, last - first) & ~cluster.valid
+            for start, end in _mask_runs(missing):
+                cluster.data[start * C.BLOCK_BYTES : end * C.BLOCK_BYTES] = data[start * C.BLOCK_BYTES : end * C.BLOCK_BYTES]
+        cluster.valid = _mask(0, last - first)
+
+    def _write_back(self, index: int, cluster: Cluster) -> None:
+        first = index * self.cluster_blocks
+        for start, end in _mask_runs(cluster.dirty):
+            super().write_block_range(first + start, bytes(cluster.data[start * C.BLOCK_BYTES : end * C.BLOCK_BYTES]))
+        cluster.dirty = 0
+
+    def _cached_in_range(self, start: int, end: int):
+        """
+        [start, end)涉及到的、在缓存里的簇：(簇号, 簇, 簇内的起点, 簇内的终点)
+        """
+        first_index, last_index = start // self.cluster_blocks, (end - 1) // self.cluster_blocks + 1
+        if last_index - first_index <= len(self.clusters):
+            indexes = [i for i in range(first_index, last_index) if i in self.clusters]
+        else:
+            indexes = [i for i in self.clusters.keys() if first_index <= i < last_index]
+        for index in indexes:
+            base = index * self.cluster_blocks
+            yield index, self.clusters[index], max(start - base, 0), min(end - base, self.cluster_blocks)
+
+    def _invalidate(self, start: int, end: int) -> None:
+        # 这些块在缓存里的内容（包括还没写回的修改）都不要了
+        for _, cluster, first, last in self._cached_in_range(start, end):
+            mask = ~_mask(first, last)
+            cluster.valid &= mask
+            cluster.dirty &= mask
+
+    def read_block_bytes(self, block_number: int, start: int, length: int) -> bytes:
+        assert start + length <= C.BLOCK_BYTES, f"start: {start} + length: {length} > BLOCK_SIZE: {C.BLOCK_BYTES}"
+        index, position = divmod(block_number, self.cluster_blocks)
+        cluster = self._cluster(index)
+        if not cluster.valid >> position & 1:
+            self._fill(index, cluster)
+        offset = position * C.BLOCK_BYTES + start
+        return bytes(cluster.data[offset : offset + length])
+
+    def read_block(self, block_number: int) -> bytes:
+        return self.read_block_bytes(block_number, 0, C.BLOCK_BYTES)
+
+    def read_block_range(self, start: int, end: int) -> bytes:
+        """
+        左闭右开，从0开始
+        直接从镜像中整段读取，再用缓存里还没写回的块覆盖，读到的块不会被放进缓存
+        """
+        data = super().read_block_range(start, end)
+        buffer = None
+        for index, cluster, first, last in self._cached_in_range(start, end):
+            for run_start, run_end in _mask_runs(cluster.dirty & _mask(first, last)):
+                if buffer is None:
+                    buffer = bytearray(data)
+                position = (index * self.cluster_blocks + run_start - start) * C.BLOCK_BYTES
+                buffer[position : position + (run_end - run_start) * C.BLOCK_BYTES] = \
+                    cluster.data[run_start * C.BLOCK_BYTES : run_end * C.BLOCK_BYTES]
+        return data if buffer is None else bytes(buffer)
+
+    def write_block_bytes(self, block_number: int, start: int, data: bytes) -> None:
+        assert start + len(data) <= C.BLOCK_BYTES, f"start: {start} + len(data): {len(data)} > BLOCK_SIZE: {C.BLOCK_BYTES}"
+        self.check_writable()
+        self._written(block_number, block_number + 1)
+        index, position = divmod(block_number, self.cluster_blocks)
+        cluster = self._cluster(index)
+        bit = 1 << position
+        # 只改一块里的一部分时，这一块的其余部分要先读进来；整块覆盖就不用读了
+        if len(data) < C.BLOCK_BYTES and not cluster.valid & bit:
+            self._fill(index, cluster)
+        offset = position * C.BLOCK_BYTES + start
+        cluster.data[offset : offset + len(data)] = data
+        cluster.valid |= bit
+        cluster.dirty |= bit
+
+    def write_block(self, block_number: int, data: bytes) -> None:
+        self.write_block_bytes(block_number, 0, data)
+
+    def write_block_range(self, start: int, data: bytes) -> None:
+        """
+        直接整段写入镜像，已在缓存中的块会被一并更新（不会再被写回）
+        """
+        assert len(data) % C.BLOCK_BYTES == 0
+        super().write_block_range(start, data)
+        for index, cluster, first, last in self._cached_in_range(start, start + len(data) // C.BLOCK_BYTES):
+            position = (index * self.cluster_blocks + first - start) * C.BLOCK_BYTES
+            cluster.data[first * C.BLOCK_BYTES : last * C.BLOCK_BYTES] = \
+                data[position : position + (last - first) * C.BLOCK_BYTES]
+            mask = _mask(first, last)
+            cluster.valid |= mask
+            cluster.dirty &= ~mask
+
+    def write_block_vectors(self, start: int, buffers: list) -> None:
+        """
+        直接写入镜像，写到的块在缓存里的内容就作废了
+        """
+        super().write_block_vectors(start, buffers)
+        self._invalidate(start, start + sum(len(buffer) for buffer in buffers) // C.BLOCK_BYTES)
+
+    def discard(self, start: int, end: int) -> None:
+        if self.discard_enabled:
+            self._invalidate(start, end)
+        super().discard(start, end)
+
+    def _punch(self, start: int, end: int) -> bool:
+        self._invalidate(start, end)
+        return super()._punch(start, end)
+
+    def flush(self) -> None:
+        for index, cluster in self.clusters.items():
+            if cluster.dirty:
+                self._write_back(index, cluster)
+        super().flush()
+
+    def sync(self) -> None:
+        self.flush()
+        super().sync()
+
+    def close(self) -> None:
+        self.flush()
+        super().close()
+
+
+class ReadonlyCachedBlockDevice(BlockDevice):
+    """
+    只读的块设备，多个线程可以同时使用。
+    镜像不会被修改，缓存里的块也就永远不会过时，不需要写回，也不需要在读之间互斥：
+    缓存用的是functools.lru_cache（本身就是线程安全的），没命中的块用pread读，读的时候不占着GIL
+    """
+    def __init__(self, path_to_image: str, readonly: bool = True, discard: bool = False,
+                 cache_blocks: int = C.READONLY_CACHE_BLOCKS):
+        assert readonly
+        super().__init__(path_to_image, True, False)
+        self._load = functools.lru_cache(maxsize=cache_blocks)(super().read_block)
+
+    def read_block_bytes(self, block_number: int, start: int, length: int) -> bytes:
+        return self._load(block_number)[start : start + length]
+
+    def read_block(self, block_number: int) -> bytes:
+        return self._load(block_number)
+
+    def write_block_bytes(self, block_number: int, start: int, data: bytes) -> None:
+        self.check_writable()
+
+    def close(self) -> None:
+        self._load.cache_clear()
+        super().close()
+
+
+def open_device(path_to_image: str, readonly: bool = False, discard: bool = False,
+                cluster_bytes: int = C.CACHE_CLUSTER_BYTES) -> CachedBlockDevice | ClusteredBlockDevice | ReadonlyCachedBlockDevice:
+    """
+    打开镜像：路径以MEMORY_IMAGE_PREFIX开头时是内存镜像（见memory_device）；
+    旁边有写时复制的索引文件时，打开的是克隆（见cow_device）；
+    旁边有变更块位图时，还要记录写过的块（见change_tracking）。
+    cluster_bytes不为0时按这么大的簇缓存（ClusteredBlockDevice），否则逐块缓存。
+    只读打开时总是用多个线程可以共用的ReadonlyCachedBlockDevice，cluster_bytes不起作用
+    """
+    from cow_device import (CachedCowBlockDevice, CachedTrackedCowBlockDevice, ClusteredCowBlockDevice,
+                            ClusteredTrackedCowBlockDevice, ReadonlyCowBlockDevice, is_clone)
+    from change_tracking import CachedTrackedBlockDevice, ClusteredTrackedBlockDevice, is_tracked
+    from memory_device import CachedMemoryBlockDevice, ClusteredMemoryBlockDevice, ReadonlyMemoryBlockDevice, is_memory_image
+
+    if readonly:
+        # 只读时不会写，也就不用记录变更块
+        if is_memory_image(path_to_image):
+            return ReadonlyMemoryBlockDevice(path_to_image)
+        if is_clone(path_to_image):
+            return ReadonlyCowBlockDevice(path_to_image)
+        return ReadonlyCachedBlockDevice(path_to_image)
+
+    clustered = cluster_bytes > 0
+    if is_memory_image(path_to_image):
+        cls = ClusteredMemoryBlockDevice if clustered else CachedMemoryBlockDevice
+    elif is_clone(path_to_image):
+        if is_tracked(path_to_image):
+            cls = ClusteredTrackedCowBlockDevice if clustered else CachedTrackedCowBlockDevice
+        else:
+            cls = ClusteredCowBlockDevice if clustered else CachedCowBlockDevice
+    elif is_tracked(path_to_image):
+        cls = ClusteredTrackedBlockDevice if clustered else CachedTrackedBlockDevice
+    else:
+        cls = ClusteredBlockDevice if clustered else CachedBlockDevice
+    if clustered:
+        return cls(path_to_image, readonly, discard, cluster_bytes)
+    return cls(path_to_image, readonly, discard)
     
\ No newline at end of file
@@ -0,0 +1,252 @@
+import errno
+import os
+import struct
+import zlib
+
+import constants as C
+from bitmap import Bitmap
+from block_device import BlockDevice, CachedBlockDevice, ClusteredBlockDevice
+
+# 位图文件头：魔数、块数、下一个增量的序号、是否正常关闭，后面跟着压缩过的位图（每块一个字节，非0表示改过）
+_CBT_HEADER = struct.Struct("<8sQQ?")
+# 增量文件头：魔数、块数、序号、是否包含全部块，后面是若干段：(起点, 块数)和这些块的数据
+_DELTA_HEADER = struct.Struct("<8sQQ?")
+_RUN = struct.Struct("<QQ")
+# 恢复出来的镜像旁边的记录：魔数、最后应用的增量序号
+_APPLIED = struct.Struct("<8sQ")
+
+
+def cbt_path(image_path: str) -> str:
+    return image_path + C.CBT_SUFFIX
+
+
+def is_tracked(image_path: str) -> bool:
+    return os.path.exists(cbt_path(image_path))
+
+
+def _save_bitmap(image_path: str, changed: Bitmap, sequence: int, clean: bool, fsync: bool = False) -> None:
+    data = _CBT_HEADER.pack(C.CBT_MAGIC, len(changed), sequence, clean) + zlib.compress(changed.to_bytes())
+    # 先写临时文件再改名，避免留下写了一半的位图
+    path = cbt_path(image_path)
+    with open(path + ".tmp", "wb") as f:
+        f.write(data)
+        if fsync:
+            os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+
+
+def _load_bitmap(image_path: str) -> tuple[Bitmap, int, bool]:
+    with open(cbt_path(image_path), "rb") as f:
+        data = f.read()
+    magic, block_count, sequence, clean = _CBT_HEADER.unpack_from(data, 0)
+    if magic != C.CBT_MAGIC:
+        raise ValueError(f"{cbt_path(image_path)} is not a changed-block tracking file")
+    return Bitmap(block_count, zlib.decompress(data[_CBT_HEADER.size:])), sequence, clean
+
+
+def _all_changed(block_count: int) -> Bitmap:
+    return Bitmap(block_count, b"\x01" * block_count)
+
+
+def enable_tracking(image_path: str) -> None:
+    """
+    开始跟踪镜像里被改过的块。所有块都先被当作改过的，所以之后的第一个增量就是完整的备份。
+    已经在跟踪的镜像会从头开始（下一个增量的序号回到0）
+    """
+    block_count = os.path.getsize(image_path) // C.BLOCK_BYTES
+    _save_bitmap(image_path, _all_changed(block_count), 0, True, fsync=True)
+
+
+def mark_changed(image_path: str, runs: list[tuple[int, int]] | None = None) -> None:
+    """
+    不经过块设备直接改了镜像的工具（格式化、合并克隆）用这个把改过的块[(起点, 终点)]记下来，
+    runs为None表示整个镜像都改过了。镜像没有在跟踪时什么都不做
+    """
+    if not is_tracked(image_path):
+        return
+    changed, sequence, clean = _load_bitmap(image_path)
+    if runs is None:
+        changed = _all_changed(os.path.getsize(image_path) // C.BLOCK_BYTES)
+    for start, end in runs or ():
+        changed.data[start:end] = b"\x01" * (end - start)
+    _save_bitmap(image_path, changed, sequence, clean, fsync=True)
+
+
+def disable_tracking(image_path: str) -> None:
+    if is_tracked(image_path):
+        os.remove(cbt_path(image_path))
+
+
+class TrackedBlockDevice(BlockDevice):
+    """
+    记录自上一个增量以来被写过的块，位图保存在镜像旁边。
+    打开时先把位图标记为“没有正常关闭”，正常关闭时才改回来；
+    如果上次没有正常关闭，中途的写入可能没有记下来，这时就把所有块都当作改过的，下一个增量是完整的
+    """
+    def __init__(self, path_to_image: str, readonly: bool = False, discard: bool = False):
+        super().__init__(path_to_image, readonly, discard)
+        self.changed, self.sequence, clean = _load_bitmap(path_to_image)
+        if len(self.changed) != self.block_count:
+            raise ValueError(f"{cbt_path(path_to_image)} does not match {path_to_image}")
+        if not readonly:
+            if not clean:
+                self.changed = _all_changed(self.block_count)
+            _save_bitmap(path_to_image, self.changed, self.sequence, False, fsync=True)
+        self.bitmap_dirty = False
+
+    def _punch(self, start: int, end: int) -> bool:
+        # 打洞也改了块的内容，增量里要带上
+        if not super()._punch(start, end):
+            return False
+        self._mark_changed(start, end)
+        return True
+
+    def _mark_changed(self, start: int, end: int) -> None:
+        self.changed.data[start:end] = b"\x01" * (end - start)
+        self.bitmap_dirty = True
+
+    def write_block(self, block_number: int, data: bytes) -> None:
+        super().write_block(block_number, data)
+        self._mark_changed(block_number, block_number + 1)
+
+    def write_block_range(self, start: int, data: bytes) -> None:
+        super().write_block_range(start, data)
+        self._mark_changed(start, start + len(data) // C.BLOCK_BYTES)
+
+    def write_block_vectors(self, start: int, buffers: list) -> None:
+        super().write_block_vectors(start, buffers)
+        self._mark_changed(start, start + sum(len(buffer) for buffer in buffers) // C.BLOCK_BYTES)
+
+    def flush(self) -> None:
+        super().flush()
+        if self.bitmap_dirty:
+            _save_bitmap(self.path_to_image, self.changed, self.sequence, False)
+            self.bitmap_dirty = False
+
+    def close(self) -> None:
+        if not self.readonly:
+            self.flush()
+            # 数据落盘之后才能标记为正常关闭
+            os.fsync(self.fd)
+            _save_bitmap(self.path_to_image, self.changed, self.sequence, True, fsync=True)
+        super().close()
+
+
+class CachedTrackedBlockDevice(CachedBlockDevice, TrackedBlockDevice):
+    pass
+
+
+class ClusteredTrackedBlockDevice(ClusteredBlockDevice, TrackedBlockDevice):
+    pass
+
+
+def _changed_runs(changed: Bitmap):
+    data = changed.data
+    start = data.find(1)
+    while start != -1:
+        end = data.find(0, start)
+        end = len(data) if end == -1 else end
+        yield start, end
+        start = data.find(1, end)
+
+
+def emit_delta(image_path: str, delta_path: str) -> tuple[int, int]:
+    """
+    把自上一个增量以来改过的块写成一个增量文件，然后清空位图，返回(序号, 块数)。
+    镜像不能处于挂载状态。增量文件完全落盘之后才会清空位图，中途失败的话下次还会包含这些块
+    """
+    from block_device import open_device
+
+    changed, sequence, clean = _load_bitmap(image_path)
+    if not clean:
+        raise OSError(errno.EBUSY, f"{image_path} is mounted or was not unmounted cleanly, mount and unmount it first")
+    batch = C.COPY_BATCH_BYTES // C.BLOCK_BYTES
+    count = 0
+    # 镜像可能是一个克隆，要通过块设备来读
+    device = open_device(image_path, readonly=True)
+    try:
+        with open(delta_path, "wb") as f:
+            f.write(_DELTA_HEADER.pack(C.DELTA_MAGIC, len(changed), sequence, changed.count_free() == 0))
+            for start, end in _changed_runs(changed):
+                f.write(_RUN.pack(start, end - start))
+                for chunk in range(start, end, batch):
+                    f.write(device.read_block_range(chunk, min(chunk + batch, end)))
+                count += end - start
+            f.flush()
+            os.fsync(f.fileno())
+    finally:
+        device.close()
+    _save_bitmap(image_path, Bitmap(len(changed)), sequence + 1, True, fsync=True)
+    return sequence, count
+
+
+def applied_path(image_path: str) -> str:
+    return image_path + C.APPLIED_SUFFIX
+
+
+def _load_applied(image_path: str) -> int | None:
+    """
+    返回最后一次应用到image_path上的增量序号，没有记录时返回None
+    """
+    try:
+        with open(applied_path(image_path), "rb") as f:
+            magic, sequence = _APPLIED.unpack(f.read(_APPLIED.size))
+    except (FileNotFoundError, struct.error):
+        return None
+    return sequence if magic == C.APPLIED_MAGIC else None
+
+
+def _save_applied(image_path: str, sequence: int) -> None:
+    path = applied_path(image_path)
+    with open(path + ".tmp", "wb") as f:
+        f.write(_APPLIED.pack(C.APPLIED_MAGIC, sequence))
+        os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+
+
+def apply_deltas(image_path: str, delta_paths: list[str]) -> int:
+    """
+    按顺序把一串增量写到image_path上，返回写入的块数。
+    镜像旁边记着最后应用的序号，增量必须从它接着往下连续编号，完整的增量不受这个限制；
+    image_path不存在时，第一个增量必须是完整的。写入之前先检查完所有增量的文件头
+    """
+    exists = os.path.exists(image_path)
+    previous = _load_applied(image_path) if exists else None
+    size = os.path.getsize(image_path) if exists else None
+    for delta_path in delta_paths:
+        with open(delta_path, "rb") as f:
+            magic, block_count, sequence, full = _DELTA_HEADER.unpack(f.read(_DELTA_HEADER.size))
+        if magic != C.DELTA_MAGIC:
+            raise ValueError(f"{delta_path} is not an incremental delta")
+        if not full:
+            if size is None:
+                raise ValueError(f"{image_path} does not exist and {delta_path} is not a full backup")
+            if previous is None:
+                raise ValueError(f"{image_path} has no record of applied deltas and {delta_path} is not a full backup")
+            if sequence != previous + 1:
+                raise ValueError(f"{delta_path} has sequence {sequence}, expected {previous + 1}")
+            if size != block_count * C.BLOCK_BYTES:
+                raise ValueError(f"{delta_path} does not match the size of {image_path}")
+        previous, size = sequence, block_count * C.BLOCK_BYTES
+
+    blocks = 0
+    for delta_path in delta_paths:
+        with open(delta_path, "rb") as f:
+            _, block_count, sequence, full = _DELTA_HEADER.unpack(f.read(_DELTA_HEADER.size))
+            with open(image_path, "r+b" if os.path.exists(image_path) else "w+b", buffering=0) as image:
+                if full:
+                    image.truncate(block_count * C.BLOCK_BYTES)
+                while header := f.read(_RUN.size):
+                    start, count = _RUN.unpack(header)
+                    batch = C.COPY_BATCH_BYTES // C.BLOCK_BYTES
+                    for chunk in range(start, start + count, batch):
+                        length = min(batch, start + count - chunk) * C.BLOCK_BYTES
+                        data = f.read(length)
+                        if len(data) != length:
+                            raise ValueError(f"{delta_path} is truncated")
+                        os.pwrite(image.fileno(), data, chunk * C.BLOCK_BYTES)
+                    blocks += count
+                os.fsync(image.fileno())
+        # 镜像落盘之后再记下序号
+        _save_applied(image_path, sequence)
+    return blocks
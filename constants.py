@@ -6,6 +6,32 @@ OUTPUT_LOG = False
 
 # LRU缓存块数
 LRU_CACHE_LENGTH = 15
+# 按簇缓存（见block_device.ClusteredBlockDevice）时，默认的簇大小和缓存的总字节数；簇大小为0表示逐块缓存
+CACHE_CLUSTER_BYTES = 0
+CLUSTER_CACHE_BYTES = 8 * 1024 * 1024
+# 只读挂载时多个线程共用的块缓存的块数（见block_device.ReadonlyCachedBlockDevice）
+READONLY_CACHE_BLOCKS = 16384
+# 缓存多少个目录的索引
+DIR_INDEX_CACHE_LENGTH = 64
+# 删除目录项之后，目录至少有这么多块、而且非空槽位的比例低于DIR_COMPACT_RATIO时，就把目录挤紧
+DIR_COMPACT_MIN_BLOCKS = 4
+DIR_COMPACT_RATIO = 0.25
+# 每个打开的文件最多攒多少字节的连续写入再写到磁盘上
+WRITE_BUFFER_BYTES = 1024 * 1024
+# 流式读取文件时每次最多读多少字节
+READ_CHUNK_BYTES = 64 * 1024
+# 流式写入文件时攒够多少字节写一次
+WRITE_CHUNK_BYTES = 256 * 1024
+# 在镜像内复制文件时每批复制多少字节
+COPY_BATCH_BYTES = 1024 * 1024
+# 导入宿主机目录时，不超过这么大的文件由线程池整个读进内存，更大的文件边读边写
+IMPORT_SMALL_FILE_BYTES = 1024 * 1024
+# 导入时读宿主机文件的线程数
+IMPORT_WORKERS = 8
+# 挂载期间后台整理碎片时，每隔多少秒整理一轮
+DEFRAG_INTERVAL = 1.0
+# 导出镜像时，每个交给子进程的任务最多包含多少字节的文件
+EXPORT_TASK_BYTES = 4 * 1024 * 1024
 
 # 扇区大小
 BLOCK_BYTES = 512
@@ -62,6 +88,28 @@ FILE_SIZE_HUGE_THRESHOLD = FILE_INDEX_HUGE_THRESHOLD * BLOCK_BYTES
 FREE_INDEX_BYTES = 4
 FREE_INDEX_BLOCK_BYTES = BLOCK_BYTES
 FREE_INDEX_PER_BLOCK = 100
+# 批量生成空闲块索引块时，每攒够多少个写一次
+FREE_INDEX_WRITE_BATCH = 1024
 
 # 用于标识具有扩充数据的superblock的磁盘的魔数
 MAGIC = b"febilly~"
+
+# 附加文件（保存在镜像旁边，用于加快下次挂载）
+SIDECAR_SUFFIX = ".sidecar"
+SIDECAR_MAGIC = b"v6sidec2"
+
+# 写时复制的克隆：克隆本身是一个与底包一样大的稀疏文件，只存被写过的块，
+# 旁边的索引文件记录底包的路径和哪些块被写过
+COW_INDEX_SUFFIX = ".cow"
+COW_MAGIC = b"v6cowix1"
+
+# 变更块跟踪：镜像旁边的位图记录自上一个增量备份以来被写过的块
+CBT_SUFFIX = ".cbt"
+CBT_MAGIC = b"v6cbtbm1"
+DELTA_MAGIC = b"v6delta1"
+# 恢复出来的镜像旁边记录最后应用的增量序号，下一次只能接着它应用
+APPLIED_SUFFIX = ".applied"
+APPLIED_MAGIC = b"v6apply1"
+
+# 以这个前缀开头的镜像路径表示内存镜像（见memory_device），不对应宿主机上的文件
+MEMORY_IMAGE_PREFIX = "mem:"
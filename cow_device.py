@@ -0,0 +1,204 @@
+import operator
+import os
+import struct
+import zlib
+
+import constants as C
+from bitmap import Bitmap
+from block_device import BlockDevice, CachedBlockDevice, ClusteredBlockDevice, ReadonlyCachedBlockDevice
+from change_tracking import TrackedBlockDevice, mark_changed
+
+# 索引文件头：魔数、块数、底包路径的长度，后面跟着底包路径和压缩过的位图（每块一个字节，非0表示写过）
+_HEADER = struct.Struct("<8sQH")
+
+
+def index_path(clone_path: str) -> str:
+    return clone_path + C.COW_INDEX_SUFFIX
+
+
+def is_clone(path: str) -> bool:
+    return os.path.exists(index_path(path))
+
+
+def _save_index(clone_path: str, base_path: str, written: Bitmap, fsync: bool = False) -> None:
+    encoded = base_path.encode()
+    data = _HEADER.pack(C.COW_MAGIC, len(written), len(encoded)) + encoded + zlib.compress(written.to_bytes())
+    # 先写临时文件再改名，避免留下写了一半的索引
+    path = index_path(clone_path)
+    with open(path + ".tmp", "wb") as f:
+        f.write(data)
+        if fsync:
+            os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+
+
+def _load_index(clone_path: str) -> tuple[str, Bitmap]:
+    with open(index_path(clone_path), "rb") as f:
+        data = f.read()
+    magic, block_count, length = _HEADER.unpack_from(data, 0)
+    if magic != C.COW_MAGIC:
+        raise ValueError(f"{index_path(clone_path)} is not a copy-on-write index")
+    base_path = data[_HEADER.size : _HEADER.size + length].decode()
+    written = Bitmap(block_count, zlib.decompress(data[_HEADER.size + length:]))
+    return base_path, written
+
+
+def _base_of(clone_path: str, base_path: str) -> str:
+    # 索引里记的底包路径是相对于克隆所在目录的
+    return os.path.join(os.path.dirname(os.path.abspath(clone_path)), base_path)
+
+
+def create_clone(base_path: str, clone_path: str) -> None:
+    """
+    创建一个写时复制的克隆：一个与底包一样大的空稀疏文件加上一个空的索引，不复制底包的任何数据。
+    克隆存在期间底包不能再被修改（commit除外，见commit_clone）
+    """
+    if os.path.exists(clone_path):
+        raise FileExistsError(f"{clone_path} already exists")
+    if is_clone(base_path):
+        raise ValueError(f"{base_path} is itself a clone, commit it or clone its base instead")
+    size = os.path.getsize(base_path)
+    assert size % C.BLOCK_BYTES == 0
+    with open(clone_path, "wb") as f:
+        f.truncate(size)
+    relative = os.path.relpath(os.path.abspath(base_path), os.path.dirname(os.path.abspath(clone_path)))
+    _save_index(clone_path, relative, Bitmap(size // C.BLOCK_BYTES))
+
+
+def _written_runs(written: Bitmap, start: int, end: int):
+    """
+    把[start, end)分成若干段，返回(起点, 终点, 是否写过)
+    """
+    data = written.data
+    while start < end:
+        dirty = data[start] != 0
+        stop = data.find(0 if dirty else 1, start, end)
+        stop = end if stop == -1 else stop
+        yield start, stop, dirty
+        start = stop
+
+
+def commit_clone(clone_path: str) -> int:
+    """
+    把克隆里写过的块合并回底包，然后清空克隆（克隆仍然可以继续使用），返回合并的块数。
+    同一个底包的其它克隆会看到底包被改动，所以合并之前要确认它们已经不再需要了
+    """
+    relative, written = _load_index(clone_path)
+    base_path = _base_of(clone_path, relative)
+    merged = 0
+    runs = [(start, end) for start, end, dirty in _written_runs(written, 0, len(written)) if dirty]
+    # 底包在跟踪变更块的话，先记下来再改，中途崩溃也不会漏掉
+    mark_changed(base_path, runs)
+    with open(clone_path, "rb", buffering=0) as delta, open(base_path, "r+b", buffering=0) as base:
+        for start, end in runs:
+            for chunk in range(start, end, C.COPY_BATCH_BYTES // C.BLOCK_BYTES):
+                stop = min(chunk + C.COPY_BATCH_BYTES // C.BLOCK_BYTES, end)
+                data = os.pread(delta.fileno(), (stop - chunk) * C.BLOCK_BYTES, chunk * C.BLOCK_BYTES)
+                os.pwrite(base.fileno(), data, chunk * C.BLOCK_BYTES)
+            merged += end - start
+        os.fsync(base.fileno())
+    # 底包落盘之后才清空克隆，中途崩溃的话再commit一次就行
+    _save_index(clone_path, relative, Bitmap(len(written)), fsync=True)
+    with open(clone_path, "r+b") as f:
+        size = os.path.getsize(clone_path)
+        f.truncate(0)
+        f.truncate(size)
+    return merged
+
+
+class CowBlockDevice(BlockDevice):
+    """
+    写时复制的块设备：读的时候，写过的块从克隆里读，没写过的从只读打开的底包里读；
+    写入总是写到克隆里，并在索引里记下来。
+    索引在flush时写回，写回之前先等克隆里的数据落盘，所以索引里记着的块一定已经在克隆里了
+    """
+    def __init__(self, path_to_image: str, readonly: bool = False, discard: bool = False):
+        # 找洞的时候就要用到索引，所以先读索引
+        relative, self.written = _load_index(path_to_image)
+        super().__init__(path_to_image, readonly, discard)
+        self.base_relative = relative
+        self.base_path = _base_of(path_to_image, relative)
+        self.base_file = open(self.base_path, "rb", buffering=0)
+        self.base_fd = self.base_file.fileno()
+        if os.path.getsize(self.base_path) != self.image_size or len(self.written) != self.block_count:
+            raise ValueError(f"{path_to_image} does not match its base image {self.base_path}")
+        self.index_dirty = False
+
+    def read_block(self, block_number: int) -> bytes:
+        fd = self.fd if self.written.data[block_number] else self.base_fd
+        return os.pread(fd, C.BLOCK_BYTES, block_number * C.BLOCK_BYTES)
+
+    def read_block_range(self, start: int, end: int) -> bytes:
+        parts = [os.pread(self.fd if dirty else self.base_fd, (stop - first) * C.BLOCK_BYTES, first * C.BLOCK_BYTES)
+                 for first, stop, dirty in _written_runs(self.written, start, end)]
+        return parts[0] if len(parts) == 1 else b"".join(parts)
+
+    def _scan_holes(self) -> bytearray:
+        # 没写过的块要从底包里读，克隆里的洞只有在写过的块上才表示全是0
+        return bytearray(map(operator.and_, super()._scan_holes(), self.written.data))
+
+    def _punch(self, start: int, end: int) -> bool:
+        # 打过洞的块要从克隆里读，才能读到0
+        if not super()._punch(start, end):
+            return False
+        self._mark_written(start, end)
+        return True
+
+    def _mark_written(self, start: int, end: int) -> None:
+        self.written.data[start:end] = b"\x01" * (end - start)
+        self.index_dirty = True
+
+    def write_block(self, block_number: int, data: bytes) -> None:
+        super().write_block(block_number, data)
+        self._mark_written(block_number, block_number + 1)
+
+    def write_block_range(self, start: int, data: bytes) -> None:
+        super().write_block_range(start, data)
+        self._mark_written(start, start + len(data) // C.BLOCK_BYTES)
+
+    def write_block_vectors(self, start: int, buffers: list) -> None:
+        super().write_block_vectors(start, buffers)
+        self._mark_written(start, start + sum(len(buffer) for buffer in buffers) // C.BLOCK_BYTES)
+
+    def flush(self) -> None:
+        super().flush()
+        if self.index_dirty:
+            os.fsync(self.fd)
+            _save_index(self.path_to_image, self.base_relative, self.written, fsync=True)
+            self.index_dirty = False
+
+    def sync(self) -> None:
+        self.flush()
+        super().sync()
+
+    def close(self) -> None:
+        if not self.readonly:
+            self.flush()
+        self.base_file.close()
+        super().close()
+
+
+class CachedCowBlockDevice(CachedBlockDevice, CowBlockDevice):
+    """
+    带缓存的写时复制块设备：CachedBlockDevice里通过super()做的读写都落到CowBlockDevice上
+    """
+    pass
+
+
+class CachedTrackedCowBlockDevice(CachedBlockDevice, TrackedBlockDevice, CowBlockDevice):
+    """
+    同时跟踪变更块的克隆：变更块位图记录的是克隆里写过的块
+    """
+    pass
+
+
+class ClusteredCowBlockDevice(ClusteredBlockDevice, CowBlockDevice):
+    pass
+
+
+class ClusteredTrackedCowBlockDevice(ClusteredBlockDevice, TrackedBlockDevice, CowBlockDevice):
+    pass
+
+
+class ReadonlyCowBlockDevice(ReadonlyCachedBlockDevice, CowBlockDevice):
+    pass
@@ -0,0 +1,232 @@
+import struct
+import time
+from dataclasses import dataclass
+from math import ceil
+
+import constants as C
+import disk_params as DiskParams
+from disk import Disk
+from inode import Inode, index_block_count
+
+_INDEX_BLOCK = struct.Struct(f"<{C.FILE_INDEX_PER_BLOCK}I")
+
+
+@dataclass
+class DefragStats:
+    files: int = 0
+    blocks: int = 0
+    before: float = 0.0
+    after: float = 0.0
+    seconds: float = 0.0
+
+
+def _breaks(blocks) -> int:
+    # 相邻的两个块不连续的次数
+    return sum(1 for i in range(1, len(blocks)) if blocks[i] != blocks[i - 1] + 1)
+
+
+class Defragmenter:
+    """
+    把文件的数据块和索引块搬到连续的一段空闲块里，数据块按文件内的顺序从小到大排列。
+    每一轮（step）：
+    1. 从上一轮停下的inode接着往后找要搬的文件，为它们从空闲链表里拿出连续的目标段；
+    2. 把数据和新的索引块写到目标段，连同拿掉了目标段的空闲链表一起落盘之后再改写inode（这是唯一的切换点）；
+    3. inode落盘之后把旧的块放回空闲链表。
+    每一轮的代价只与搬的块数有关，与镜像大小无关；全部整理完的那一轮再按块号重建整条空闲链表。
+    任何一步崩溃，最坏也只是漏掉一些块（fsck会报告为leaked），不会丢数据
+    """
+    def __init__(self, disk: Disk):
+        self.disk = disk
+        self.accessor = disk.object_accessor
+        self.superblock = disk.superblock
+        # 已经是连续的或者已经搬过的inode，之后不用再看
+        self.done: set[int] = set()
+        self.moved_files = 0
+        # 下一轮从这个inode开始找
+        self.cursor = 0
+        self.finished = False
+
+    def _inodes(self):
+        inode_map = self.superblock.inode_map
+        for ino in range(DiskParams.INODE_COUNT):
+            if ino == C.INODE_ROOT_NO or not inode_map.is_free(ino):
+                yield self.disk.load_inode(ino)
+
+    def fragmentation(self) -> float:
+        """
+        碎片化程度：所有文件里相邻两个数据块不连续的比例，0表示每个文件都是连续的
+        """
+        breaks = pairs = 0
+        for inode in self._inodes():
+            blocks = inode.block_map()
+            breaks += _breaks(blocks)
+            pairs += max(len(blocks) - 1, 0)
+        return breaks / pairs if pairs else 0.0
+
+    def _index_blocks(self, inode: Inode) -> list[int]:
+        """
+        按Inode._block_list的规则找出文件现在用到的所有索引块
+        """
+        remaining = inode.block_count - C.FILE_INDEX_SMALL_THRESHOLD
+        d_addr = inode.data.d_addr
+        blocks = []
+        for k in range(C.INODE_SMALL_THRESHOLD, C.INODE_LARGE_THRESHOLD):
+            if remaining <= 0:
+                return blocks
+            blocks.append(d_addr[k])
+            remaining -= C.FILE_INDEX_PER_BLOCK
+        for k in range(C.INODE_LARGE_THRESHOLD, C.INODE_HUGE_THRESHOLD):
+            if remaining <= 0:
+                return blocks
+            blocks.append(d_addr[k])
+            seconds = _INDEX_BLOCK.unpack(self.accessor.read_raw_block(d_addr[k]))
+            count = min(ceil(remaining / C.FILE_INDEX_PER_BLOCK), C.FILE_INDEX_PER_BLOCK)
+            blocks += seconds[:count]
+            remaining -= count * C.FILE_INDEX_PER_BLOCK
+        return blocks
+
+    @staticmethod
+    def _layout(data_blocks: range, index_blocks: range) -> tuple[list[int], list[tuple[int, bytes]]]:
+        """
+        计算把数据块放到data_blocks、索引块放到index_blocks时的d_addr和各个索引块的内容
+        """
+        def pack(entries) -> bytes:
+            return _INDEX_BLOCK.pack(*entries, *[0] * (C.FILE_INDEX_PER_BLOCK - len(entries)))
+
+        d_addr = [0] * C.INODE_DIRECTORY_ENTRY_COUNT
+        d_addr[:min(len(data_blocks), C.INODE_SMALL_THRESHOLD)] = data_blocks[:C.INODE_SMALL_THRESHOLD]
+        rest = data_blocks[C.INODE_SMALL_THRESHOLD:]
+        free_index = iter(index_blocks)
+        written = []
+        for k in range(C.INODE_SMALL_THRESHOLD, C.INODE_LARGE_THRESHOLD):
+            if not rest:
+                break
+            d_addr[k] = next(free_index)
+            written.append((d_addr[k], pack(rest[:C.FILE_INDEX_PER_BLOCK])))
+            rest = rest[C.FILE_INDEX_PER_BLOCK:]
+        for k in range(C.INODE_LARGE_THRESHOLD, C.INODE_HUGE_THRESHOLD):
+            if not rest:
+                break
+            d_addr[k] = next(free_index)
+            seconds = []
+            while rest and len(seconds) < C.FILE_INDEX_PER_BLOCK:
+                seconds.append(next(free_index))
+                written.append((seconds[-1], pack(rest[:C.FILE_INDEX_PER_BLOCK])))
+                rest = rest[C.FILE_INDEX_PER_BLOCK:]
+            written.append((d_addr[k], pack(seconds)))
+        return d_addr, written
+
+    def _copy(self, blocks, target: int) -> None:
+        # 块号连续的一段一次读进来，攒够COPY_BATCH_BYTES就用pwritev写到目标段
+        batch = C.COPY_BATCH_BYTES // C.BLOCK_BYTES
+        for start in range(0, len(blocks), batch):
+            chunk = blocks[start : start + batch]
+            buffers = []
+            i = 0
+            while i < len(chunk):
+                j = i + 1
+                while j < len(chunk) and chunk[j] == chunk[j - 1] + 1:
+                    j += 1
+                buffers.append(self.accessor.read_raw_block_range(chunk[i], chunk[j - 1] + 1))
+                i = j
+            self.accessor.write_raw_vectors(target + start, buffers)
+
+    def _candidates(self):
+        """
+        从cursor开始依次给出还需要看的inode，走到末尾后从头再来一遍，
+        如果这一遍是从0开始的就到此为止
+        """
+        inode_map = self.superblock.inode_map
+        start = self.cursor
+        while True:
+            for ino in range(self.cursor, DiskParams.INODE_COUNT):
+                self.cursor = ino
+                if ino in self.done or ino in self.disk.open_inodes:
+                    continue
+                if ino == C.INODE_ROOT_NO or not inode_map.is_free(ino):
+                    yield self.disk.load_inode(ino)
+            self.cursor = 0
+            if start == 0:
+                return
+            start = 0
+
+    def _release(self, blocks: list[int]) -> None:
+        # 块号连续的一段一起放回空闲链表
+        blocks = sorted(blocks)
+        i = 0
+        while i < len(blocks):
+            j = i + 1
+            while j < len(blocks) and blocks[j] == blocks[j - 1] + 1:
+                j += 1
+            self.superblock.release_block_range(blocks[i], blocks[j - 1] + 1)
+            i = j
+
+    def step(self, budget: int = -1) -> int:
+        """
+        整理一轮，最多搬budget个块（不过至少会搬一个文件），budget<0表示不限。
+        返回这一轮搬了多少个块，0表示已经没有可以整理的文件了
+        """
+        moves: list[tuple[Inode, list[int], list[int], int]] = []
+        total = 0
+        for inode in self._candidates():
+            data_blocks = list(inode.block_map())
+            if not _breaks(data_blocks):
+                self.done.add(inode.index)
+                continue
+            need = len(data_blocks) + index_block_count(len(data_blocks))
+            if budget >= 0 and moves and total + need > budget:
+                break
+            start = self.superblock.take_run(need)
+            if start == -1:
+                continue
+            moves.append((inode, data_blocks, self._index_blocks(inode), start))
+            total += need
+            # 这个inode已经搬了，下一轮从它后面开始
+            self.done.add(inode.index)
+        if not moves:
+            if not self.finished:
+                # 全部整理完了，按块号重建空闲链表，之后的分配也尽量连续
+                self.finished = True
+                self.superblock.rebuild_free_list(self.superblock.block_map)
+                self.superblock.flush()
+                self.disk.sync()
+            return 0
+        self.finished = False
+
+        # 数据、新的索引块和拿掉了目标段的空闲链表都落盘之后，才改写inode
+        layouts = []
+        for inode, data_blocks, _, start in moves:
+            index_count = index_block_count(len(data_blocks))
+            data_start = start + index_count
+            d_addr, written = self._layout(range(data_start, data_start + len(data_blocks)), range(start, data_start))
+            self._copy(data_blocks, data_start)
+            self.accessor.write_raw_blocks(written)
+            layouts.append(d_addr)
+        self.superblock.flush()
+        self.disk.sync()
+        for (inode, data_blocks, index_blocks, _), d_addr in zip(moves, layouts):
+            inode.data.d_addr = d_addr
+            inode.flush()
+            self.disk.forget_inode(inode.index)
+            self.moved_files += 1
+        self.disk.sync()
+
+        # 最后把旧的块放回空闲链表
+        for _, data_blocks, index_blocks, _ in moves:
+            self._release(data_blocks + index_blocks)
+        self.superblock.flush()
+        return total
+
+    def run(self) -> DefragStats:
+        """
+        离线整理整个镜像，直到没有可以整理的文件为止
+        """
+        stats = DefragStats()
+        start = time.perf_counter()
+        stats.before = self.fragmentation()
+        while moved := self.step():
+            stats.blocks += moved
+        stats.files = self.moved_files
+        stats.after = self.fragmentation()
+        stats.seconds = time.perf_counter() - start
+        return stats
@@ -1,7 +1,10 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING
 import constants as C
-from construct import Container
 from object_accessor import ObjectAccessor
-from structures import DirectoryBlockStruct
+import structures as S
+if TYPE_CHECKING:
+    from construct import Container
 
 class DirBlock:
     def __init__(self, dir_block_index: int, dirs: list[Container], object_accessor: ObjectAccessor):
@@ -15,14 +18,13 @@ class DirBlock:
         """
         通过块号构造索引对象
         """
-        # dirs: list[Container] = object_accessor.dir_blocks[index]._obj
-        dirs: list[Container] = object_accessor.dir_blocks[index]
+        dirs: list[Container] = object_accessor.dir_blocks.get(index)
         return cls(index, dirs, object_accessor)
 
     @classmethod
     def new(cls, index: int, object_accessor: ObjectAccessor):
         data = b"\x00" * C.DATA_BLOCK_BYTES
-        dirs = DirectoryBlockStruct.parse(data)
+        dirs = S.DirectoryBlockStruct.parse(data)
         return cls(index, dirs, object_accessor)
 
     def __getitem__(self, index: int) -> Container:
@@ -36,7 +38,7 @@ class DirBlock:
         return iter(self.dirs)
 
     def flush(self) -> None:
-        self.object_accessor.dir_blocks[self.dir_block_index] = self.dirs
+        self.object_accessor.dir_blocks.set(self.dir_block_index, self.dirs)
     
     def __contains__(self, item: str) -> bool:
         return any([dir.m_name == item for dir in self.dirs])
@@ -62,10 +64,17 @@ class DirBlock:
     def is_full(self) -> bool:
         return all([dir.m_ino != 0 for dir in self.dirs])
     
+    def put(self, index: int, ino: int, name: str) -> None:
+        """
+        直接写入指定槽位的目录项
+        """
+        self.dirs[index] = S.Container(m_ino=ino, m_name=name)
+        self.flush()
+
     def add(self, ino: int, name: str) -> bool:
         for index, dir in enumerate(self.dirs):
             if dir.m_ino == 0:
-                self.dirs[index] = Container(m_ino=ino, m_name=name)
+                self.dirs[index] = S.Container(m_ino=ino, m_name=name)
                 self.flush()
                 return True
         return False
@@ -74,7 +83,7 @@ class DirBlock:
         index = self.index(name)
         if index == -1:
             return False
-        self.dirs[index] = Container(m_ino=0, m_name="")
+        self.dirs[index] = S.Container(m_ino=0, m_name="")
         self.flush()
         return True
     
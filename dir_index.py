@@ -0,0 +1,124 @@
+import heapq
+import constants as C
+
+
+class DirIndex:
+    """
+    一个目录的内存索引，这样查找、添加、删除目录项时就不用每次都把目录块全部读一遍
+    记录了目录的各个数据块、每个文件名所在的位置，以及所有的空槽位
+    位置用(块在目录中的序号, 块内的槽位)表示
+    """
+    def __init__(self, ino: int, blocks: list[int]):
+        self.ino = ino
+        self.blocks = blocks
+        # 文件名 -> (inode号, 块序号, 槽位)
+        self.entries: dict[str, tuple[int, int, int]] = {}
+        # 每个块里的有效目录项数
+        self.live = [0] * len(blocks)
+        # 空槽位，小根堆，保证总是先用最靠前的空位（与逐块扫描的结果一致）
+        self.free: list[tuple[int, int]] = []
+        # 被前面的同名目录项遮住的目录项，查不到，但仍然占着槽位
+        self.shadowed: list[tuple[int, int, int, str]] = []
+
+    @classmethod
+    def build(cls, ino: int, blocks: list[int], slots: list[tuple[int, int, int, str]]):
+        """
+        slots是所有非空的目录项：(块序号, 槽位, inode号, 文件名)，需要按位置排好序
+        """
+        index = cls(ino, blocks)
+        used = set()
+        for position, slot, m_ino, name in slots:
+            used.add((position, slot))
+            index.live[position] += 1
+            # 如果有重名的，以最靠前的为准（与逐块扫描的结果一致）
+            if name in index.entries:
+                index.shadowed.append((position, slot, m_ino, name))
+            else:
+                index.entries[name] = (m_ino, position, slot)
+        index.free = [(position, slot)
+                      for position in range(len(blocks))
+                      for slot in range(C.DIRECTORY_PER_BLOCK)
+                      if (position, slot) not in used]
+        heapq.heapify(index.free)
+        return index
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.entries
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def lookup(self, name: str) -> int:
+        """
+        返回文件名对应的inode号，没有则返回-1
+        """
+        entry = self.entries.get(name)
+        return entry[0] if entry is not None else -1
+
+    def position(self, name: str) -> tuple[int, int]:
+        _, position, slot = self.entries[name]
+        return position, slot
+
+    def add(self, name: str, ino: int) -> tuple[int, int] | None:
+        """
+        占用最靠前的空槽位，返回其位置；没有空位时返回None
+        """
+        if not self.free:
+            return None
+        position, slot = heapq.heappop(self.free)
+        self.entries[name] = (ino, position, slot)
+        self.live[position] += 1
+        return position, slot
+
+    def add_block(self, block_index: int) -> None:
+        position = len(self.blocks)
+        self.blocks.append(block_index)
+        self.live.append(0)
+        for slot in range(C.DIRECTORY_PER_BLOCK):
+            heapq.heappush(self.free, (position, slot))
+
+    def replace(self, name: str, ino: int) -> tuple[int, int]:
+        """
+        让已有的目录项指向另一个inode，返回它的位置
+        """
+        _, position, slot = self.entries[name]
+        self.entries[name] = (ino, position, slot)
+        return position, slot
+
+    def remove(self, name: str) -> tuple[int, int]:
+        """
+        删除一个目录项，返回它原来的位置
+        """
+        _, position, slot = self.entries.pop(name)
+        self.live[position] -= 1
+        heapq.heappush(self.free, (position, slot))
+        return position, slot
+
+    def names(self) -> list[str]:
+        """
+        按目录项在磁盘上的顺序返回所有文件名
+        """
+        return sorted(self.entries, key=lambda name: self.entries[name][1:])
+
+    def slots(self) -> list[tuple[int, int, int, str]]:
+        """
+        按位置排好序的所有非空目录项，包括被遮住的：(块序号, 槽位, inode号, 文件名)
+        """
+        slots = [(position, slot, ino, name) for name, (ino, position, slot) in self.entries.items()]
+        return sorted(slots + self.shadowed)
+
+    def usage(self) -> float:
+        """
+        非空的槽位占全部槽位的比例，没有目录块时为1
+        """
+        if not self.blocks:
+            return 1.0
+        return sum(self.live) / (len(self.blocks) * C.DIRECTORY_PER_BLOCK)
+
+    def dump(self) -> dict:
+        return {"ino": self.ino, "blocks": self.blocks, "slots": self.slots()}
+
+    @classmethod
+    def load(cls, data: dict):
+        slots = [tuple(slot) for slot in data["slots"]]
+        return cls.build(data["ino"], list(data["blocks"]), slots)
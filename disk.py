@@ -1,18 +1,28 @@
-from block_device import CachedBlockDevice
+from block_device import LRUCache, open_device
 import constants as C
 import disk_params as DiskParams
 from object_accessor import ObjectAccessor
-from superblock import Superblock
+from superblock import Superblock, SuperblockData
 from inode import Inode, FILE_TYPE
 import os
 from dir_block import DirBlock
+from dir_index import DirIndex
 from math import ceil
-from utils import get_disk_start, get_disk_params, debug_print
-from format_disk import format_disk
+from utils import get_disk_start, debug_print
+from sidecar import load_sidecar, save_sidecar
+from file_writer import FileWriter
 from dataclasses import dataclass
+from typing import Iterator
+from contextlib import contextmanager
 import os, errno
 import stat
 import time
+import json
+import struct
+import structures as S
+
+# 目录项的二进制格式，与structures.DirectoryStruct一致
+_DIR_ENTRY = struct.Struct(f"<I{C.DIRECTORY_NAME_MAX_LENGTH + 1}s")
 
 @dataclass
 class DiskStats:
@@ -50,8 +60,21 @@ class FileStats():
         return f"FileStats(st_mode={self.st_mode}, st_ino={self.st_ino}, st_dev={self.st_dev}, st_nlink={self.st_nlink}, st_uid={self.st_uid}, st_gid={self.st_gid}, st_size={self.st_size}, st_atime={self.st_atime}, st_mtime={self.st_mtime}, st_ctime={self.st_ctime})"
 
 class Disk:
-    def __init__(self, path: str):
+    def __init__(self, path: str, sidecar: bool = False, readonly: bool = False, discard: bool = False,
+                 cluster_bytes: int = C.CACHE_CLUSTER_BYTES):
+        """
+        sidecar: 是否在卸载时把inode分配情况、空闲盘块位图、常用目录的索引等信息
+        保存到镜像旁边的附加文件里，下次挂载时就不用重新扫描了
+        readonly: 只读挂载，不会对镜像和附加文件做任何修改，所有写操作都会抛出EROFS
+        discard: 被释放的块在镜像文件里打洞，镜像在宿主机上占的空间随实际数据增减
+        cluster_bytes: 不为0时块设备按这么大的簇缓存，见block_device.ClusteredBlockDevice
+        """
         self.path = path
+        # 内存镜像没有对应的文件，也就没有附加文件
+        self.sidecar = sidecar and not readonly and not path.startswith(C.MEMORY_IMAGE_PREFIX)
+        self.readonly = readonly
+        self.discard = discard and not readonly
+        self.cluster_bytes = cluster_bytes
         self.mounted = False
     
     def get_stats(self) -> DiskStats:
@@ -60,59 +83,132 @@ class Disk:
             f_bsize=C.BLOCK_BYTES,
             f_frsize=C.BLOCK_BYTES,
             f_blocks=DiskParams.DISK_BLOCKS,
-            f_bfree=self.superblock.data.bfree,
-            f_bavail=self.superblock.data.bfree,
+            f_bfree=self.superblock.bfree,
+            f_bavail=self.superblock.bfree,
             f_files=DiskParams.INODE_COUNT,
-            f_ffree=self.superblock.data.ffree,
-            f_favail=self.superblock.data.ffree,
+            f_ffree=self.superblock.ffree,
+            f_favail=self.superblock.ffree,
             f_flag=os.ST_NOSUID,
             f_namemax=27
         )
     
     @classmethod
-    def new(cls, path: str):
-        debug_print(f"Disk.new({path})")
-        format_disk(path, init_params=True)
+    def new(cls, path: str, inode_blocks: int = 4096, disk_blocks: int = 65536):
+        debug_print(f"Disk.new({path}, {inode_blocks}, {disk_blocks})")
+        from format_disk import format_disk  # 只有格式化时才用得到
+        format_disk(path, init_params=True, inode_blocks=inode_blocks, disk_blocks=disk_blocks)
         disk = cls(path)
         return disk
     
     def mount(self):
         debug_print(f"Disk.mount()")
-        print('加载磁盘中...')
         if self.mounted:
             return
         
-        self.block_device = CachedBlockDevice(self.path)
+        self.block_device = open_device(self.path, self.readonly, self.discard, self.cluster_bytes)
         
         boot_block = self.block_device.read_block(0)
         disk_start = get_disk_start(boot_block)
         
-        superblock_bytes = self.block_device.read_block_range(disk_start, disk_start + 2)
-        inode_block_size, disk_block_size = get_disk_params(superblock_bytes)
+        superblock_bytes = self.block_device.read_block_range(disk_start, disk_start + C.SUPERBLOCK_BLOCKS)
+        superblock_data = SuperblockData.unpack(superblock_bytes)
         
-        DiskParams.init_constants(disk_start, inode_block_size, disk_block_size)
+        DiskParams.init_constants(disk_start, superblock_data.s_isize, superblock_data.s_fsize)
         
         self.object_accessor = ObjectAccessor(self.block_device)
-        self.superblock = Superblock(self.object_accessor.superblock, self.object_accessor, new=False)
-        self.root_inode = Inode.from_index(C.INODE_ROOT_NO, self.object_accessor, self.superblock)
+        sections = load_sidecar(self.path, superblock_data.hash) if self.sidecar else None
+        sections = sections or {}
+        self.superblock = Superblock(superblock_data, self.object_accessor, new=False,
+                                     inode_map=sections.get("inode_map"),
+                                     block_map=sections.get("block_map"))
+        # 根目录的inode在第一次用到时才读取
+        self._root_inode = None
+        
+        # 目录索引的缓存：目录的inode号 -> DirIndex
+        self.dir_cache = LRUCache[DirIndex](C.DIR_INDEX_CACHE_LENGTH)
+        if "dirs" in sections:
+            for data in json.loads(sections["dirs"]):
+                self.dir_cache.put(data["ino"], DirIndex.load(data))
+        
+        # 被打开的文件的inode：inode号 -> (Inode对象, 打开次数)
+        # 打开期间所有操作都共用同一个Inode对象，它缓存的块号列表也就一直有效
+        self.open_inodes: dict[int, tuple[Inode, int]] = {}
         
         self.mounted = True
-        print('磁盘挂载成功')
+        debug_print("磁盘挂载成功")
+
+    @property
+    def root_inode(self) -> Inode:
+        if self._root_inode is None:
+            self._root_inode = Inode.from_index(C.INODE_ROOT_NO, self.object_accessor, self.superblock)
+        return self._root_inode
         
     def flush(self):
         debug_print(f"Disk.flush()")
+        if self.readonly:
+            return
         self.superblock.flush()
-        self.root_inode.flush()
+        if self._root_inode is not None:
+            self._root_inode.flush()
         self.block_device.flush()
     
+    def sync(self):
+        """
+        写回并等待落盘
+        """
+        self.flush()
+        if not self.readonly:
+            self.block_device.sync()
+
+    def forget_inode(self, inode_no: int) -> None:
+        """
+        inode的块被搬走之后（比如整理碎片），丢掉与它有关的缓存：目录索引、根目录的Inode对象
+        打开着的inode不能这样搬，调用者需要自己保证
+        """
+        self.dir_cache.pop(inode_no)
+        if inode_no == C.INODE_ROOT_NO:
+            self._root_inode = None
+
+    @contextmanager
+    def batch(self):
+        """
+        with disk.batch(): 里面的操作不再逐个写回元数据，
+        每个被改过的inode块、目录块、索引块在最外层的batch结束时只写一次，超级块也只写一次
+        batch中途出错时，已经做完的修改照样写回
+        """
+        with self.object_accessor.batch():
+            yield
+        if not self.object_accessor.batch_depth:
+            self.superblock.flush()
+
     def unmount(self):
         debug_print(f"Disk.unmount()")
         if not self.mounted:
             return
+        # 还开着的文件视为被关闭，已经被删除的文件在这里真正释放
+        for inode, _ in list(self.open_inodes.values()):
+            if inode.data.d_nlink == 0 and not self.readonly:
+                self._free_inode(inode)
+        self.open_inodes.clear()
         self.flush()
         self.block_device.close()
+        if self.sidecar:
+            self._save_sidecar()
         self.mounted = False
 
+    def _save_sidecar(self) -> None:
+        sections = {}
+        inode_map = self.superblock.export_inode_map()
+        if inode_map is not None:
+            sections["inode_map"] = inode_map
+        block_map = self.superblock.export_block_map()
+        if block_map is not None:
+            sections["block_map"] = block_map
+        # 按LRU的顺序保存，最近用过的在最后，恢复时的顺序也一样
+        dirs = [self.dir_cache.peek(ino).dump() for ino in self.dir_cache.keys()]
+        sections["dirs"] = json.dumps(dirs).encode()
+        save_sidecar(self.path, self.superblock.data.hash, sections)
+
     def _get_inode(self, path: str) -> Inode:
         debug_print(f"Disk._get_inode({path})")
         if path == '/':
@@ -126,14 +222,63 @@ class Disk:
         if parent.file_type != FILE_TYPE.DIR:
             raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), path)
         
-        for index in parent.block_list():
-            dir_block = DirBlock.from_index(index, self.object_accessor)
-            if name not in dir_block:
-                continue
-            inode_no = dir_block.find_inode(name)
-            return Inode.from_index(inode_no, self.object_accessor, self.superblock)
-        
-        raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), path)
+        inode_no = self._dir_index(parent).lookup(name)
+        if inode_no == -1:
+            raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), path)
+        return self._load_inode(inode_no)
+
+    def _load_inode(self, inode_no: int) -> Inode:
+        # 文件被打开着的话，就用打开时的那个Inode对象，保证大家看到的是同一份数据
+        if inode_no in self.open_inodes:
+            return self.open_inodes[inode_no][0]
+        return Inode.from_index(inode_no, self.object_accessor, self.superblock)
+
+    def open_inode(self, path: str) -> Inode:
+        """
+        打开一个文件，返回的Inode对象在close_inode之前一直有效，
+        可以直接交给read_inode、write_inode、truncate_inode使用
+        """
+        debug_print(f"Disk.open_inode({path})")
+        return self._pin_inode(self._get_inode(path))
+
+    def _pin_inode(self, inode: Inode) -> Inode:
+        _, count = self.open_inodes.get(inode.index, (inode, 0))
+        self.open_inodes[inode.index] = (inode, count + 1)
+        return inode
+
+    def close_inode(self, inode: Inode) -> None:
+        debug_print(f"Disk.close_inode({inode.index})")
+        _, count = self.open_inodes[inode.index]
+        if count > 1:
+            self.open_inodes[inode.index] = (inode, count - 1)
+            return
+        del self.open_inodes[inode.index]
+        # 文件在打开期间被删除了，最后一次关闭时才真正释放
+        if inode.data.d_nlink == 0:
+            self._free_inode(inode)
+
+    def _free_inode(self, inode: Inode) -> None:
+        # 释放inode的所有数据块
+        for _ in range(inode.block_count):
+            block = inode.pop_block()
+            self.superblock.release_block(block)
+        self.superblock.release_inode(inode.index)
+
+    def _dir_index(self, inode: Inode) -> DirIndex:
+        """
+        获取目录的索引，不在缓存里的话就把目录块全部读一遍来构造
+        """
+        if inode.index in self.dir_cache:
+            return self.dir_cache.get(inode.index)
+        blocks = list(inode.block_list())
+        slots = []
+        for position, dirs in enumerate(self.object_accessor.dir_blocks.get_many(blocks)):
+            for slot, dir in enumerate(dirs):
+                if dir.m_ino != 0:
+                    slots.append((position, slot, dir.m_ino, dir.m_name))
+        index = DirIndex.build(inode.index, blocks, slots)
+        self.dir_cache.put(inode.index, index)
+        return index
     
     def get_attr(self, path: str) -> FileStats:
         debug_print(f"Disk.get_attr({path})")
@@ -163,22 +308,24 @@ class Disk:
     
     def _add_to_dir(self, parent: Inode, name: str, inode: Inode) -> None:
         debug_print(f"Disk._add_to_dir({parent.index}, {name}, {inode.index})")
-        position = 0
+        dir_index = self._dir_index(parent)
         # 如果父inode的文件索引里面还有空位，就直接添加到空位里
-        for index in parent.block_list():
-            dir_block = DirBlock.from_index(index, self.object_accessor)
-            if dir_block.add(inode.index, name):
-                supposed_size = position + dir_block.length() * C.DIRECTORY_BYTES
-                if supposed_size > parent.size:
-                    parent.size = supposed_size
-                    parent.flush()
-                return
-            position += C.DATA_BLOCK_BYTES
+        if (found := dir_index.add(name, inode.index)) is not None:
+            position, slot = found
+            dir_block = DirBlock.from_index(dir_index.blocks[position], self.object_accessor)
+            dir_block.put(slot, inode.index, name)
+            supposed_size = position * C.DATA_BLOCK_BYTES + dir_index.live[position] * C.DIRECTORY_BYTES
+            if supposed_size > parent.size:
+                parent.size = supposed_size
+                parent.flush()
+            return
 
         # 没有空位，因此我们新建一个目录块
         new_block_index = self.superblock.allocate_block()
         dir_block = DirBlock.new(new_block_index, self.object_accessor)
         dir_block.add(inode.index, name)
+        dir_index.add_block(new_block_index)
+        dir_index.add(name, inode.index)
         
         parent.push_block(new_block_index)
         parent.size += C.DIRECTORY_BYTES
@@ -191,12 +338,26 @@ class Disk:
         if inode.file_type != FILE_TYPE.DIR:
             raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), path)
         
-        result = []
-        for index in inode.block_list():
-            dir_block = DirBlock.from_index(index, self.object_accessor)
-            result += dir_block.list()
-        
-        return result
+        return self._dir_index(inode).names()
+
+    def iter_dir(self, path: str) -> Iterator[tuple[str, Inode]]:
+        """
+        按磁盘上的顺序逐个返回目录里的(文件名, Inode)，不包括'.'和'..'
+        """
+        debug_print(f"Disk.iter_dir({path})")
+        inode = self._get_inode(path)
+        if inode.file_type != FILE_TYPE.DIR:
+            raise NotADirectoryError(errno.ENOTDIR, os.strerror(errno.ENOTDIR), path)
+        dir_index = self._dir_index(inode)
+        for name in dir_index.names():
+            if name not in ('.', '..'):
+                yield name, self._load_inode(dir_index.lookup(name))
+
+    def load_inode(self, inode_no: int) -> Inode:
+        """
+        按inode号读取inode，不用经过路径解析
+        """
+        return self._load_inode(inode_no)
     
     def exists(self, path: str) -> bool:
         debug_print(f"Disk.exists({path})")
@@ -231,21 +392,7 @@ class Disk:
     def unlink(self, path: str) -> None:
         debug_print(f"Disk.unlink({path})")
         inode = self._get_inode(path)
-        inode.data.d_nlink -= 1
-        
-        # 只有硬连接数归零了才删除文件
-        if inode.data.d_nlink == 0:
-            # 如果path是文件夹，移除所有子文件
-            if inode.file_type == FILE_TYPE.DIR:
-                for name in self.dir_list(path):
-                    self.unlink(os.path.join(path, name))
-            # 释放inode的所有数据块
-            for _ in range(inode.block_count):
-                block = inode.pop_block()
-                self.superblock.release_block(block)
-            self.superblock.release_inode(inode.index)
-        else:
-            inode.flush()
+        self._drop_link(inode)
 
         parent_path, name = os.path.split(path)
         parent = self._get_inode(parent_path)
@@ -253,12 +400,248 @@ class Disk:
         parent.flush()
         
         # 删除文件夹里对此文件的引用
-        for index in parent.block_list():
-            dir_block = DirBlock.from_index(index, self.object_accessor)
-            if name not in dir_block:
-                continue
-            dir_block.remove(name)
+        dir_index = self._dir_index(parent)
+        if name not in dir_index:
+            return
+        self._remove_entry(dir_index, name)
+        self._maybe_compact_dir(parent)
+
+    def _group_by_parent(self, paths: list[str]) -> dict[str, list[tuple[int, str]]]:
+        # 父目录路径 -> [(在paths里的序号, 文件名)]，保持第一次出现的顺序
+        groups: dict[str, list[tuple[int, str]]] = {}
+        for i, path in enumerate(paths):
+            parent_path, name = os.path.split(path)
+            groups.setdefault(parent_path, []).append((i, name))
+        return groups
+
+    def _resolve_parent(self, parent_path: str) -> Inode:
+        parent = self._get_inode(parent_path)
+        if parent.file_type != FILE_TYPE.DIR:
+            raise NotADirectoryError(errno.ENOTDIR, os.strerror(errno.ENOTDIR), parent_path)
+        return parent
+
+    def _write_dir_entries(self, dir_index: DirIndex, entries: dict[int, list[tuple[int, int, str]]],
+                           new_positions: set[int] = frozenset()) -> None:
+        """
+        entries: 块序号 -> [(槽位, inode号, 文件名)]，每个目录块只读写一次
+        new_positions里的块是刚分配的，不用读
+        """
+        blocks = []
+        for position, items in sorted(entries.items()):
+            block_index = dir_index.blocks[position]
+            if position in new_positions:
+                data = bytearray(C.DATA_BLOCK_BYTES)
+            else:
+                data = bytearray(self.object_accessor.read_raw_block(block_index))
+            for slot, ino, name in items:
+                _DIR_ENTRY.pack_into(data, slot * C.DIRECTORY_BYTES, ino, name.encode())
+            blocks.append((block_index, bytes(data)))
+        self.object_accessor.write_raw_blocks(blocks)
+
+    def create_many(self, paths: list[str], type: FILE_TYPE) -> list[int | OSError]:
+        """
+        一次创建多个文件（夹），按父目录分组，每个父目录只解析一次，
+        新的inode和目录项按块成批写入。
+        返回与paths一一对应的结果：成功时是新文件的inode号，失败时是对应的异常
+        """
+        debug_print(f"Disk.create_many({len(paths)} paths, {type})")
+        results: list[int | OSError] = [None] * len(paths)
+        # 所有新inode的内容都一样
+        template = Inode.new(0, type, self.object_accessor, self.superblock)
+        template.data.d_nlink = 1
+        template = S.InodeStruct.build(template.data)
+
+        with self.batch():
+            for parent_path, items in self._group_by_parent(paths).items():
+                try:
+                    parent = self._resolve_parent(parent_path)
+                except OSError as e:
+                    for i, _ in items:
+                        results[i] = e
+                    continue
+                dir_index = self._dir_index(parent)
+
+                # 检查文件名，同一批里重名的也算已存在
+                names = []
+                seen = set()
+                for i, name in items:
+                    if name == '':
+                        results[i] = FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), paths[i])
+                    elif len(name.encode()) > C.DIRECTORY_NAME_MAX_LENGTH:
+                        results[i] = OSError(errno.ENAMETOOLONG, os.strerror(errno.ENAMETOOLONG), paths[i])
+                    elif name in dir_index or name in seen:
+                        results[i] = FileExistsError(errno.EEXIST, os.strerror(errno.EEXIST), paths[i])
+                    else:
+                        seen.add(name)
+                        names.append((i, name))
+                if not names:
+                    continue
+
+                # 目录里的空位不够的话，一次分配所有需要的新目录块
+                missing = len(names) - len(dir_index.free)
+                new_positions = set()
+                if missing > 0:
+                    try:
+                        block_count = ceil(missing / C.DIRECTORY_PER_BLOCK)
+                        new_blocks = self.superblock.allocate_blocks(block_count, parent.new_index_blocks(block_count))
+                    except Exception:
+                        for i, _ in names:
+                            results[i] = OSError(errno.ENOSPC, os.strerror(errno.ENOSPC), paths[i])
+                        continue
+                    for block_index in new_blocks:
+                        new_positions.add(len(dir_index.blocks))
+                        dir_index.add_block(block_index)
+                    parent.push_blocks(new_blocks)
+
+                # 分配inode，填进目录的空位
+                inode_blocks: dict[int, list[int]] = {}
+                entries: dict[int, list[tuple[int, int, str]]] = {}
+                for i, name in names:
+                    try:
+                        ino = self.superblock.allocate_inode()
+                    except Exception:
+                        results[i] = OSError(errno.ENOSPC, os.strerror(errno.ENOSPC), paths[i])
+                        continue
+                    position, slot = dir_index.add(name, ino)
+                    entries.setdefault(position, []).append((slot, ino, name))
+                    inode_blocks.setdefault(DiskParams.INODE_START + ino // C.INODE_PER_BLOCK, []).append(ino)
+                    results[i] = ino
+
+                blocks = []
+                for block_index, inos in sorted(inode_blocks.items()):
+                    data = bytearray(self.object_accessor.read_raw_block(block_index))
+                    for ino in inos:
+                        offset = ino % C.INODE_PER_BLOCK * C.INODE_BYTES
+                        data[offset : offset + C.INODE_BYTES] = template
+                    blocks.append((block_index, bytes(data)))
+                self.object_accessor.write_raw_blocks(blocks)
+                self._write_dir_entries(dir_index, entries, new_positions)
+
+                for position in entries:
+                    supposed_size = position * C.DATA_BLOCK_BYTES + dir_index.live[position] * C.DIRECTORY_BYTES
+                    parent.size = max(parent.size, supposed_size)
+                parent.update_mtime()
+                parent.flush()
+        return results
+
+    def unlink_many(self, paths: list[str]) -> list[OSError | None]:
+        """
+        一次删除多个文件（夹），按父目录分组，每个父目录只解析一次，
+        每个目录块只写一次。返回与paths一一对应的结果：成功时是None，失败时是对应的异常
+        """
+        debug_print(f"Disk.unlink_many({len(paths)} paths)")
+        results: list[OSError | None] = [None] * len(paths)
+        with self.batch():
+            for parent_path, items in self._group_by_parent(paths).items():
+                try:
+                    parent = self._resolve_parent(parent_path)
+                except OSError as e:
+                    for i, _ in items:
+                        results[i] = e
+                    continue
+                dir_index = self._dir_index(parent)
+
+                entries: dict[int, list[tuple[int, int, str]]] = {}
+                for i, name in items:
+                    if name == '' or name not in dir_index:
+                        results[i] = FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), paths[i])
+                        continue
+                    self._drop_link(self._load_inode(dir_index.lookup(name)))
+                    position, slot = dir_index.remove(name)
+                    entries.setdefault(position, []).append((slot, 0, ""))
+                if not entries:
+                    continue
+
+                self._write_dir_entries(dir_index, entries)
+                parent.update_mtime()
+                parent.flush()
+                self._maybe_compact_dir(parent)
+        return results
+
+    def _drop_link(self, inode: Inode) -> None:
+        """
+        硬连接数减一，归零了就删除文件；目录的话连同里面的所有文件一起删除
+        """
+        inode.data.d_nlink -= 1
+        if inode.data.d_nlink > 0:
+            inode.flush()
             return
+        
+        # 如果是文件夹，移除所有子文件（目录块马上就要被释放，里面的目录项不用再一个个清掉）
+        if inode.file_type == FILE_TYPE.DIR:
+            dir_index = self._dir_index(inode)
+            for name in dir_index.names():
+                if name not in ('.', '..'):
+                    self._drop_link(self._load_inode(dir_index.lookup(name)))
+            self.dir_cache.pop(inode.index)
+        if inode.index in self.open_inodes:
+            # 还有人打开着，先只断开目录项，等最后一次关闭时再释放
+            inode.flush()
+        else:
+            self._free_inode(inode)
+
+    def _remove_entry(self, dir_index: DirIndex, name: str) -> None:
+        position, slot = dir_index.remove(name)
+        dir_block = DirBlock.from_index(dir_index.blocks[position], self.object_accessor)
+        dir_block.put(slot, 0, "")
+
+    def _replace_entry(self, dir_index: DirIndex, name: str, ino: int) -> None:
+        position, slot = dir_index.replace(name, ino)
+        dir_block = DirBlock.from_index(dir_index.blocks[position], self.object_accessor)
+        dir_block.put(slot, ino, name)
+
+    def compact_dir(self, inode: Inode) -> int:
+        """
+        把目录里的目录项按原来的顺序挤到最前面的几个块里，从末尾释放空出来的块，返回释放的块数。
+        目录项之间的相对顺序不变，所以'.'和'..'仍然在最前面，被遮住的重名目录项也仍然被遮住
+        """
+        dir_index = self._dir_index(inode)
+        slots = dir_index.slots()
+        keep = ceil(len(slots) / C.DIRECTORY_PER_BLOCK)
+        released = len(dir_index.blocks) - keep
+        if released <= 0:
+            return 0
+        debug_print(f"Disk.compact_dir({inode.index}): {len(dir_index.blocks)} -> {keep} blocks")
+
+        packed = [(i // C.DIRECTORY_PER_BLOCK, i % C.DIRECTORY_PER_BLOCK, ino, name)
+                  for i, (_, _, ino, name) in enumerate(slots)]
+        data = [bytearray(C.DATA_BLOCK_BYTES) for _ in range(keep)]
+        for position, slot, ino, name in packed:
+            _DIR_ENTRY.pack_into(data[position], slot * C.DIRECTORY_BYTES, ino, name.encode())
+        with self.batch():
+            # 先写好挤紧之后的块，再释放末尾的块、改d_size
+            self.object_accessor.write_raw_blocks([(dir_index.blocks[position], bytes(block))
+                                                   for position, block in enumerate(data)])
+            for _ in range(released):
+                self.superblock.release_block(inode.pop_block())
+            inode.size = len(slots) * C.DIRECTORY_BYTES
+            inode.flush()
+        self.dir_cache.put(inode.index, DirIndex.build(inode.index, dir_index.blocks[:keep], packed))
+        return released
+
+    def _maybe_compact_dir(self, inode: Inode) -> None:
+        # 删除目录项之后调用：目录够大而且大部分槽位都空着时才挤紧
+        dir_index = self._dir_index(inode)
+        if len(dir_index.blocks) >= C.DIR_COMPACT_MIN_BLOCKS and dir_index.usage() < C.DIR_COMPACT_RATIO:
+            self.compact_dir(inode)
+
+    def compact_dirs(self, path: str = '/') -> tuple[int, int]:
+        """
+        把path和它下面的所有目录都挤紧（不管空槽位有多少），返回(挤紧的目录数, 释放的块数)
+        """
+        dirs = released = 0
+        stack = [(path, self._get_inode(path))]
+        while stack:
+            dir_path, inode = stack.pop()
+            if inode.file_type != FILE_TYPE.DIR:
+                raise NotADirectoryError(errno.ENOTDIR, os.strerror(errno.ENOTDIR), dir_path)
+            if count := self.compact_dir(inode):
+                dirs += 1
+                released += count
+            for name, child in self.iter_dir(dir_path):
+                if child.file_type == FILE_TYPE.DIR:
+                    stack.append((os.path.join(dir_path, name), child))
+        return dirs, released
 
     def link(self, src: str, dst: str) -> None:
         debug_print(f"Disk.link({src}, {dst})")
@@ -270,19 +653,84 @@ class Disk:
         parent = self._get_inode(parent_path)
         
         # 添加到父文件夹里
-        parent = self._get_inode(parent_path)
         self._add_to_dir(parent, name, inode)
+        inode.data.d_nlink += 1
+        inode.flush()
 
     def rename(self, src: str, dst: str) -> None:
+        """
+        把src的目录项移动到dst，不会读写被移动的文件（夹）的内容；
+        dst已存在时直接把它的目录项改为指向src（目录只能替换空目录）
+        """
         debug_print(f"Disk.rename({src}, {dst})")
-        self.link(src, dst)
-        self.unlink(src)
+        src_parent_path, src_name = os.path.split(src)
+        dst_parent_path, dst_name = os.path.split(dst)
+        if len(dst_name) > C.DIRECTORY_NAME_MAX_LENGTH:
+            raise OSError(errno.ENAMETOOLONG, os.strerror(errno.ENAMETOOLONG), dst)
+        
+        src_parent = self._get_inode(src_parent_path)
+        src_index = self._dir_index(src_parent)
+        inode_no = src_index.lookup(src_name)
+        if inode_no == -1:
+            raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), src)
+        inode = self._load_inode(inode_no)
+        is_dir = inode.file_type == FILE_TYPE.DIR
+        
+        dst_parent = self._get_inode(dst_parent_path)
+        if dst_parent.file_type != FILE_TYPE.DIR:
+            raise OSError(errno.ENOTDIR, os.strerror(errno.ENOTDIR), dst)
+        if dst_parent.index == src_parent.index:
+            dst_parent = src_parent  # 同一个目录，用同一个对象，以免互相覆盖
+        # 不能把目录移动到它自己里面
+        if is_dir and (dst_parent_path.rstrip('/') + '/').startswith(src.rstrip('/') + '/'):
+            raise OSError(errno.EINVAL, os.strerror(errno.EINVAL), dst)
+        dst_index = self._dir_index(dst_parent)
+        
+        target_no = dst_index.lookup(dst_name)
+        if target_no == inode_no:
+            return  # 同一个文件的两个硬连接，什么都不用做
+        if target_no != -1:
+            target = self._load_inode(target_no)
+            if target.file_type == FILE_TYPE.DIR:
+                if not is_dir:
+                    raise OSError(errno.EISDIR, os.strerror(errno.EISDIR), dst)
+                if any(name not in ('.', '..') for name in self._dir_index(target).names()):
+                    raise OSError(errno.ENOTEMPTY, os.strerror(errno.ENOTEMPTY), dst)
+            elif is_dir:
+                raise OSError(errno.ENOTDIR, os.strerror(errno.ENOTDIR), dst)
+            # 一次写入就把dst换成新的文件，然后再释放原来的
+            self._replace_entry(dst_index, dst_name, inode_no)
+            self._drop_link(target)
+        else:
+            self._add_to_dir(dst_parent, dst_name, inode)
+        self._remove_entry(src_index, src_name)
+        
+        # 换了父目录的话，要修改目录里的".."
+        if is_dir and dst_parent is not src_parent:
+            moved_index = self._dir_index(inode)
+            if '..' in moved_index:
+                if dst_parent.index == C.INODE_ROOT_NO:
+                    # 根目录的inode号是0，而m_ino为0的目录项会被当作空位，只能删掉
+                    self._remove_entry(moved_index, '..')
+                else:
+                    self._replace_entry(moved_index, '..', dst_parent.index)
+        
+        src_parent.update_mtime()
+        src_parent.flush()
+        if dst_parent is not src_parent:
+            dst_parent.update_mtime()
+            dst_parent.flush()
+        self._maybe_compact_dir(src_parent)
 
     def truncate(self, path: str, new_size: int) -> None:
         debug_print(f"Disk.truncate({path}, {new_size})")
         inode = self._get_inode(path)
         if inode.file_type != FILE_TYPE.FILE:
             raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), path)
+        self.truncate_inode(inode, new_size)
+
+    def truncate_inode(self, inode: Inode, new_size: int) -> None:
+        debug_print(f"Disk.truncate_inode({inode.index}, {new_size})")
         
         target_blockcount = ceil(new_size / C.BLOCK_BYTES)
         while inode.block_count < target_blockcount:
@@ -297,9 +745,9 @@ class Disk:
         if new_size % C.BLOCK_BYTES != 0 and 0 < new_size < inode.size:
             last_block_position = new_size % C.BLOCK_BYTES
             last_block_index = inode.peek_block(target_blockcount - 1)
-            block_data = self.object_accessor.file_blocks[last_block_index]
+            block_data = self.object_accessor.file_blocks.get(last_block_index)
             block_data = block_data[:last_block_position] + b"\x00" * (C.BLOCK_BYTES - last_block_position)
-            self.object_accessor.file_blocks[last_block_index] = block_data
+            self.object_accessor.file_blocks.set(last_block_index, block_data)
                 
         inode.size = new_size
         inode.flush()
@@ -307,67 +755,208 @@ class Disk:
     def read_file(self, path: str, offset: int, size: int) -> bytes:
         debug_print(f"Disk.read_file({path}, {offset}, {size})")
         inode = self._get_inode(path)
+        if inode.file_type != FILE_TYPE.FILE:
+            raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), path)
+        return self.read_inode(inode, offset, size)
+
+    def read_inode(self, inode: Inode, offset: int, size: int) -> bytes:
         offset = max(offset, 0)
         if size < 0:
             size = inode.size - offset
         else:
             size = min(size, inode.size - offset)
-        
+        if size <= 0:
+            return b""
+        return b"".join(self.iter_inode(inode, offset, size))
+
+    def iter_file(self, path: str, offset: int = 0, chunk_size: int = C.READ_CHUNK_BYTES) -> Iterator[memoryview]:
+        """
+        从offset开始按块流式读取文件，每次产出不超过chunk_size字节，
+        不管文件多大，占用的内存都只有一块chunk
+        """
+        debug_print(f"Disk.iter_file({path}, {offset}, {chunk_size})")
+        inode = self._get_inode(path)
         if inode.file_type != FILE_TYPE.FILE:
             raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), path)
+        return self.iter_inode(inode, offset, -1, chunk_size)
+
+    def iter_inode(self, inode: Inode, offset: int = 0, size: int = -1,
+                   chunk_size: int = C.READ_CHUNK_BYTES) -> Iterator[memoryview]:
+        offset = max(offset, 0)
+        end = inode.size if size < 0 else min(inode.size, offset + size)
+        chunk_size = max(chunk_size, C.BLOCK_BYTES)
+        block_map = inode.block_map()
         
-        start_block_index = offset // C.BLOCK_BYTES
-        position = offset % C.BLOCK_BYTES
-        
-        result = b""
-        for index in inode.block_list(start_block_index):
-            data = self.object_accessor.file_blocks[index][position : position + size]
-            result += data
-            position = 0
-            size -= len(data)
-            if size == 0:
-                break
+        while offset < end:
+            # 找出从当前块开始、块号连续的一段，一次读进来
+            # 空闲块表是后进先出的，逐块分配出来的文件块号往往是递减的，这种也算连续
+            first = offset // C.BLOCK_BYTES
+            last = (min(end, offset + chunk_size) - 1) // C.BLOCK_BYTES
+            step = -1 if first < last and block_map[first + 1] == block_map[first] - 1 else 1
+            run_end = first + 1
+            while run_end <= last and block_map[run_end] == block_map[run_end - 1] + step:
+                run_end += 1
+            count = run_end - first
+            if step == 1:
+                data = self.object_accessor.read_raw_block_range(block_map[first], block_map[first] + count)
+            else:
+                low = block_map[run_end - 1]
+                raw = self.object_accessor.read_raw_block_range(low, low + count)
+                data = b"".join(raw[i * C.BLOCK_BYTES : (i + 1) * C.BLOCK_BYTES] for i in range(count - 1, -1, -1))
             
-        return result
+            base = first * C.BLOCK_BYTES
+            stop = min(end, offset + chunk_size, run_end * C.BLOCK_BYTES)
+            yield memoryview(data)[offset - base : stop - base]
+            offset = stop
     
     def write_file(self, path: str, offset: int, data: bytes) -> None:
         debug_print(f"Disk.write_file({path}, {offset}, (data omitted for performance reason) )")
         inode = self._get_inode(path)
+        self.write_inode(inode, offset, data)
+
+    def write_inode(self, inode: Inode, offset: int, data: bytes) -> None:
         if offset < 0:
             offset = inode.size
         
+        if offset > inode.size:  # 如果起始位置就已经超过文件大小了，那就先扩展文件到起始位置
+            self.truncate_inode(inode, offset)
+        
         start_block_index = offset // C.BLOCK_BYTES
         position = offset % C.BLOCK_BYTES
         target_size = offset + len(data)
-        
-        if position > inode.size:  # 如果起始位置就已经超过文件大小了，那就先扩展文件到起始位置
-            self.truncate(path, position)
+        data = memoryview(data)
+        done = 0
         
         # 对现有的block进行覆写
         for index in inode.block_list(start_block_index):
-            part_length = min(len(data), C.BLOCK_BYTES - position)
-            chunk, data = data[:part_length], data[part_length:]
+            part_length = min(len(data) - done, C.BLOCK_BYTES - position)
+            chunk = data[done : done + part_length]
             
-            block_data = self.object_accessor.file_blocks[index]
+            block_data = self.object_accessor.file_blocks.get(index)
             block_data = block_data[:position] + chunk + block_data[position + part_length:]
-            self.object_accessor.file_blocks[index] = block_data
+            self.object_accessor.file_blocks.set(index, block_data)
+            position = 0
+            done += part_length
             
-            if len(data) == 0:
+            if done == len(data):
                 break
         
         # 如果新的数据比原来就有的还多，就要加新的block来写
-        while (len(data) > 0):
-            part_length = min(len(data), C.BLOCK_BYTES)
-            chunk, data = data[:part_length], data[part_length:]
-            chunk = chunk + b"\x00" * (C.BLOCK_BYTES - len(chunk))
-            
-            block_index = self.superblock.allocate_block()
-            self.object_accessor.file_blocks[block_index] = chunk
-            inode.push_block(block_index)
+        if done < len(data):
+            self.append_blocks(inode, data[done:])
         
         inode.size = max(inode.size, target_size)
         inode.flush()
 
+    def append_blocks(self, inode: Inode, data: bytes | list) -> None:
+        """
+        在文件的最后一个块之后追加新块来存放data（也可以是依次拼接的若干段数据），
+        最后一块不满的部分补0，不修改文件大小，也不写回inode。
+        新块一次分配出来并按块号排好序，块号连续的部分用一次pwritev写入，索引块也是改完了再一起写
+        """
+        buffers = [memoryview(buffer) for buffer in (data if isinstance(data, list) else [data])]
+        total = sum(len(buffer) for buffer in buffers)
+        count = ceil(total / C.BLOCK_BYTES)
+        if count == 0:
+            return
+        if total % C.BLOCK_BYTES != 0:
+            buffers.append(memoryview(bytes(C.BLOCK_BYTES - total % C.BLOCK_BYTES)))
+        blocks = sorted(self.superblock.allocate_blocks(count, inode.new_index_blocks(count)))
+        
+        # 按目标的连续段把buffers切开，每段一次写入
+        run_start = 0
+        k = 0  # 下一个要写的buffer
+        for i in range(1, count + 1):
+            if i < count and blocks[i] == blocks[i - 1] + 1:
+                continue
+            remaining = (i - run_start) * C.BLOCK_BYTES
+            run = []
+            while remaining > 0:
+                buffer = buffers[k]
+                if len(buffer) <= remaining:
+                    run.append(buffer)
+                    remaining -= len(buffer)
+                    k += 1
+                else:
+                    run.append(buffer[:remaining])
+                    buffers[k] = buffer[remaining:]
+                    remaining = 0
+            self.object_accessor.write_raw_vectors(blocks[run_start], run)
+            run_start = i
+        inode.push_blocks(blocks)
+
+    def copy_file(self, src: str, dst: str, offset: int = 0, length: int = -1) -> int:
+        """
+        把src从offset开始的length字节（-1表示到文件末尾）复制到dst的同一位置，
+        dst不存在时会被创建。返回复制的字节数
+        """
+        debug_print(f"Disk.copy_file({src}, {dst}, {offset}, {length})")
+        src_inode = self._get_inode(src)
+        if src_inode.file_type != FILE_TYPE.FILE:
+            raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), src)
+        if not self.exists(dst):
+            self.create(dst, FILE_TYPE.FILE)
+        dst_inode = self._get_inode(dst)
+        if dst_inode.file_type != FILE_TYPE.FILE:
+            raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), dst)
+        return self.copy_inode(src_inode, offset, dst_inode, offset, length)
+
+    def copy_inode(self, src: Inode, src_offset: int, dst: Inode, dst_offset: int, length: int = -1) -> int:
+        """
+        在镜像内部复制数据，不经过调用者。dst_offset为-1表示追加到dst末尾
+        如果是从块边界开始、追加到dst末尾（复制整个文件就是这种情况），
+        就按块复制：源文件按连续的块读出来，目标的块成批分配，用pwritev写入
+        """
+        src_offset = max(src_offset, 0)
+        end = src.size if length < 0 else min(src.size, src_offset + length)
+        if end <= src_offset:
+            return 0
+        if dst_offset < 0:
+            dst_offset = dst.size
+        
+        if src_offset % C.BLOCK_BYTES != 0 or dst_offset != dst.size or dst_offset % C.BLOCK_BYTES != 0:
+            # 没有对齐，只能读出来再写
+            position = dst_offset
+            for chunk in self.iter_inode(src, src_offset, end - src_offset, C.COPY_BATCH_BYTES):
+                self.write_inode(dst, position, chunk)
+                position += len(chunk)
+            return end - src_offset
+        
+        position = src_offset
+        while position < end:
+            batch_end = min(end, position + C.COPY_BATCH_BYTES)
+            self.append_blocks(dst, list(self.iter_inode(src, position, batch_end - position)))
+            position = batch_end
+        dst.size = dst_offset + end - src_offset
+        dst.update_mtime()
+        dst.flush()
+        return end - src_offset
+
+    def open_writer(self, path: str) -> FileWriter:
+        """
+        以覆盖的方式打开文件进行流式写入（文件不存在时会被创建），
+        返回的FileWriter用完之后需要close
+        """
+        debug_print(f"Disk.open_writer({path})")
+        if not self.exists(path):
+            self.create(path, FILE_TYPE.FILE)
+        return self._open_writer(self.open_inode(path), path)
+
+    def open_writer_by_ino(self, inode_no: int) -> FileWriter:
+        """
+        和open_writer一样，但是直接用inode号打开，省掉路径解析（比如批量导入时刚用create_many创建的文件）
+        """
+        debug_print(f"Disk.open_writer_by_ino({inode_no})")
+        return self._open_writer(self._pin_inode(self._load_inode(inode_no)), inode_no)
+
+    def _open_writer(self, inode: Inode, name) -> FileWriter:
+        if inode.file_type != FILE_TYPE.FILE:
+            self.close_inode(inode)
+            raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), name)
+        if inode.size:
+            self.truncate_inode(inode, 0)
+        return FileWriter(self, inode)
+
     def modify_timestamp(self, path: str, atime: int = -1, mtime: int = -1) -> None:
         debug_print(f"Disk.modify_timestamp({path}, {atime}, {mtime})")
         inode = self._get_inode(path)
@@ -382,6 +971,7 @@ class Disk:
         mounted = self.mounted
         if mounted:
             self.unmount()
+        from format_disk import format_disk
         format_disk(self.path)
         if mounted:
             self.mount()
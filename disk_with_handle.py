@@ -2,21 +2,22 @@ from disk import Disk
 from file import File, OpenedFiles
 
 class DiskWithHandle(Disk):
-    def __init__(self, path: str):
-        super().__init__(path)
+    def __init__(self, path: str, sidecar: bool = False):
+        super().__init__(path, sidecar=sidecar)
         self.files = OpenedFiles()
-        self.new_handle = 1
 
     def open(self, path: str) -> int:
         if path in self.files:
             return self.files.find(path)
-        file = File(path)
+        # 打开时解析一次路径，之后的读写都直接用这个inode（以及它缓存的块号列表）
+        file = File(path, self.open_inode(path))
         return self.files.add(file)
     
     def close(self, handle: int) -> None:
         if handle not in self.files:
             raise FileNotFoundError(f"File handle {handle} not found")
-        self.files.pop(handle)
+        file = self.files.pop(handle)
+        self.close_inode(file.inode)
 
     def seek(self, handle: int, offset: int) -> None:
         file = self.files.get(handle)
@@ -27,27 +28,27 @@ class DiskWithHandle(Disk):
         return super().dir_list(file.path)
 
     def unlink(self, path: str) -> None:
-        if path in self.files:
-            self.files.pop(path)
+        for handle in self.files.handles(path):
+            self.close(handle)
         super().unlink(path)
             
     def truncate(self, handle: int, new_size: int) -> None:
         file = self.files.get(handle)
         file.offset = min(file.offset, new_size)
-        super().truncate(file.path, new_size)
+        self.truncate_inode(file.inode, new_size)
     
     def read_file(self, handle: int, size: int) -> bytes:
         file = self.files.get(handle)
-        result = super().read_file(file.path, file.offset, size)
+        result = self.read_inode(file.inode, file.offset, size)
         file.offset += len(result)
         return result
     
     def write_file(self, handle: int, data: bytes) -> None:
         file = self.files.get(handle)
+        self.write_inode(file.inode, file.offset, data)
         file.offset += len(data)
-        super().write_file(file.path, file.offset, data)
         
     def format(self):
         self.files.clear()
         super().format()
-    
\ No newline at end of file
+    
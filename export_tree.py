@@ -0,0 +1,191 @@
+import io
+import os
+import posixpath
+import sys
+import tarfile
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Iterator
+
+import constants as C
+from disk import Disk
+from inode import Inode, FILE_TYPE
+
+
+@dataclass
+class ExportStats:
+    files: int = 0
+    dirs: int = 0
+    bytes: int = 0
+    seconds: float = 0.0
+
+
+# 每个子进程各自以只读方式挂载一份镜像，有自己的缓存
+_worker_disk: Disk | None = None
+
+
+def _init_worker(image_path: str) -> None:
+    global _worker_disk
+    _worker_disk = Disk(image_path, readonly=True)
+    _worker_disk.mount()
+
+
+def _write_files(files: list[tuple[int, str, int]]) -> int:
+    """
+    在子进程里把一批文件写到宿主机上：[(inode号, 宿主机路径, 修改时间)]，返回写入的字节数
+    """
+    total = 0
+    for ino, host_path, mtime in files:
+        with open(host_path, 'wb') as f:
+            for chunk in _worker_disk.iter_inode(_worker_disk.load_inode(ino)):
+                total += f.write(chunk)
+        os.utime(host_path, (mtime, mtime))
+    return total
+
+
+def _read_files(inos: list[int]) -> list[bytes]:
+    return [_worker_disk.read_inode(_worker_disk.load_inode(ino), 0, -1) for ino in inos]
+
+
+class _InodeReader(io.RawIOBase):
+    """
+    把iter_inode包装成文件对象，交给tarfile边读边写
+    """
+    def __init__(self, disk: Disk, inode: Inode):
+        self.chunks = disk.iter_inode(inode)
+        self.leftover = memoryview(b"")
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        if not self.leftover:
+            self.leftover = memoryview(next(self.chunks, b""))
+        length = min(len(buffer), len(self.leftover))
+        buffer[:length] = self.leftover[:length]
+        self.leftover = self.leftover[length:]
+        return length
+
+
+def _walk(disk: Disk, root: str) -> Iterator[tuple[str, Inode]]:
+    """
+    深度优先遍历镜像里的目录树，返回(相对路径, Inode)，目录总是在它里面的文件之前
+    设备文件等不是普通文件也不是目录的会被跳过
+    """
+    stack = [("", root)]
+    while stack:
+        relative, path = stack.pop()
+        for name, inode in disk.iter_dir(path):
+            child = posixpath.join(relative, name) if relative else name
+            if inode.file_type == FILE_TYPE.DIR:
+                yield child, inode
+                stack.append((child, posixpath.join(path, name)))
+            elif inode.file_type == FILE_TYPE.FILE:
+                yield child, inode
+
+
+def _plan(disk: Disk, root: str, stream_large: bool):
+    """
+    把遍历结果分成有序的若干项：('dir', (相对路径, Inode))、
+    ('files', [(相对路径, Inode)])（一批小文件，交给子进程）、('large', (相对路径, Inode))（由当前进程边读边写）
+    """
+    batch, size = [], 0
+    for relative, inode in _walk(disk, root):
+        large = inode.file_type == FILE_TYPE.FILE and stream_large and inode.size > C.EXPORT_TASK_BYTES
+        if inode.file_type == FILE_TYPE.DIR or large:
+            if batch:
+                yield 'files', batch
+                batch, size = [], 0
+            yield ('dir' if not large else 'large'), (relative, inode)
+            continue
+        batch.append((relative, inode))
+        size += inode.size
+        if size >= C.EXPORT_TASK_BYTES:
+            yield 'files', batch
+            batch, size = [], 0
+    if batch:
+        yield 'files', batch
+
+
+def _tar_info(relative: str, inode: Inode) -> tarfile.TarInfo:
+    info = tarfile.TarInfo(relative)
+    info.mtime = inode.data.d_mtime
+    if inode.file_type == FILE_TYPE.DIR:
+        info.type = tarfile.DIRTYPE
+        info.mode = 0o755
+    else:
+        info.size = inode.size
+        info.mode = 0o644
+    return info
+
+
+def export_tree(image_path: str, destination: str, root: str = '/', workers: int = C.IMPORT_WORKERS) -> ExportStats:
+    """
+    不经过FUSE，把镜像里root下面的目录树导出到宿主机。
+    destination是'-'或者以.tar结尾时输出tar流（'-'表示标准输出），否则导出到这个目录下面。
+    镜像以只读方式打开，文件内容由进程池并行读取，每个子进程各自只读挂载镜像；
+    正在处理的任务数有上限，所以占用的内存不随目录树的大小增长
+    """
+    stats = ExportStats()
+    start = time.perf_counter()
+    to_tar = destination == '-' or destination.endswith('.tar')
+
+    disk = Disk(image_path, readonly=True)
+    disk.mount()
+    try:
+        if to_tar:
+            output = sys.stdout.buffer if destination == '-' else open(destination, 'wb')
+            tar = tarfile.open(fileobj=output, mode='w|', format=tarfile.PAX_FORMAT)
+        else:
+            os.makedirs(destination, exist_ok=True)
+
+        with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(image_path,)) as pool:
+            window: deque = deque()
+
+            def finish(kind, payload, future) -> None:
+                if kind == 'dir':
+                    stats.dirs += 1
+                    if to_tar:
+                        tar.addfile(_tar_info(*payload))
+                elif kind == 'large':
+                    relative, inode = payload
+                    # tarfile要求每次都读满，用BufferedReader包一层
+                    tar.addfile(_tar_info(relative, inode), io.BufferedReader(_InodeReader(disk, inode)))
+                    stats.files += 1
+                    stats.bytes += inode.size
+                elif to_tar:
+                    for (relative, inode), data in zip(payload, future.result()):
+                        tar.addfile(_tar_info(relative, inode), io.BytesIO(data))
+                        stats.bytes += len(data)
+                    stats.files += len(payload)
+                else:
+                    stats.bytes += future.result()
+                    stats.files += len(payload)
+
+            for kind, payload in _plan(disk, root, stream_large=to_tar):
+                future = None
+                if kind == 'dir' and not to_tar:
+                    # 目录要在它里面的文件交给子进程之前建好
+                    os.makedirs(os.path.join(destination, payload[0]), exist_ok=True)
+                elif kind == 'files' and to_tar:
+                    future = pool.submit(_read_files, [inode.index for _, inode in payload])
+                elif kind == 'files':
+                    future = pool.submit(_write_files, [(inode.index, os.path.join(destination, relative), inode.data.d_mtime)
+                                                         for relative, inode in payload])
+                window.append((kind, payload, future))
+                while len(window) > workers * 2:
+                    finish(*window.popleft())
+            while window:
+                finish(*window.popleft())
+
+        if to_tar:
+            tar.close()
+            if output is not sys.stdout.buffer:
+                output.close()
+    finally:
+        disk.unmount()
+
+    stats.seconds = time.perf_counter() - start
+    return stats
@@ -1,23 +1,73 @@
+import heapq
 from inode import Inode
+import constants as C
 
 class File:
-    def __init__(self, path: str):
+    def __init__(self, path: str, inode: Inode | None = None):
         self.path = path
         self.offset = 0
+        # 打开时解析好的inode，读写时不用再按路径查找
+        self.inode = inode
+        # 还没写到磁盘上的连续写入，从pending_offset开始
+        self.pending = bytearray()
+        self.pending_offset = 0
+
+    def buffer(self, offset: int, data: bytes) -> bool:
+        """
+        尝试把一次写入接在缓冲区后面，接不上时返回False
+        """
+        if self.pending and offset != self.pending_offset + len(self.pending):
+            return False
+        if not self.pending:
+            self.pending_offset = offset
+        self.pending += data
+        return True
+
+    @property
+    def buffer_full(self) -> bool:
+        return len(self.pending) >= C.WRITE_BUFFER_BYTES
+
+    def take_pending(self) -> tuple[int, bytes]:
+        """
+        取出缓冲区里的数据，并清空缓冲区
+        """
+        data = bytes(self.pending)
+        self.pending.clear()
+        return self.pending_offset, data
         
 class OpenedFiles:
+    """
+    打开的文件表：句柄 -> File，另外按路径和inode号各建一个索引，
+    查找、添加、删除都不用遍历所有打开的文件。关闭的句柄号会被重新使用
+    """
     def __init__(self) -> None:
         self.files: dict[int, File] = {}
+        # 路径/inode号 -> 句柄（用dict当作有序集合，先打开的在前面）
+        self.by_path: dict[str, dict[int, None]] = {}
+        self.by_inode: dict[int, dict[int, None]] = {}
+        self.free_handles: list[int] = []
         self.new_handle = 1
 
     def clear(self) -> None:
         self.files.clear()
+        self.by_path.clear()
+        self.by_inode.clear()
+        self.free_handles.clear()
         self.new_handle = 1
 
+    def __len__(self) -> int:
+        return len(self.files)
+
     def add(self, file: File) -> int:
-        handle = self.new_handle
+        if self.free_handles:
+            handle = heapq.heappop(self.free_handles)
+        else:
+            handle = self.new_handle
+            self.new_handle += 1
         self.files[handle] = file
-        self.new_handle += 1
+        self.by_path.setdefault(file.path, {})[handle] = None
+        if file.inode is not None:
+            self.by_inode.setdefault(file.inode.index, {})[handle] = None
         return handle
     
     def get(self, handle: int) -> File:
@@ -26,23 +76,31 @@ class OpenedFiles:
         return self.files[handle]
     
     def find(self, path: str) -> int:
-        for handle, file in self.files.items():
-            if file.path == path:
-                return handle
-        raise FileNotFoundError(f"File {path} not found")
-    
-    def pop(self, item: int | str) -> None:
-        if isinstance(item, int):
-            self.files.pop(item)
-        else:
-            handle = self.find(item)
-            self.files.pop(handle)
+        handles = self.by_path.get(path)
+        if not handles:
+            raise FileNotFoundError(f"File {path} not found")
+        return next(iter(handles))
+
+    def handles(self, path: str) -> list[int]:
+        return list(self.by_path.get(path, ()))
+
+    def pop(self, item: int | str) -> File:
+        handle = item if isinstance(item, int) else self.find(item)
+        file = self.files.pop(handle)
+        self._unindex(self.by_path, file.path, handle)
+        if file.inode is not None:
+            self._unindex(self.by_inode, file.inode.index, handle)
+        heapq.heappush(self.free_handles, handle)
+        return file
+
+    @staticmethod
+    def _unindex(index: dict, key, handle: int) -> None:
+        handles = index[key]
+        del handles[handle]
+        if not handles:
+            del index[key]
         
     def __contains__(self, wanted: int | str) -> bool:
         if isinstance(wanted, int):
             return wanted in self.files
-        for file in self.files.values():
-            if file.path == wanted:
-                return True
-        return False
-    
\ No newline at end of file
+        return wanted in self.by_path
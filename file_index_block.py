@@ -13,8 +13,7 @@ class FileIndexBlock:
         """
         通过块号构造索引对象
         """
-        # index_data: list[int] = object_accessor.file_index_blocks[index]._obj
-        index_data: list[int] = object_accessor.file_index_blocks[index]
+        index_data: list[int] = object_accessor.file_index_blocks.get(index)
         return cls(index, index_data, object_accessor)
         
     def __getitem__(self, index: int) -> int:
@@ -25,7 +24,7 @@ class FileIndexBlock:
         self.flush()
 
     def flush(self) -> None:
-        self.object_accessor.file_index_blocks[self.block_index] = self.indexes        
+        self.object_accessor.file_index_blocks.set(self.block_index, self.indexes)        
  
     def to_list(self) -> list[int]:
         return self.indexes.copy()
@@ -0,0 +1,70 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING, BinaryIO
+import constants as C
+from utils import debug_print
+if TYPE_CHECKING:
+    from disk import Disk
+    from inode import Inode
+
+
+class FileWriter:
+    """
+    向文件末尾流式写入数据，由Disk.open_writer创建
+    写入的数据先攒在缓冲区里，攒够WRITE_CHUNK_BYTES就按整块写到磁盘上，
+    所以不管写多少数据，占用的内存都只有一个缓冲区
+    """
+    def __init__(self, disk: Disk, inode: Inode):
+        self.disk = disk
+        self.inode = inode
+        self.buffer = bytearray()
+        self.closed = False
+
+    def write(self, data: bytes) -> int:
+        if self.closed:
+            raise ValueError("write to closed file")
+        self.buffer += data
+        if len(self.buffer) >= C.WRITE_CHUNK_BYTES:
+            self._write_full_blocks()
+        return len(data)
+
+    def write_from(self, source: BinaryIO) -> int:
+        """
+        把一个文件对象里的数据全部写进来，返回写入的字节数
+        """
+        total = 0
+        while chunk := source.read(C.WRITE_CHUNK_BYTES):
+            total += self.write(chunk)
+        return total
+
+    def _write_full_blocks(self) -> None:
+        length = len(self.buffer) - len(self.buffer) % C.BLOCK_BYTES
+        if length == 0:
+            return
+        with memoryview(self.buffer) as view:
+            self.disk.append_blocks(self.inode, view[:length])
+        del self.buffer[:length]
+        self.inode.size += length
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        debug_print(f"FileWriter.close({self.inode.index})")
+        self.closed = True
+        try:
+            self._write_full_blocks()
+            # 最后不满一块的部分
+            if self.buffer:
+                self.disk.append_blocks(self.inode, self.buffer)
+                self.inode.size += len(self.buffer)
+                self.buffer.clear()
+            self.inode.update_mtime()
+            self.inode.flush()
+        finally:
+            # 写失败了（比如磁盘满了）也要放开inode，不然推迟的unlink永远不会释放它
+            self.disk.close_inode(self.inode)
+
+    def __enter__(self) -> FileWriter:
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
@@ -1,24 +1,38 @@
 import constants as C
 import disk_params as DiskParams
 from block_device import CachedBlockDevice
+from change_tracking import mark_changed
+from memory_device import CachedMemoryBlockDevice, create_memory_image, is_memory_image
 from object_accessor import ObjectAccessor
 from superblock import Superblock
 from inode import Inode, FILE_TYPE
 
-def format_disk(path: str, init_params: bool = False):
+def format_disk(path: str, init_params: bool = False,
+                inode_blocks: int = 4096, disk_blocks: int = 65536):
     if init_params:
-        DiskParams.init_constants()
-    
+        if inode_blocks <= 0 or disk_blocks <= C.SUPERBLOCK_BLOCKS + inode_blocks:
+            raise ValueError(f"invalid disk size: inode_blocks={inode_blocks}, disk_blocks={disk_blocks}")
+        if disk_blocks >= 2 ** 32:
+            raise ValueError(f"disk_blocks={disk_blocks} does not fit in a 32-bit block index")
+        DiskParams.init_constants(0, inode_blocks, disk_blocks)
+
     # 对磁盘低格
-    with open(path, 'wb') as f:
-        f.write(b'\x00' * DiskParams.TOTAL_BYTES)
-        
-    disk = CachedBlockDevice(path)
+    if is_memory_image(path):
+        create_memory_image(path, DiskParams.TOTAL_BYTES)
+        disk = CachedMemoryBlockDevice(path)
+    else:
+        # 用truncate创建稀疏文件，不需要真的写入全是0的数据
+        with open(path, 'wb') as f:
+            f.truncate(DiskParams.TOTAL_BYTES)
+        disk = CachedBlockDevice(path)
+
     accessor = ObjectAccessor(disk)
     superblock = Superblock.new(accessor)
     root_inode = Inode.new(C.INODE_ROOT_NO, FILE_TYPE.DIR, accessor, superblock)
-    
+
     superblock.flush()
     root_inode.flush()
     disk.close()
-    
\ No newline at end of file
+    # 格式化不经过变更块跟踪，整个镜像都算改过了
+    if not is_memory_image(path):
+        mark_changed(path)
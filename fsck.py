@@ -0,0 +1,255 @@
+import struct
+import time
+from array import array
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from math import ceil
+
+import constants as C
+import disk_params as DiskParams
+from disk import Disk
+from inode import FILE_TYPE
+from utils import get_superblock_hash
+
+# inode的二进制格式，与structures.InodeStruct一致：d_mode, d_nlink, d_uid, d_gid, d_size, d_addr[10], d_atime, d_mtime
+_INODE = struct.Struct(f"<IIHHI{C.INODE_DIRECTORY_ENTRY_COUNT}III")
+_INDEX_BLOCK = struct.Struct(f"<{C.FILE_INDEX_PER_BLOCK}I")
+_DIR_ENTRY = struct.Struct(f"<I{C.DIRECTORY_NAME_MAX_LENGTH + 1}s")
+_FREE_INDEX_BLOCK = struct.Struct(f"<I{C.FREE_INDEX_PER_BLOCK}I")
+
+# d_mode里的各个位，见structures.InodeMode
+_IALLOC = 1 << 15
+_IFMT_SHIFT = 13
+
+
+@dataclass
+class FsckReport:
+    inodes: int = 0
+    blocks: int = 0
+    seconds: float = 0.0
+    # 被不止一个对象占用的块：(块号, [占用者])，占用者是inode号，空闲链表记作"free"
+    double_allocated: list[tuple[int, list]] = field(default_factory=list)
+    # 既不属于任何文件、也不在空闲链表里的块
+    leaked: list[int] = field(default_factory=list)
+    # 已分配但是从根目录走不到的inode
+    orphaned: list[int] = field(default_factory=list)
+    # 指向未分配inode的目录项：(目录的inode号, 文件名, inode号)
+    dangling: list[tuple[int, str, int]] = field(default_factory=list)
+    # 指向数据区以外的块号：(inode号, 块号)
+    bad_pointers: list[tuple[int, int]] = field(default_factory=list)
+    # 普通文件的硬连接数与目录项数不一致：(inode号, d_nlink, 目录项数)
+    bad_nlink: list[tuple[int, int, int]] = field(default_factory=list)
+    # 空闲链表本身的问题和超级块里计数的问题
+    free_list: list[str] = field(default_factory=list)
+    counters: list[str] = field(default_factory=list)
+
+    @property
+    def clean(self) -> bool:
+        return not (self.double_allocated or self.leaked or self.orphaned or self.dangling
+                    or self.bad_pointers or self.bad_nlink or self.free_list or self.counters)
+
+
+# 每个子进程各自以只读方式挂载一份镜像
+_worker_disk: Disk | None = None
+
+
+def _init_worker(image_path: str) -> None:
+    global _worker_disk
+    _worker_disk = Disk(image_path, readonly=True)
+    _worker_disk.mount()
+
+
+def _valid_block(block: int) -> bool:
+    return DiskParams.DATA_START <= block < DiskParams.DISK_BLOCKS
+
+
+def _read_index(block: int) -> tuple[int, ...]:
+    return _INDEX_BLOCK.unpack(_worker_disk.object_accessor.read_raw_block(block))
+
+
+def _scan_inode(ino: int, d_addr: tuple[int, ...], d_size: int, owned: array, bad: list) -> list[int]:
+    """
+    按Inode._block_list的规则走一遍文件的索引树，把用到的索引块和数据块记到owned里，返回数据块列表
+    """
+    remaining = ceil(d_size / C.BLOCK_BYTES)
+    blocks: list[int] = []
+
+    def own(block: int) -> bool:
+        if not _valid_block(block):
+            bad.append((ino, block))
+            return False
+        owned.append(block)
+        owned.append(ino)
+        return True
+
+    def take(entries) -> None:
+        nonlocal remaining
+        entries = entries[:remaining]
+        remaining -= len(entries)
+        for block in entries:
+            if own(block):
+                blocks.append(block)
+
+    take(d_addr[:C.INODE_SMALL_THRESHOLD])
+    for k in range(C.INODE_SMALL_THRESHOLD, C.INODE_LARGE_THRESHOLD):
+        if remaining <= 0 or not own(d_addr[k]):
+            break
+        take(_read_index(d_addr[k]))
+    for k in range(C.INODE_LARGE_THRESHOLD, C.INODE_HUGE_THRESHOLD):
+        if remaining <= 0 or not own(d_addr[k]):
+            break
+        for second in _read_index(d_addr[k]):
+            if remaining <= 0 or not own(second):
+                break
+            take(_read_index(second))
+    return blocks
+
+
+def _scan_chunk(start: int, end: int):
+    """
+    在子进程里扫描[start, end)这一段inode，返回：
+    已分配的inode [(inode号, 类型, d_nlink)]、占用的块 array[块号, inode号, ...]、
+    目录项 [(目录的inode号, 文件名, inode号)]、越界的块号 [(inode号, 块号)]
+    """
+    accessor = _worker_disk.object_accessor
+    first_block = DiskParams.INODE_START + start // C.INODE_PER_BLOCK
+    last_block = DiskParams.INODE_START + ceil(end / C.INODE_PER_BLOCK)
+    data = accessor.read_raw_block_range(first_block, last_block)
+    base = (first_block - DiskParams.INODE_START) * C.INODE_PER_BLOCK
+
+    inodes, owned, entries, bad = [], array('I'), [], []
+    for ino in range(start, end):
+        d_mode, d_nlink, _, _, d_size, *rest = _INODE.unpack_from(data, (ino - base) * C.INODE_BYTES)
+        # 根目录总是被当作已分配的（与Superblock._scan_inodes一致）
+        if not d_mode & _IALLOC and ino != C.INODE_ROOT_NO:
+            continue
+        file_type = (d_mode >> _IFMT_SHIFT) & 3
+        inodes.append((ino, file_type, d_nlink))
+        blocks = _scan_inode(ino, rest[:C.INODE_DIRECTORY_ENTRY_COUNT], d_size, owned, bad)
+        if file_type != FILE_TYPE.DIR.value:
+            continue
+        for block in blocks:
+            dir_block = accessor.read_raw_block(block)
+            for m_ino, m_name in _DIR_ENTRY.iter_unpack(dir_block):
+                if m_ino != 0:
+                    entries.append((ino, m_name.split(b"\x00", 1)[0].decode("utf8", "replace"), m_ino))
+    return inodes, owned, entries, bad
+
+
+def _walk_free_list(superblock, owner: array, report: FsckReport) -> int:
+    """
+    沿着空闲链表把每个空闲块登记到owner里，返回空闲块数
+    owner里-1表示没有主人，-2表示空闲
+    """
+    free = 0
+    s_nfree, s_free = superblock.data.s_nfree, list(superblock.data.s_free)
+    seen_index_blocks = set()
+    accessor = superblock.object_accessor
+
+    def mark(block: int) -> None:
+        nonlocal free
+        if not _valid_block(block):
+            report.free_list.append(f"free list contains block {block} outside the data area")
+            return
+        if owner[block] == -2:
+            report.free_list.append(f"block {block} appears twice in the free list")
+            return
+        if owner[block] >= 0:
+            report.double_allocated.append((block, [owner[block], "free"]))
+        owner[block] = -2
+        free += 1
+
+    while True:
+        if not 0 < s_nfree <= C.SUPERBLOCK_FREE_BLOCK:
+            report.free_list.append(f"free list node has s_nfree={s_nfree}")
+            break
+        for block in s_free[1:s_nfree]:
+            mark(block)
+        next_block = s_free[0]
+        if next_block == 0:
+            break
+        if next_block in seen_index_blocks:
+            report.free_list.append(f"free list loops back to block {next_block}")
+            break
+        seen_index_blocks.add(next_block)
+        mark(next_block)
+        if not _valid_block(next_block):
+            break
+        s_nfree, *s_free = _FREE_INDEX_BLOCK.unpack_from(accessor.read_raw_block(next_block))
+    return free
+
+
+def fsck(image_path: str, workers: int = C.IMPORT_WORKERS) -> FsckReport:
+    """
+    离线检查镜像的一致性，镜像以只读方式打开，不会做任何修改。
+    inode表分段交给进程池扫描，得到每个块的归属和所有目录项；
+    然后从根目录出发遍历目录图，再与空闲链表、超级块里的bfree/ffree对照
+    """
+    report = FsckReport()
+    start = time.perf_counter()
+    disk = Disk(image_path, readonly=True)
+    disk.mount()
+    try:
+        superblock = disk.superblock
+        report.inodes, report.blocks = DiskParams.INODE_COUNT, DiskParams.DISK_BLOCKS
+
+        # 1. 并行扫描inode表
+        chunk = max(C.INODE_PER_BLOCK, ceil(DiskParams.INODE_COUNT / (workers * 4) / C.INODE_PER_BLOCK) * C.INODE_PER_BLOCK)
+        ranges = [(i, min(i + chunk, DiskParams.INODE_COUNT)) for i in range(0, DiskParams.INODE_COUNT, chunk)]
+        inodes: dict[int, tuple[int, int]] = {}
+        owner = array('l', [-1]) * DiskParams.DISK_BLOCKS
+        children: dict[int, list[tuple[str, int]]] = {}
+        with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(image_path,)) as pool:
+            for chunk_inodes, owned, entries, bad in pool.map(_scan_chunk, *zip(*ranges)):
+                for ino, file_type, d_nlink in chunk_inodes:
+                    inodes[ino] = (file_type, d_nlink)
+                # 2. 块的归属
+                for i in range(0, len(owned), 2):
+                    block, ino = owned[i], owned[i + 1]
+                    if owner[block] >= 0:
+                        report.double_allocated.append((block, [owner[block], ino]))
+                    else:
+                        owner[block] = ino
+                for dir_ino, name, ino in entries:
+                    children.setdefault(dir_ino, []).append((name, ino))
+                report.bad_pointers.extend(bad)
+
+        # 3. 空闲链表
+        free = _walk_free_list(superblock, owner, report)
+        report.leaked = [block for block in range(DiskParams.DATA_START, DiskParams.DISK_BLOCKS) if owner[block] == -1]
+
+        # 4. 从根目录出发遍历目录图
+        references: dict[int, int] = {}
+        reachable = {C.INODE_ROOT_NO}
+        queue = deque([C.INODE_ROOT_NO])
+        while queue:
+            dir_ino = queue.popleft()
+            for name, ino in children.get(dir_ino, ()):
+                if name in ('.', '..'):
+                    continue
+                if ino not in inodes:
+                    report.dangling.append((dir_ino, name, ino))
+                    continue
+                references[ino] = references.get(ino, 0) + 1
+                if ino not in reachable:
+                    reachable.add(ino)
+                    if inodes[ino][0] == FILE_TYPE.DIR.value:
+                        queue.append(ino)
+        report.orphaned = sorted(ino for ino in inodes if ino not in reachable)
+        report.bad_nlink = sorted((ino, d_nlink, references.get(ino, 0)) for ino, (file_type, d_nlink) in inodes.items()
+                                  if file_type == FILE_TYPE.FILE.value and ino in reachable and d_nlink != references[ino])
+
+        # 5. 超级块里的计数只有本程序写过的镜像才有（hash对得上）
+        if superblock.data.hash == get_superblock_hash(superblock.data.pack()):
+            # 根目录总在inodes里，而且不计入ffree（与Superblock.recount一致）
+            ffree = DiskParams.INODE_COUNT - len(inodes)
+            if superblock.data.bfree != free:
+                report.counters.append(f"bfree is {superblock.data.bfree}, free list has {free} blocks")
+            if superblock.data.ffree != ffree:
+                report.counters.append(f"ffree is {superblock.data.ffree}, {ffree} inodes are free")
+    finally:
+        disk.unmount()
+
+    report.seconds = time.perf_counter() - start
+    return report
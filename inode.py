@@ -1,13 +1,31 @@
-from typing import Any, Generator
-from construct import Container
+from __future__ import annotations
+from typing import TYPE_CHECKING, Any, Generator, Iterable
 import constants as C
 from enum import Enum
 from object_accessor import ObjectAccessor
 from free_block_interface import FreeBlockInterface
 from file_index_block import FileIndexBlock
 from math import ceil
+from array import array
+import struct
 from utils import timestamp
-from structures import InodeStruct
+import structures as S
+if TYPE_CHECKING:
+    from construct import Container
+
+# 文件索引块的二进制格式，与structures.FileIndexBlock一致
+_INDEX_BLOCK = struct.Struct(f"<{C.FILE_INDEX_PER_BLOCK}I")
+_LARGE_BLOCKS = C.FILE_INDEX_LARGE_THRESHOLD - C.FILE_INDEX_SMALL_THRESHOLD
+
+
+def index_block_count(count: int) -> int:
+    """
+    有count个数据块的文件需要多少个索引块
+    """
+    large = min(max(count - C.FILE_INDEX_SMALL_THRESHOLD, 0), _LARGE_BLOCKS)
+    huge = max(count - C.FILE_INDEX_LARGE_THRESHOLD, 0)
+    return (ceil(large / C.FILE_INDEX_PER_BLOCK) + ceil(huge / C.FILE_INDEX_PER_BLOCK)
+            + ceil(huge / C.FILE_INDEX_PER_BLOCK ** 2))
 
 class FILE_TYPE(Enum):
     FILE = 0
@@ -35,6 +53,8 @@ class Inode:
         self.object_accessor = object_accessor
         self.free_block_manager = free_block_manager
         self.block_count = ceil(self.data.d_size / C.BLOCK_BYTES)
+        # 文件所有数据块的块号，第一次用到时才读出来，见block_map
+        self._block_map: array | None = None
         
     @classmethod
     def from_index(cls, index: int,
@@ -43,8 +63,7 @@ class Inode:
         """
         通过Inode号码构造Inode对象
         """
-        # inode_data: Container[Any] = object_accessor.inodes[index]._obj
-        inode_data: Container[Any] = object_accessor.inodes[index]
+        inode_data: Container[Any] = object_accessor.inodes.get(index)
         return cls(index, inode_data, object_accessor, free_block_manager)
     
     @classmethod
@@ -56,7 +75,7 @@ class Inode:
         mode |= file_type.value << 13
         mode = mode.to_bytes(4, 'little')
         inode = mode + b'\x00' * (C.INODE_BYTES - 4)
-        inode = InodeStruct.parse(inode)
+        inode = S.InodeStruct.parse(inode)
         time = timestamp()
         inode.d_atime = time
         inode.d_mtime = time
@@ -74,13 +93,14 @@ class Inode:
         self.data.d_size = value
     
     def flush(self) -> None:
-        self.object_accessor.inodes[self.index] = self.data
+        self.object_accessor.inodes.set(self.index, self.data)
     
     def _get_index_block(self, block_index: int) -> FileIndexBlock:
         return FileIndexBlock.from_index(block_index, self.object_accessor)
     
     def _get_index_list(self, block_index: int) -> list[int]:
-        list = self._get_index_block(block_index).to_list()
+        # 只读的话不需要经过construct
+        list = [*_INDEX_BLOCK.unpack(self.object_accessor.read_raw_block(block_index))]
         while list and list[-1] == 0:
             list.pop()
         return list
@@ -132,24 +152,43 @@ class Inode:
                     yield index_3
                 start_index_3 = 0
             start_index_2 = 0
-    def block_list(self, start_block: int = 0, length: int = -1) -> Generator[int, None, None]:
+    def _read_block_list(self) -> Generator[int, None, None]:
         """
-        获取文件的块序号列表
+        从inode和索引块里读出全部block_count个块号
         """
-        if length < 0:
-            length = self.block_count - start_block
-        else:
-            length = min(length, self.block_count - start_block)
-        
+        length = self.block_count
         if length <= 0:
             return
         
-        for block_index in self._block_list(start_block):
+        for block_index in self._block_list(0):
             yield block_index
             length -= 1
             if length <= 0:
                 break
 
+    def block_map(self) -> array:
+        """
+        文件所有数据块的块号。第一次调用时把索引全部读出来，
+        之后随push_block和pop_block一起维护，不用再去读索引块
+        """
+        if self._block_map is None:
+            self._block_map = array('I', self._read_block_list())
+        return self._block_map
+
+    def block_list(self, start_block: int = 0, length: int = -1) -> Generator[int, None, None]:
+        """
+        获取文件的块序号列表
+        """
+        if length < 0:
+            end_block = self.block_count
+        else:
+            end_block = min(start_block + length, self.block_count)
+        
+        if end_block <= start_block:
+            return
+        
+        yield from self.block_map()[start_block:end_block]
+
     def peek_block(self, index: int) -> int:
         """
         获取文件的一个块
@@ -157,9 +196,6 @@ class Inode:
         iterator = self.block_list(index, 1)
         return next(iterator)
     
-    def _new_data_block_index(self) -> int:
-        return self.free_block_manager.allocate_block(zero=True)
-
     def _delete_data_block(self, index: int) -> None:
         self.free_block_manager.release_block(index)
 
@@ -167,49 +203,72 @@ class Inode:
         """
         向索引列表中添加一个新的索引
         """
-        insert_position: int = self.block_count
-        self.block_count += 1
-        index_1, index_2, index_3 = self._get_block_index(insert_position)
-        
-        # 小型文件
-        if insert_position < C.FILE_INDEX_SMALL_THRESHOLD:
-            self.data.d_addr[insert_position] = index
-            return
+        self.push_blocks([index])
+
+    def new_index_blocks(self, count: int) -> int:
+        """
+        再push_blocks count个块时要新分配多少个索引块
+        """
+        return index_block_count(self.block_count + count) - index_block_count(self.block_count)
+
+    def push_blocks(self, indexes: Iterable[int]) -> None:
+        """
+        向索引列表中依次添加若干个新的索引
+        用到的索引块先在内存里改好，最后每个索引块只写一次
+        """
+        index_blocks: dict[int, list[int]] = {}
+        def load(block_index: int, new: bool) -> list[int]:
+            if block_index not in index_blocks:
+                if new:  # 新的索引块整块都会被写入，不需要清零
+                    index_blocks[block_index] = [0] * C.FILE_INDEX_PER_BLOCK
+                else:
+                    index_blocks[block_index] = [*_INDEX_BLOCK.unpack(self.object_accessor.read_raw_block(block_index))]
+            return index_blocks[block_index]
         
-        # 大型文件
-        if insert_position < C.FILE_INDEX_LARGE_THRESHOLD:
-            # 是否应新增第一层索引块
-            if index_2 == 0:
-                self.data.d_addr[index_1] = self._new_data_block_index()
-            # 获取第一层索引块
-            block_1 = self._get_index_block(self.data.d_addr[index_1])
+        d_addr = self.data.d_addr
+        for index in indexes:
+            insert_position: int = self.block_count
+            if insert_position >= C.FILE_INDEX_HUGE_THRESHOLD:
+                raise Exception("文件已达最大大小，无法增加索引块")
+            index_1, index_2, index_3 = self._get_block_index(insert_position)
             
-            # 设置索引
-            block_1[index_2] = index
-            return
-        
-        # 巨型文件
-        if insert_position < C.FILE_INDEX_HUGE_THRESHOLD:
-            # 是否应新增第一层索引块
-            if index_2 == index_3 == 0:
-                self.data.d_addr[index_1] = self._new_data_block_index()
-            # 获取第一层索引块
-            block_1 = self._get_index_block(self.data.d_addr[index_1])
-
-            # 是否应新增第二层索引块
-            if index_3 == 0:
-                block_1[index_2] = self._new_data_block_index()
-            # 获取第二层索引块
-            block_2 = block_1.subblock(index_2)
+            # 小型文件
+            if insert_position < C.FILE_INDEX_SMALL_THRESHOLD:
+                d_addr[insert_position] = index
             
-            # 设置索引
-            block_2[index_3] = index
-            return
+            # 大型文件
+            elif insert_position < C.FILE_INDEX_LARGE_THRESHOLD:
+                # 是否应新增第一层索引块
+                if index_2 == 0:
+                    d_addr[index_1] = self.free_block_manager.allocate_block()
+                # 设置索引
+                load(d_addr[index_1], index_2 == 0)[index_2] = index
+            
+            # 巨型文件
+            else:
+                # 是否应新增第一层索引块
+                if index_2 == index_3 == 0:
+                    d_addr[index_1] = self.free_block_manager.allocate_block()
+                block_1 = load(d_addr[index_1], index_2 == index_3 == 0)
+                # 是否应新增第二层索引块
+                if index_3 == 0:
+                    block_1[index_2] = self.free_block_manager.allocate_block()
+                # 设置索引
+                load(block_1[index_2], index_3 == 0)[index_3] = index
+            
+            self.block_count += 1
+            if self._block_map is not None:
+                self._block_map.append(index)
         
-        raise Exception("文件已达最大大小，无法增加索引块")
+        self.object_accessor.write_raw_blocks([(block_index, _INDEX_BLOCK.pack(*block))
+                                               for block_index, block in index_blocks.items()])
     
     def pop_block(self) -> int:
         pop_position: int = self.block_count - 1
+        if pop_position < 0:
+            raise Exception("文件为空，无法删除索引块")
+        if self._block_map is not None:
+            self._block_map.pop()
         self.block_count -= 1
         index_1, index_2, index_3 = self._get_block_index(pop_position)
         
@@ -0,0 +1,109 @@
+import errno
+import mmap
+import os
+
+import constants as C
+from block_device import BlockDevice, CachedBlockDevice, ClusteredBlockDevice, ReadonlyCachedBlockDevice
+
+# 内存镜像：路径（以MEMORY_IMAGE_PREFIX开头）-> 镜像的全部内容
+# 用匿名mmap而不是bytearray，这样没写过的页不占内存，新建一个镜像也不用先把整段内存清零
+# 同一个进程里按同样的路径再次挂载，看到的是同一份数据；进程退出后就没有了
+_images: dict[str, mmap.mmap] = {}
+
+
+def is_memory_image(path: str) -> bool:
+    return path.startswith(C.MEMORY_IMAGE_PREFIX)
+
+
+def create_memory_image(path: str, size: int) -> None:
+    """
+    新建（或者清空）一个全是0的内存镜像
+    """
+    assert is_memory_image(path) and size % C.BLOCK_BYTES == 0
+    _images[path] = mmap.mmap(-1, size)
+
+
+def remove_memory_image(path: str) -> None:
+    _images.pop(path, None)
+
+
+def load_image(path: str, host_path: str) -> None:
+    """
+    把宿主机上的镜像文件整个读进内存镜像path
+    """
+    assert is_memory_image(path)
+    size = os.path.getsize(host_path)
+    assert size % C.BLOCK_BYTES == 0
+    data = mmap.mmap(-1, size)
+    with open(host_path, 'rb') as f:
+        f.readinto(data)
+    _images[path] = data
+
+
+def save_image(path: str, host_path: str) -> None:
+    """
+    把内存镜像写到宿主机上，必须在卸载之后调用
+    """
+    data = _images[path]
+    with open(host_path + '.tmp', 'wb') as f:
+        f.write(data)
+    os.replace(host_path + '.tmp', host_path)
+
+
+class MemoryBlockDevice(BlockDevice):
+    """
+    数据放在内存里的块设备，不打开任何文件，用于测试和只测CPU开销的基准测试。
+    内存里没有洞可打，discard总是关闭的
+    """
+    def __init__(self, path_to_image: str, readonly: bool = False, discard: bool = False):
+        if path_to_image not in _images:
+            raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), path_to_image)
+        self.path_to_image = path_to_image
+        self.readonly = readonly
+        self.data = _images[path_to_image]
+        self.image_size = len(self.data)
+        self.block_count = self.image_size // C.BLOCK_BYTES
+        self.image_file = None
+        self.fd = -1
+        self.discard_enabled = False
+        self.discards = None
+        self.known_zero = None
+
+    def read_block(self, block_number: int) -> bytes:
+        offset = block_number * C.BLOCK_BYTES
+        return self.data[offset : offset + C.BLOCK_BYTES]
+
+    def read_block_range(self, start: int, end: int) -> bytes:
+        return self.data[start * C.BLOCK_BYTES : end * C.BLOCK_BYTES]
+
+    def write_block(self, block_number: int, data: bytes) -> None:
+        self.check_writable()
+        offset = block_number * C.BLOCK_BYTES
+        self.data[offset : offset + len(data)] = data
+
+    def write_block_range(self, start: int, data: bytes) -> None:
+        assert len(data) % C.BLOCK_BYTES == 0
+        self.check_writable()
+        offset = start * C.BLOCK_BYTES
+        self.data[offset : offset + len(data)] = data
+
+    def write_block_vectors(self, start: int, buffers: list) -> None:
+        self.write_block_range(start, b"".join(buffers))
+
+    def sync(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class CachedMemoryBlockDevice(CachedBlockDevice, MemoryBlockDevice):
+    pass
+
+
+class ClusteredMemoryBlockDevice(ClusteredBlockDevice, MemoryBlockDevice):
+    pass
+
+
+class ReadonlyMemoryBlockDevice(ReadonlyCachedBlockDevice, MemoryBlockDevice):
+    pass
@@ -4,176 +4,244 @@ from __future__ import with_statement
 
 import os
 import sys
-import errno
-import time
-import stat
 
-from fuse import FUSE, FuseOSError, Operations, fuse_get_context
+from docopt import docopt
 
 from disk import Disk
-from inode import FILE_TYPE
-from utils import debug_print
-
-from docopt import docopt
-import constants as C
 
 doc = """
 Usage:
-    mount.py mount <image_path> <mountpoint> [-h | --help | -d | --debug]
-    mount.py format <image_path>
-    mount.py new <image_path>
+    mount.py mount <image_path> <mountpoint> [-h | --help | -d | --debug] [-s | --sidecar] [--defrag=<mb>] [--discard] [--cluster=<kb>] [--ro]
+    mount.py format <image_path> [--inode-blocks=<n>] [--disk-blocks=<n>]
+    mount.py new <image_path> [--inode-blocks=<n>] [--disk-blocks=<n>]
+    mount.py copy <image_path> <src> <dst>...
+    mount.py import <image_path> <host_dir> <image_dir> [--workers=<n>]
+    mount.py export <image_path> <destination> [--workers=<n>]
+    mount.py fsck <image_path> [--workers=<n>]
+    mount.py defrag <image_path>
+    mount.py compact <image_path> [<path>]
+    mount.py clone <image_path> <clone>...
+    mount.py commit <clone>
+    mount.py track <image_path> [--off]
+    mount.py backup <image_path> <delta>
+    mount.py restore <image_path> <delta>...
 
 Options:
-    -h, --help     Show this screen.
-    -d, --debug    Show debug information (and run in foreground).
+    -h, --help          Show this screen.
+    -d, --debug         Show debug information (and run in foreground).
+    -s, --sidecar       Keep allocator state in <image_path>.sidecar between mounts.
+    --defrag=<mb>       Defragment in the background, moving at most <mb> MB per second.
+    --discard           Punch holes in the image file for freed blocks.
+    --cluster=<kb>      Cache the image in aligned <kb> KB clusters instead of single blocks.
+    --ro                Mount read-only: nothing is written to the image and reads are served by multiple threads.
+    --inode-blocks=<n>  Number of blocks used by the inode table [default: 4096].
+    --disk-blocks=<n>   Total number of 512-byte blocks in the image [default: 65536].
+    --workers=<n>       Number of threads (import) or processes (export, fsck) [default: 8].
+    --off               Stop tracking changed blocks.
 """
 
-class MyFS(Operations):
-    def __init__(self, image_path, debug):
-        self.image_path = image_path
-        C.OUTPUT_LOG = debug
-        assert os.path.exists(image_path)
-        self.disk = Disk(image_path)
-        self.disk.mount()
-
-    # Filesystem methods
-    # ==================
-
-    def destroy(self, path = None):
-        debug_print("Calling [bold green]fsdestroy[/bold green]")
-        self.disk.unmount()
-        
-    def access(self, path, mode):
-        debug_print("Calling [bold green]access[/bold green] with path:", path, "and mode:", mode)
-        return 0
-
-    def chmod(self, path, mode):
-        debug_print("Calling [bold green]chmod[/bold green] with path:", path, "and mode:", mode)
-        pass
-
-    def chown(self, path, uid, gid):
-        debug_print("Calling [bold green]chown[/bold green] with path:", path, "uid:", uid, "and gid:", gid)
-        pass
-
-    def getattr(self, path, fh=None):
-        debug_print("Calling [bold green]getattr[/bold green] with path:", path)
-        result = self.disk.get_attr(path)
-        debug_print(result)
-        return result
-
-    def readdir(self, path, fh):
-        debug_print("Calling [bold green]readdir[/bold green] with path:", path, "and fh:", fh)
-        for e in self.disk.dir_list(path):
-            yield e
-
-    def readlink(self, path):
-        debug_print("Calling [bold green]readlink[/bold green] with path:", path)
-        raise NotImplementedError
-    
-    def mknod(self, path, mode, dev):
-        debug_print("Calling [bold green]mknod[/bold green] with path:", path, "mode:", mode, "and dev:", dev)
-        if mode & stat.S_IFREG:
-            self.disk.create(path, FILE_TYPE.FILE)
-        elif mode & stat.S_IFDIR:
-            self.disk.create(path, FILE_TYPE.DIR)
-        else:
-            raise NotImplementedError
-
-    def rmdir(self, path):
-        debug_print("Calling [bold green]rmdir[/bold green] with path:", path)
-        self.disk.unlink(path)
-
-    def mkdir(self, path, mode):
-        debug_print("Calling [bold green]mkdir[/bold green] with path:", path, "and mode:", mode)
-        self.disk.create(path, FILE_TYPE.DIR)
-
-    def statfs(self, path):
-        debug_print("Calling [bold green]statfs[/bold green]")
-        return self.disk.get_stats()
-
-    def unlink(self, path):
-        debug_print("Calling [bold green]unlink[/bold green] with path:", path)
-        self.disk.unlink(path)
-
-    def symlink(self, name, target):
-        debug_print("Calling [bold green]symlink[/bold green] with name:", name, "and target:", target)
-        raise NotImplementedError
-
-    def rename(self, old, new):
-        debug_print("Calling [bold green]rename[/bold green] with old:", old, "and new:", new)
-        self.disk.rename(old, new)
-
-    def link(self, target, name):
-        debug_print("Calling [bold green]link[/bold green] with target:", target, "and name:", name)
-        self.disk.link(target, name)
-
-    def utimens(self, path, times=None):
-        debug_print("Calling [bold green]utime[/bold green] with path:", path, "and times:", times)
-        if times:
-            atime, mtime = times
-        else:
-            atime = mtime = time.time()
-            
-        atime, mtime = int(atime), int(mtime)
-        self.disk.modify_timestamp(path, atime, mtime)
-
-    # File methods
-    # ============
-
-    def open(self, path, flags):
-        debug_print("Calling [bold green]open[/bold green] with path:", path, "and flags:", flags)
-        return 0
-
-    def create(self, path, mode, fi=None):
-        debug_print("Calling [bold green]create[/bold green] with path:", path, "and mode:", mode)
-        if mode & stat.S_IFREG:
-            return self.disk.create(path, FILE_TYPE.FILE).index
-        elif mode & stat.S_IFDIR:
-            return self.disk.create(path, FILE_TYPE.DIR).index
-        else:
-            raise NotImplementedError
-
-    def read(self, path, length, offset, fh):
-        debug_print("Calling [bold green]read[/bold green] with path:", path, "length:", length, "and offset:", offset)
-        return self.disk.read_file(path, offset, length)
-
-    def write(self, path, buf, offset, fh):
-        debug_print("Calling [bold green]write[/bold green] with path:", path, "buf:", "(omitted for performance reason)", "and offset:", offset)
-        length = len(buf)
-        debug_print("buf length:", length)
-        self.disk.write_file(path, offset, buf)
-        return length
-
-    def truncate(self, path, length, fh=None):
-        debug_print("Calling [bold green]truncate[/bold green] with path:", path, "and length:", length, "and fh:", fh)
-        self.disk.truncate(path, length)
-
-    def flush(self, path, fh):
-        debug_print("Calling [bold green]flush[/bold green] with path:", path, "and fh:", fh)
-        # self.disk.flush()
-        return 0
-
-    def release(self, path, fh):
-        debug_print("Calling [bold green]release[/bold green] with path:", path, "and fh:", fh)
-        return 0
-
-    def fsync(self, path, fdatasync, fh):
-        debug_print("Calling [bold green]fsync[/bold green] with path:", path, "and fdatasync:", fdatasync, "and fh:", fh)
-        self.disk.flush()
-
-
-def main(mountpoint, image_path, debug):
-    FUSE(MyFS(image_path, debug), mountpoint, nothreads=True, foreground=debug, allow_other=True)
+def main(mountpoint, image_path, debug, sidecar=False, defrag_rate=0.0, discard=False, cluster_bytes=0,
+         readonly=False):
+    # fuse只有挂载时才用得到，而且导入时就要去找libfuse，所以推迟到这里再导入
+    from fuse import FUSE
+    from myfs import MyFS
+
+    print('加载磁盘中...')
+    fs = MyFS(image_path, debug, sidecar, defrag_rate, discard, cluster_bytes, readonly)
+    print('磁盘挂载成功')
+    # 可写时所有操作都在一个线程里做；只读时读数据可以多个线程同时进行，内核那边也按只读挂载
+    FUSE(fs, mountpoint, nothreads=not readonly, foreground=debug, allow_other=True, ro=readonly)
+
+
+def copy(image_path, src, dsts):
+    """
+    在镜像内部把src复制到每一个dst，已存在的dst会被覆盖；
+    与src是同一个文件的dst（src本身或者它的硬连接）会被跳过，否则清空dst时src也被清空了
+    """
+    disk = Disk(image_path)
+    disk.mount()
+    try:
+        src_ino = disk.get_attr(src).st_ino
+        for dst in dsts:
+            if disk.exists(dst):
+                if disk.get_attr(dst).st_ino == src_ino:
+                    print(f'{src} -> {dst}: same file, skipped')
+                    continue
+                disk.truncate(dst, 0)
+            size = disk.copy_file(src, dst)
+            print(f'{src} -> {dst}: {size} bytes')
+    finally:
+        disk.unmount()
+
+
+def import_dir(image_path, host_dir, image_dir, workers):
+    """
+    不挂载，直接把宿主机上的目录导入到镜像里
+    """
+    from import_tree import import_tree
+
+    disk = Disk(image_path)
+    disk.mount()
+    try:
+        stats = import_tree(disk, host_dir, image_dir, workers)
+    finally:
+        disk.unmount()
+    for path, error in stats.errors:
+        print(f'{path}: {error}', file=sys.stderr)
+    for path in stats.skipped:
+        print(f'{path}: skipped (not a regular file or directory)', file=sys.stderr)
+    seconds = max(stats.seconds, 1e-9)
+    print(f'{stats.files} files, {stats.dirs} directories, {stats.bytes} bytes in {stats.seconds:.3f} s: '
+          f'{stats.bytes / seconds / 1024 / 1024:.1f} MB/s, {stats.files / seconds:.0f} files/s')
+    return not stats.errors
+
+
+def export(image_path, destination, workers):
+    """
+    不挂载，把镜像里的所有文件导出到宿主机上的目录，或者tar文件（destination以.tar结尾，'-'表示标准输出）
+    """
+    from export_tree import export_tree
+
+    stats = export_tree(image_path, destination, workers=workers)
+    seconds = max(stats.seconds, 1e-9)
+    # 输出tar到标准输出时，统计信息只能打到标准错误
+    print(f'{stats.files} files, {stats.dirs} directories, {stats.bytes} bytes in {stats.seconds:.3f} s: '
+          f'{stats.bytes / seconds / 1024 / 1024:.1f} MB/s, {stats.files / seconds:.0f} files/s', file=sys.stderr)
+
+
+def check(image_path, workers):
+    """
+    离线检查镜像，没有问题时返回True
+    """
+    from fsck import fsck
+
+    report = fsck(image_path, workers)
+    for block, owners in report.double_allocated:
+        print(f'block {block} is used by {", ".join(map(str, owners))}')
+    if report.leaked:
+        print(f'{len(report.leaked)} leaked blocks: {report.leaked[:20]}{" ..." if len(report.leaked) > 20 else ""}')
+    for ino in report.orphaned:
+        print(f'inode {ino} is allocated but not reachable from /')
+    for dir_ino, name, ino in report.dangling:
+        print(f'entry {name!r} in directory inode {dir_ino} points to free inode {ino}')
+    for ino, block in report.bad_pointers:
+        print(f'inode {ino} points to block {block} outside the data area')
+    for ino, nlink, references in report.bad_nlink:
+        print(f'inode {ino} has d_nlink {nlink} but {references} directory entries')
+    for message in report.free_list + report.counters:
+        print(message)
+    print(f'{report.inodes} inodes, {report.blocks} blocks checked in {report.seconds:.3f} s: '
+          f'{"clean" if report.clean else "PROBLEMS FOUND"}')
+    return report.clean
+
+
+def defrag(image_path):
+    """
+    离线整理碎片
+    """
+    from defrag import Defragmenter
+
+    disk = Disk(image_path)
+    disk.mount()
+    try:
+        stats = Defragmenter(disk).run()
+    finally:
+        disk.unmount()
+    print(f'moved {stats.files} files ({stats.blocks} blocks) in {stats.seconds:.3f} s, '
+          f'fragmentation {stats.before:.1%} -> {stats.after:.1%}')
+
+
+def compact(image_path, path):
+    """
+    离线把path下面的所有目录挤紧，释放空出来的目录块
+    """
+    disk = Disk(image_path)
+    disk.mount()
+    try:
+        dirs, released = disk.compact_dirs(path)
+    finally:
+        disk.unmount()
+    print(f'compacted {dirs} directories, released {released} blocks')
+
+
+def clone(image_path, clones):
+    """
+    为image_path创建若干个写时复制的克隆，每个克隆都可以像普通镜像一样挂载
+    """
+    import time
+    from cow_device import create_clone
+
+    start = time.perf_counter()
+    for path in clones:
+        create_clone(image_path, path)
+    print(f'created {len(clones)} clones of {image_path} in {time.perf_counter() - start:.3f} s')
+
+
+def commit(clone_path):
+    """
+    把克隆里写过的块合并回它的底包
+    """
+    from cow_device import commit_clone
+
+    print(f'merged {commit_clone(clone_path)} blocks into the base image of {clone_path}')
+
+
+def backup(image_path, delta_path):
+    """
+    把自上一次备份以来改过的块写成一个增量
+    """
+    import time
+    from change_tracking import emit_delta
+
+    start = time.perf_counter()
+    sequence, blocks = emit_delta(image_path, delta_path)
+    print(f'delta {sequence}: {blocks} blocks ({blocks * 512} bytes) in {time.perf_counter() - start:.3f} s')
+
+
+def restore(image_path, delta_paths):
+    """
+    按顺序应用一串增量，image_path不存在时从第一个（完整的）增量开始重建
+    """
+    from change_tracking import apply_deltas
+
+    print(f'applied {len(delta_paths)} deltas, {apply_deltas(image_path, delta_paths)} blocks')
 
 
 if __name__ == '__main__':
     # main(sys.argv[2], sys.argv[1])
     args = docopt(doc)
     if args['mount']:
-        main(args['<mountpoint>'], args['<image_path>'], args['--debug'])
-    elif args['format']:
-        disk = Disk(args['<image_path>'])
-        disk.format()
-    elif args['new']:
-        disk = Disk.new(args['<image_path>'])
+        main(args['<mountpoint>'], args['<image_path>'], args['--debug'], args['--sidecar'],
+             float(args['--defrag'] or 0), args['--discard'], int(args['--cluster'] or 0) * 1024,
+             args['--ro'])
+    elif args['import']:
+        if not import_dir(args['<image_path>'], args['<host_dir>'], args['<image_dir>'], int(args['--workers'])):
+            sys.exit(1)
+    elif args['export']:
+        export(args['<image_path>'], args['<destination>'], int(args['--workers']))
+    elif args['fsck']:
+        if not check(args['<image_path>'], int(args['--workers'])):
+            sys.exit(1)
+    elif args['defrag']:
+        defrag(args['<image_path>'])
+    elif args['clone']:
+        clone(args['<image_path>'], args['<clone>'])
+    elif args['commit']:
+        commit(args['<clone>'][0])
+    elif args['track']:
+        from change_tracking import enable_tracking, disable_tracking
+        if args['--off']:
+            disable_tracking(args['<image_path>'])
+        else:
+            enable_tracking(args['<image_path>'])
+    elif args['backup']:
+        backup(args['<image_path>'], args['<delta>'][0])
+    elif args['restore']:
+        restore(args['<image_path>'], args['<delta>'])
+    elif args['compact']:
+        compact(args['<image_path>'], args['<path>'] or '/')
+    elif args['copy']:
+        copy(args['<image_path>'], args['<src>'], args['<dst>'])
+    elif args['format'] or args['new']:
+        disk = Disk.new(args['<image_path>'], int(args['--inode-blocks']), int(args['--disk-blocks']))
         
\ No newline at end of file
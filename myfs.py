@@ -0,0 +1,266 @@
+import os
+import errno
+import time
+import stat
+import threading
+
+from fuse import FuseOSError, Operations, fuse_get_context
+
+from disk import Disk
+from file import File, OpenedFiles
+from inode import FILE_TYPE
+from utils import debug_print
+
+import constants as C
+
+
+# 会修改文件系统的操作，只读挂载时直接返回EROFS
+_MUTATING_OPS = frozenset({
+    'chmod', 'chown', 'mknod', 'mkdir', 'rmdir', 'unlink', 'symlink', 'rename', 'link', 'utimens',
+    'create', 'write', 'truncate', 'copy_file_range',
+})
+_WRITE_FLAGS = os.O_WRONLY | os.O_RDWR | os.O_APPEND | os.O_CREAT | os.O_TRUNC
+
+
+class MyFS(Operations):
+    def __init__(self, image_path, debug, sidecar=False, defrag_rate=0.0, discard=False, cluster_bytes=0,
+                 readonly=False):
+        """
+        defrag_rate: 挂载期间在后台整理碎片，每秒最多搬多少MB，0表示不整理
+        discard: 被释放的块在镜像文件里打洞
+        cluster_bytes: 块设备按这么大的簇缓存，0表示逐块缓存
+        readonly: 只读挂载，镜像不会被修改（连超级块也不会写），所有修改操作都返回EROFS；
+                  读文件数据不需要拿锁，可以由多个FUSE线程同时进行
+        """
+        self.image_path = image_path
+        C.OUTPUT_LOG = debug
+        assert os.path.exists(image_path)
+        self.readonly = readonly
+        self.disk = Disk(image_path, sidecar=sidecar, readonly=readonly, discard=discard, cluster_bytes=cluster_bytes)
+        self.disk.mount()
+        self.files = OpenedFiles()
+        # 缓冲区里有数据的句柄
+        self.dirty_handles: set[int] = set()
+        # 所有文件系统操作和后台整理碎片互斥（只读挂载时读文件数据除外）
+        self.lock = threading.RLock()
+        self.defrag_rate = 0.0 if readonly else defrag_rate
+        self.stopping = threading.Event()
+        self.defrag_thread: threading.Thread | None = None
+
+    def __call__(self, op, *args):
+        if self.readonly:
+            if op in _MUTATING_OPS:
+                raise FuseOSError(errno.EROFS)
+            if op == 'read':
+                # 只读时块设备和打开着的Inode都不会再变，读数据不用和别的操作互斥
+                return super().__call__(op, *args)
+        if op == 'destroy':
+            # 后台线程可能正在等锁，要在拿锁之前让它停下来
+            self._stop_defrag()
+        with self.lock:
+            return super().__call__(op, *args)
+
+    def _stop_defrag(self) -> None:
+        self.stopping.set()
+        if self.defrag_thread is not None:
+            self.defrag_thread.join()
+            self.defrag_thread = None
+
+    def _defrag_loop(self) -> None:
+        from defrag import Defragmenter
+
+        defragmenter = Defragmenter(self.disk)
+        budget = max(int(self.defrag_rate * 1024 * 1024 * C.DEFRAG_INTERVAL) // C.BLOCK_BYTES, 1)
+        while not self.stopping.wait(C.DEFRAG_INTERVAL):
+            with self.lock:
+                if defragmenter.step(budget) == 0:
+                    debug_print(f"碎片整理完成，共搬动了{defragmenter.moved_files}个文件")
+                    return
+
+    # 把文件句柄里攒着的写入写到磁盘上
+    def _write_back(self, handle: int) -> None:
+        if handle not in self.dirty_handles:
+            return
+        self.dirty_handles.discard(handle)
+        file = self.files.get(handle)
+        offset, data = file.take_pending()
+        self.disk.write_inode(file.inode, offset, data)
+
+    def _write_back_inode(self, inode_no: int) -> None:
+        # 只读挂载时永远是空的，这时read不拿锁，不能去碰by_inode
+        if not self.dirty_handles:
+            return
+        for handle in self.files.by_inode.get(inode_no, ()):
+            self._write_back(handle)
+
+    def _write_back_all(self) -> None:
+        for handle in list(self.dirty_handles):
+            self._write_back(handle)
+
+    # Filesystem methods
+    # ==================
+
+    def init(self, path):
+        if self.defrag_rate > 0:
+            self.defrag_thread = threading.Thread(target=self._defrag_loop, daemon=True)
+            self.defrag_thread.start()
+
+    def destroy(self, path = None):
+        debug_print("Calling [bold green]fsdestroy[/bold green]")
+        self._stop_defrag()
+        self._write_back_all()
+        self.disk.unmount()
+        
+    def access(self, path, mode):
+        debug_print("Calling [bold green]access[/bold green] with path:", path, "and mode:", mode)
+        return 0
+
+    def chmod(self, path, mode):
+        debug_print("Calling [bold green]chmod[/bold green] with path:", path, "and mode:", mode)
+        pass
+
+    def chown(self, path, uid, gid):
+        debug_print("Calling [bold green]chown[/bold green] with path:", path, "uid:", uid, "and gid:", gid)
+        pass
+
+    def getattr(self, path, fh=None):
+        debug_print("Calling [bold green]getattr[/bold green] with path:", path)
+        # 文件大小要算上还没写到磁盘上的数据，只写回这个文件自己的句柄
+        if self.dirty_handles:
+            self._write_back_inode(self.disk._get_inode(path).index)
+        result = self.disk.get_attr(path)
+        debug_print(result)
+        return result
+
+    def readdir(self, path, fh):
+        debug_print("Calling [bold green]readdir[/bold green] with path:", path, "and fh:", fh)
+        for e in self.disk.dir_list(path):
+            yield e
+
+    def readlink(self, path):
+        debug_print("Calling [bold green]readlink[/bold green] with path:", path)
+        raise NotImplementedError
+    
+    def mknod(self, path, mode, dev):
+        debug_print("Calling [bold green]mknod[/bold green] with path:", path, "mode:", mode, "and dev:", dev)
+        if mode & stat.S_IFREG:
+            self.disk.create(path, FILE_TYPE.FILE)
+        elif mode & stat.S_IFDIR:
+            self.disk.create(path, FILE_TYPE.DIR)
+        else:
+            raise NotImplementedError
+
+    def rmdir(self, path):
+        debug_print("Calling [bold green]rmdir[/bold green] with path:", path)
+        self.disk.unlink(path)
+
+    def mkdir(self, path, mode):
+        debug_print("Calling [bold green]mkdir[/bold green] with path:", path, "and mode:", mode)
+        self.disk.create(path, FILE_TYPE.DIR)
+
+    def statfs(self, path):
+        debug_print("Calling [bold green]statfs[/bold green]")
+        return self.disk.get_stats()
+
+    def unlink(self, path):
+        debug_print("Calling [bold green]unlink[/bold green] with path:", path)
+        self._write_back_all()
+        self.disk.unlink(path)
+
+    def symlink(self, name, target):
+        debug_print("Calling [bold green]symlink[/bold green] with name:", name, "and target:", target)
+        raise NotImplementedError
+
+    def rename(self, old, new):
+        debug_print("Calling [bold green]rename[/bold green] with old:", old, "and new:", new)
+        self._write_back_all()
+        self.disk.rename(old, new)
+
+    def link(self, target, name):
+        debug_print("Calling [bold green]link[/bold green] with target:", target, "and name:", name)
+        self.disk.link(target, name)
+
+    def utimens(self, path, times=None):
+        debug_print("Calling [bold green]utime[/bold green] with path:", path, "and times:", times)
+        if times:
+            atime, mtime = times
+        else:
+            atime = mtime = time.time()
+            
+        atime, mtime = int(atime), int(mtime)
+        self.disk.modify_timestamp(path, atime, mtime)
+
+    # File methods
+    # ============
+
+    def open(self, path, flags):
+        debug_print("Calling [bold green]open[/bold green] with path:", path, "and flags:", flags)
+        if self.readonly and flags & _WRITE_FLAGS:
+            raise FuseOSError(errno.EROFS)
+        inode = self.disk.open_inode(path)
+        return self.files.add(File(path, inode))
+
+    def create(self, path, mode, fi=None):
+        debug_print("Calling [bold green]create[/bold green] with path:", path, "and mode:", mode)
+        if mode & stat.S_IFREG:
+            self.disk.create(path, FILE_TYPE.FILE)
+        elif mode & stat.S_IFDIR:
+            self.disk.create(path, FILE_TYPE.DIR)
+        else:
+            raise NotImplementedError
+        return self.open(path, os.O_RDWR)
+
+    def read(self, path, length, offset, fh):
+        debug_print("Calling [bold green]read[/bold green] with path:", path, "length:", length, "and offset:", offset)
+        file = self.files.get(fh)
+        self._write_back_inode(file.inode.index)
+        return self.disk.read_inode(file.inode, offset, length)
+
+    def write(self, path, buf, offset, fh):
+        debug_print("Calling [bold green]write[/bold green] with path:", path, "buf:", "(omitted for performance reason)", "and offset:", offset)
+        length = len(buf)
+        debug_print("buf length:", length)
+        file = self.files.get(fh)
+        # 连续的写入先攒在句柄里，攒够了或者接不上了再一起写
+        if not file.buffer(offset, buf):
+            self._write_back(fh)
+            file.buffer(offset, buf)
+        self.dirty_handles.add(fh)
+        if file.buffer_full:
+            self._write_back(fh)
+        return length
+
+    def truncate(self, path, length, fh=None):
+        debug_print("Calling [bold green]truncate[/bold green] with path:", path, "and length:", length, "and fh:", fh)
+        if fh:
+            file = self.files.get(fh)
+            self._write_back_inode(file.inode.index)
+            self.disk.truncate_inode(file.inode, length)
+        else:
+            self._write_back_all()
+            self.disk.truncate(path, length)
+
+    def flush(self, path, fh):
+        debug_print("Calling [bold green]flush[/bold green] with path:", path, "and fh:", fh)
+        self._write_back(fh)
+        return 0
+
+    def release(self, path, fh):
+        debug_print("Calling [bold green]release[/bold green] with path:", path, "and fh:", fh)
+        self._write_back(fh)
+        file = self.files.pop(fh)
+        self.disk.close_inode(file.inode)
+        return 0
+
+    def copy_file_range(self, path_in, fh_in, offset_in, path_out, fh_out, offset_out, length, flags):
+        # fusepy 3.0.1还不会调用这个方法，支持copy_file_range的FUSE绑定会用这个签名来调用
+        debug_print("Calling [bold green]copy_file_range[/bold green] from:", path_in, "to:", path_out, "and length:", length)
+        file_in, file_out = self.files.get(fh_in), self.files.get(fh_out)
+        self._write_back_inode(file_in.inode.index)
+        self._write_back_inode(file_out.inode.index)
+        return self.disk.copy_inode(file_in.inode, offset_in, file_out.inode, offset_out, length)
+
+    def fsync(self, path, fdatasync, fh):
+        debug_print("Calling [bold green]fsync[/bold green] with path:", path, "and fdatasync:", fdatasync, "and fh:", fh)
+        self._write_back(fh)
+        self.disk.flush()
@@ -1,9 +1,169 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING, Generic, Iterable, TypeVar
+from contextlib import contextmanager
+import operator
 from block_device import CachedBlockDevice
 import constants as C
 import disk_params as DiskParams
-from structures import *
-from construct import Container
-from lazy_array import LazyArray
+import structures as S
+if TYPE_CHECKING:
+    from construct import Container
+
+# d_mode的第二个字节的最高位是IALLOC位，这个表把它转换成0/1
+_IALLOC_TABLE = bytes((b >> 7) & 1 for b in range(256))
+
+ItemType = TypeVar('ItemType')
+
+
+def _consecutive_runs(indices: list[int]) -> list[tuple[int, int]] | None:
+    """
+    把indices按原来的顺序分成若干段块号连续递增的部分：[(在indices里的起点, 终点)]，
+    一个连续的都没有时返回None，调用者逐块处理就行
+    """
+    # 相邻两个块号的差，1表示连续
+    steps = list(map(operator.sub, indices[1:], indices[:-1]))
+    ones = steps.count(1)
+    if ones == 0:
+        return None
+    if ones == len(steps):
+        return [(0, len(indices))]
+    breaks = [i for i, step in enumerate(steps, 1) if step != 1]
+    return list(zip([0] + breaks, breaks + [len(indices)]))
+
+
+class BlockAccessor(Generic[ItemType]):
+    """
+    一种盘块的读写接口，每种盘块一个，挂载期间一直是同一个对象。
+    get/set读写一个块；get_many/set_many一次读写若干个块，块号连续的部分一次读写完。
+    这个类本身读写的是块的原始数据（文件数据块），子类StructBlockAccessor负责解析和打包
+    """
+    def __init__(self, object_accessor: ObjectAccessor):
+        self.object_accessor = object_accessor
+
+    def parse(self, data: bytes) -> ItemType:
+        return data
+
+    def build(self, value: ItemType) -> bytes:
+        return value
+
+    def get(self, index: int) -> ItemType:
+        return self.object_accessor._read_block(index)
+
+    def set(self, index: int, value: ItemType) -> None:
+        self.object_accessor._write_data_block(index, value)
+
+    def _read_many(self, indices: list[int]) -> list[bytes]:
+        accessor = self.object_accessor
+        runs = _consecutive_runs(indices)
+        if runs is None:
+            return [accessor._read_block(index) for index in indices]
+        blocks = []
+        for start, end in runs:
+            if end - start == 1:
+                blocks.append(accessor._read_block(indices[start]))
+                continue
+            data = accessor.read_raw_block_range(indices[start], indices[end - 1] + 1)
+            blocks += [data[i : i + C.BLOCK_BYTES] for i in range(0, len(data), C.BLOCK_BYTES)]
+        return blocks
+
+    def get_many(self, indices: list[int]) -> list[ItemType]:
+        return self._read_many(indices)
+
+    def set_many(self, items: Iterable[tuple[int, ItemType]]) -> None:
+        indices, buffers = [], []
+        for index, value in items:
+            indices.append(index)
+            buffers.append(self.build(value))
+        self._write_many(indices, buffers)
+
+    def _write_many(self, indices: list[int], buffers: list[bytes]) -> None:
+        if (runs := _consecutive_runs(indices)) is None:
+            for index, buffer in zip(indices, buffers):
+                self.object_accessor._write_data_block(index, buffer)
+            return
+        for start, end in runs:
+            self.object_accessor.write_raw_vectors(indices[start], buffers[start:end])
+
+
+class StructBlockAccessor(BlockAccessor[ItemType]):
+    """
+    元数据块（目录块、索引块）的读写接口，读出来时用structures里名为struct_name的结构解析，
+    写回时打包。元数据的修改在batch里会先攒起来
+    """
+    def __init__(self, object_accessor: ObjectAccessor, struct_name: str):
+        super().__init__(object_accessor)
+        # structures里的结构第一次被访问时才会构造，所以这里只记名字
+        self.struct_name = struct_name
+        self.struct = None
+
+    def parse(self, data: bytes) -> ItemType:
+        if self.struct is None:
+            self.struct = getattr(S, self.struct_name)
+        return self.struct.parse(data)
+
+    def build(self, value: ItemType) -> bytes:
+        if self.struct is None:
+            self.struct = getattr(S, self.struct_name)
+        return self.struct.build(value)
+
+    def get(self, index: int) -> ItemType:
+        return self.parse(self.object_accessor._read_block(index))
+
+    def get_many(self, indices: list[int]) -> list[ItemType]:
+        return [self.parse(data) for data in self._read_many(indices)]
+
+    def set(self, index: int, value: ItemType) -> None:
+        self.object_accessor._write_metadata_block(index, self.build(value))
+
+    def _write_many(self, indices: list[int], buffers: list[bytes]) -> None:
+        if (runs := _consecutive_runs(indices)) is None:
+            self.object_accessor.write_raw_blocks(list(zip(indices, buffers)))
+            return
+        self.object_accessor.write_raw_blocks([(indices[start], b"".join(buffers[start:end])) for start, end in runs])
+
+
+class InodeAccessor:
+    """
+    inode的读写接口，每个inode单独解析和打包，不用把整块的8个都解析出来。
+    注意：如果读出来的inode里有一个列表（比如d_addr），那修改这个列表并不会被保存，
+    需要直接替换那个列表再set才行。
+    get_many/set_many里落在同一块的inode只读写一次
+    """
+    def __init__(self, object_accessor: ObjectAccessor):
+        self.object_accessor = object_accessor
+
+    def get(self, index: int) -> Container:
+        block_index = DiskParams.INODE_START + index // C.INODE_PER_BLOCK
+        offset = index % C.INODE_PER_BLOCK * C.INODE_BYTES
+        block_bytes = self.object_accessor._read_block(block_index)
+        return S.InodeStruct.parse(block_bytes[offset : offset + C.INODE_BYTES])
+
+    def set(self, index: int, value: Container) -> None:
+        self.set_many([(index, value)])
+
+    def get_many(self, indices: list[int]) -> list[Container]:
+        blocks: dict[int, bytes] = {}
+        inodes = []
+        for index in indices:
+            block_index = DiskParams.INODE_START + index // C.INODE_PER_BLOCK
+            block_bytes = blocks.get(block_index)
+            if block_bytes is None:
+                block_bytes = blocks[block_index] = self.object_accessor._read_block(block_index)
+            offset = index % C.INODE_PER_BLOCK * C.INODE_BYTES
+            inodes.append(S.InodeStruct.parse(block_bytes[offset : offset + C.INODE_BYTES]))
+        return inodes
+
+    def set_many(self, items: Iterable[tuple[int, Container]]) -> None:
+        blocks: dict[int, bytearray] = {}
+        for index, value in items:
+            block_index = DiskParams.INODE_START + index // C.INODE_PER_BLOCK
+            block_bytes = blocks.get(block_index)
+            if block_bytes is None:
+                block_bytes = blocks[block_index] = bytearray(self.object_accessor._read_block(block_index))
+            offset = index % C.INODE_PER_BLOCK * C.INODE_BYTES
+            block_bytes[offset : offset + C.INODE_BYTES] = S.InodeStruct.build(value)
+        for block_index, block_bytes in blocks.items():
+            self.object_accessor._write_metadata_block(block_index, bytes(block_bytes))
 
 
 class ObjectAccessor:
@@ -12,96 +172,142 @@ class ObjectAccessor:
     只负责单个对象的读写，不考虑多个对象之间的联系
     只要读取此对象的属性，即可访问磁盘中对应的对象
     修改此对象的属性，则会自动将更改写回磁盘
+    在batch()里面时，对元数据（inode、目录块、索引块）的修改先攒在内存里，
+    batch结束时每个被改过的块只写一次
     """
     def __init__(self, block_device: CachedBlockDevice):
         self.block_device = block_device
-    
-    # 给下面读写数据块用的工厂方法
-    def _create_lazy_proxy_array(self, parser, builder, item_type) -> LazyArray:
-        def getter(index):
-            # block_index = DATA_START + index
-            block_index = index
-            block_bytes = self.block_device.read_block(block_index)
-            return parser(block_bytes)
-
-        def setter(index, value) -> None:
-            # block_index = DATA_START + index
-            block_index = index
-            block_bytes = builder(value)
-            self.block_device.write_block(block_index, block_bytes)
-
-        return LazyArray[item_type](DiskParams.DISK_BLOCKS, getter, setter)
+        # batch期间被修改过的元数据块：块号 -> 块的内容
+        self.pending: dict[int, bytes] = {}
+        self.batch_depth = 0
+        # 各种对象的读写接口
+        self.inodes = InodeAccessor(self)
+        # 数据块分为文件数据块、目录数据块、文件索引块，以及空白块索引块
+        self.file_blocks: BlockAccessor[bytes] = BlockAccessor(self)
+        self.dir_blocks: StructBlockAccessor[list[Container]] = StructBlockAccessor(self, 'DirectoryBlockStruct')
+        self.file_index_blocks: StructBlockAccessor[list[int]] = StructBlockAccessor(self, 'FileIndexBlock')
+        self.free_index_blocks: StructBlockAccessor[Container] = StructBlockAccessor(self, 'FreeBlockIndexBlock')
+
+    @contextmanager
+    def batch(self):
+        """
+        可以嵌套，最外层的batch结束时才写回
+        """
+        self.batch_depth += 1
+        try:
+            yield
+        finally:
+            self.batch_depth -= 1
+            if self.batch_depth == 0:
+                self._write_pending()
+
+    def _write_pending(self) -> None:
+        # 按块号排序，块号连续的一次写入
+        pending = sorted(self.pending.items())
+        self.pending = {}
+        run_start, run = 0, []
+        for block_index, data in pending:
+            if run and block_index == run_start + len(run):
+                run.append(data)
+                continue
+            if run:
+                self.block_device.write_block_range(run_start, b"".join(run))
+            run_start, run = block_index, [data]
+        if run:
+            self.block_device.write_block_range(run_start, b"".join(run))
+
+    def _read_block(self, block_index: int) -> bytes:
+        data = self.pending.get(block_index)
+        if data is not None:
+            return data
+        return self.block_device.read_block(block_index)
+
+    def _write_metadata_block(self, block_index: int, data: bytes) -> None:
+        if self.batch_depth:
+            self.pending[block_index] = data
+        else:
+            self.block_device.write_block(block_index, data)
 
+    def _write_data_block(self, block_index: int, data: bytes) -> None:
+        # 这个块以前可能是元数据块，batch里还没写回的旧内容就不要了
+        self.pending.pop(block_index, None)
+        self.block_device.write_block(block_index, data)
+    
     # 超级块的读写接口
     @property
     def superblock(self) -> Container:
         data = self.block_device.read_block_range(DiskParams.SUPERBLOCK_START, DiskParams.SUPERBLOCK_START + C.SUPERBLOCK_BLOCKS)
-        return SuperBlockStruct.parse(data)
+        return S.SuperBlockStruct.parse(data)
     
     @superblock.setter
     def superblock(self, value: Container):
-        data = SuperBlockStruct.build(value)
+        data = S.SuperBlockStruct.build(value)
         self.block_device.write_block_range(DiskParams.SUPERBLOCK_START, data)
     
-    # inode的读写接口
-    @property
-    def inodes(self) -> LazyArray[Container]:
+    # 不经过construct，直接读写超级块的原始数据
+    def read_raw_superblock(self) -> bytes:
+        return self.block_device.read_block_range(DiskParams.SUPERBLOCK_START, DiskParams.SUPERBLOCK_START + C.SUPERBLOCK_BLOCKS)
+
+    def write_raw_superblock(self, data: bytes) -> None:
+        self.block_device.write_block_range(DiskParams.SUPERBLOCK_START, data)
+    
+    def inode_alloc_map(self) -> bytes:
         """
-        inode的读写接口。
-        这个inodes本身是一个定长的数组，不能直接被修改，
-        但是我们可以对inodes里面的元素进行访问和修改，
-        所做的修改会自动保存至磁盘。
-        注意：如果这个LazyArray的元素是一个列表，那修改这个元素列表并不会被保存，
-        需要直接替换那个列表才行。
+        一次性读出整个inode区，返回每个inode是否已分配（每个inode一个字节，0或1）
+        只看IALLOC位，不解析整个inode，比逐个读取inodes快得多
         """
-        def getter(index) -> Container:
-            block_index = DiskParams.INODE_START + index // C.INODE_PER_BLOCK
-            inode_index = index % C.INODE_PER_BLOCK
-            
-            block_bytes = self.block_device.read_block(block_index)
-            return InodeBlockStruct.parse(block_bytes)[inode_index]
-        
-        def setter(index, value: Container) -> None:
-            block_index = DiskParams.INODE_START + index // C.INODE_PER_BLOCK
-            inode_index = index % C.INODE_PER_BLOCK
-            
-            block_bytes = self.block_device.read_block(block_index)
-            inode_block = InodeBlockStruct.parse(block_bytes)
-            
-            inode_block[inode_index] = value
-            block_bytes = InodeBlockStruct.build(inode_block)
-            self.block_device.write_block(block_index, block_bytes)
-            
-        return LazyArray[Container](DiskParams.INODE_COUNT, getter, setter)
+        data = self.read_raw_block_range(DiskParams.INODE_START, DiskParams.INODE_START + DiskParams.INODE_BLOCKS)
+        return data[1::C.INODE_BYTES].translate(_IALLOC_TABLE)
     
-    # 数据块分为文件数据块、目录数据块、文件索引块，以及空白块索引块
-    # 文件数据块
-    @property
-    def file_blocks(self) -> LazyArray[bytes]:
-        return self._create_lazy_proxy_array(lambda x: x, lambda x: x, bytes)
-   
-    # 目录数据块
-    @property
-    def dir_blocks(self) -> LazyArray[list[Container]]:
-        parser = DirectoryBlockStruct.parse
-        builder = DirectoryBlockStruct.build
-        return self._create_lazy_proxy_array(parser, builder, list[Container])
+    # 不经过construct，直接读取一个块的原始数据
+    def read_raw_block(self, block_index: int) -> bytes:
+        return self._read_block(block_index)
+
+    def _pending_in(self, start: int, end: int) -> list[int]:
+        # batch里攒着的块可能很多（比如整个导入都在一个batch里），哪边少就遍历哪边
+        if end - start < len(self.pending):
+            return [i for i in range(start, end) if i in self.pending]
+        return [i for i in self.pending if start <= i < end]
+
+    # 直接读取[start, end)这一段连续的块
+    def read_raw_block_range(self, start: int, end: int) -> bytes:
+        data = self.block_device.read_block_range(start, end)
+        pending = self._pending_in(start, end)
+        if not pending:
+            return data
+        buffer = bytearray(data)
+        for i in pending:
+            position = (i - start) * C.BLOCK_BYTES
+            buffer[position : position + C.BLOCK_BYTES] = self.pending[i]
+        return bytes(buffer)
+
+    # 不经过construct，直接写入若干个已经打包好的元数据块
+    def write_raw_blocks(self, blocks: list[tuple[int, bytes]]) -> None:
+        if not self.batch_depth:
+            for block_index, data in blocks:
+                self.block_device.write_block_range(block_index, data)
+            return
+        for block_index, data in blocks:
+            for i in range(len(data) // C.BLOCK_BYTES):
+                self.pending[block_index + i] = bytes(data[i * C.BLOCK_BYTES : (i + 1) * C.BLOCK_BYTES])
+
+    # 把若干段数据拼起来，从start开始连续写入（文件数据）
+    def write_raw_vectors(self, start: int, buffers: list) -> None:
+        end = start + sum(len(buffer) for buffer in buffers) // C.BLOCK_BYTES
+        for i in self._pending_in(start, end):
+            del self.pending[i]
+        self.block_device.write_block_vectors(start, buffers)
 
-    # 文件索引块
-    @property
-    def file_index_blocks(self) -> LazyArray[list[int]]:
-        parser = FileIndexBlock.parse
-        builder = FileIndexBlock.build
-        return self._create_lazy_proxy_array(parser, builder, list[int])
-    
-    # 空白块索引块
-    @property
-    def free_index_blocks(self) -> LazyArray[Container]:
-        parser = FreeBlockIndexBlock.parse
-        builder = FreeBlockIndexBlock.build
-        return self._create_lazy_proxy_array(parser, builder, Container)
-    
     # 清空一个数据块
     def clear_data_block(self, block_index: int) -> None:
-        self.block_device.write_block(block_index, b'\x00' * C.DATA_BLOCK_BYTES)
+        # 打过洞的块本来就全是0，不用再写（batch里攒着的内容还没写下去，不算）
+        if block_index not in self.pending and self.block_device.is_known_zero(block_index):
+            return
+        self._write_data_block(block_index, b'\x00' * C.DATA_BLOCK_BYTES)
+
+    def discard_blocks(self, start: int, end: int) -> None:
+        """
+        [start, end)里的块已经被释放了，开启了discard的话会在flush时打洞
+        """
+        self.block_device.discard(start, end)
         
\ No newline at end of file
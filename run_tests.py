@@ -1,6 +1,16 @@
 import unittest
 
-from unittests.test_disk import NewDiskTestCase
+from unittests.test_disk import NewDiskTestCase, OpenInodeTestCase, FileBufferTestCase, BatchTestCase, ReadonlyTestCase, DirCompactTestCase, DiscardTestCase, MemoryImageTestCase, AccessorTestCase
+from unittests.test_file import OpenedFilesTestCase, DiskWithHandleTestCase
+from unittests.test_rename import RenameTestCase
+from unittests.test_import_tree import ImportTreeTestCase
+from unittests.test_export_tree import ExportTreeTestCase
+from unittests.test_fsck import FsckTestCase
+from unittests.test_defrag import DefragTestCase
+from unittests.test_cow_device import CowDeviceTestCase
+from unittests.test_change_tracking import ChangeTrackingTestCase
+from unittests.test_block_device import ClusteredDeviceTestCase
+from unittests.test_superblock import InodeAllocationTestCase, FormatTestCase, SuperblockSyncTestCase
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
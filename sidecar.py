@@ -0,0 +1,72 @@
+import os
+import struct
+import zlib
+
+import constants as C
+
+# 文件头：魔数、标签、代数、段数
+# 标签一般是超级块的hash；代数是写附加文件时镜像文件的修改时间，
+# 之后只要镜像被改动过（不管是被谁改的），代数就对不上了
+_HEADER = struct.Struct("<8s8sQI")
+# 段头：段名长度、数据长度
+_SECTION = struct.Struct("<BI")
+
+
+def sidecar_path(image_path: str) -> str:
+    return image_path + C.SIDECAR_SUFFIX
+
+
+def _generation(image_path: str) -> int:
+    return os.stat(image_path).st_mtime_ns
+
+
+def save_sidecar(image_path: str, tag: bytes, sections: dict[str, bytes]) -> None:
+    """
+    将若干段数据写入镜像旁边的附加文件，必须在镜像已经完全写回并关闭之后调用
+    读取时用tag和镜像的修改时间来判断附加文件是否已经过时
+    """
+    parts = [_HEADER.pack(C.SIDECAR_MAGIC, tag, _generation(image_path), len(sections))]
+    for name, data in sections.items():
+        encoded_name = name.encode()
+        compressed = zlib.compress(data)
+        parts.append(_SECTION.pack(len(encoded_name), len(compressed)))
+        parts.append(encoded_name)
+        parts.append(compressed)
+
+    # 先写临时文件再改名，避免留下写了一半的附加文件
+    path = sidecar_path(image_path)
+    with open(path + ".tmp", "wb") as f:
+        f.write(b"".join(parts))
+    os.replace(path + ".tmp", path)
+
+
+def load_sidecar(image_path: str, tag: bytes) -> dict[str, bytes] | None:
+    """
+    读取并删除附加文件。
+    附加文件只在正常卸载时写入，所以读过之后就要删掉，
+    否则如果这次挂载没有正常卸载，下次挂载会读到过时的数据。
+    文件不存在、已损坏或与tag不符时返回None
+    """
+    path = sidecar_path(image_path)
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        data = f.read()
+    os.remove(path)
+
+    try:
+        magic, saved_tag, generation, count = _HEADER.unpack_from(data, 0)
+        if magic != C.SIDECAR_MAGIC or saved_tag != tag or generation != _generation(image_path):
+            return None
+        position = _HEADER.size
+        sections = {}
+        for _ in range(count):
+            name_length, data_length = _SECTION.unpack_from(data, position)
+            position += _SECTION.size
+            name = data[position:position + name_length].decode()
+            position += name_length
+            sections[name] = zlib.decompress(data[position:position + data_length])
+            position += data_length
+        return sections
+    except (struct.error, zlib.error, UnicodeDecodeError):
+        return None
@@ -1,36 +1,122 @@
+from __future__ import annotations
 from object_accessor import ObjectAccessor
-from construct import Container
 import constants as C
 import disk_params as DiskParams
 from free_block_interface import FreeBlockInterface
 from utils import timestamp, get_superblock_hash
-from structures import SuperBlockStruct
 from utils import debug_print
+from bitmap import Bitmap
+import struct
+
+# 空闲块索引块的二进制格式，与structures.FreeBlockIndexBlock一致，
+# 批量生成索引块时用它打包，比construct快得多
+_FREE_INDEX_BLOCK = struct.Struct(f"<I{C.FREE_INDEX_PER_BLOCK}I{C.FREE_INDEX_BLOCK_BYTES - 4 - 4 * C.FREE_INDEX_PER_BLOCK}x")
+
+# 超级块的二进制格式，与structures.SuperBlockStruct一致
+_SUPERBLOCK = struct.Struct(f"<3I{C.SUPERBLOCK_FREE_BLOCK}I2I{C.SUPERBLOCK_FREE_INODE}I4I160x3I8s8s")
+assert _SUPERBLOCK.size == C.SUPERBLOCK_BYTES
+_HASHED_BYTES = C.SUPERBLOCK_BYTES - 16
+
+_EMPTY_FREE_LIST = [0] * C.FREE_INDEX_PER_BLOCK
+
+
+class SuperblockData:
+    """
+    超级块在内存中的副本，字段与structures.SuperBlockStruct相同
+    给字段赋值时会自动记下这个字段被改过；直接修改s_free、s_inode这两个列表里的元素时，
+    需要调用touch手动标记。只有被改过的超级块才需要在同步时写回
+    """
+    __slots__ = ("s_isize", "s_fsize",
+                 "s_nfree", "s_free", "s_flock",
+                 "s_ninode", "s_inode", "s_ilock",
+                 "s_fmod", "s_ronly", "s_time",
+                 "bfree", "files", "ffree", "hash", "magic",
+                 "dirty")
+
+    def __init__(self, **fields):
+        object.__setattr__(self, "dirty", set())
+        for name, value in fields.items():
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name: str, value) -> None:
+        object.__setattr__(self, name, value)
+        self.dirty.add(name)
+
+    def touch(self, *names: str) -> None:
+        self.dirty.update(names)
+
+    @classmethod
+    def unpack(cls, data: bytes) -> SuperblockData:
+        values = _SUPERBLOCK.unpack_from(data)
+        s_isize, s_fsize, s_nfree = values[0:3]
+        s_free = list(values[3:103])
+        s_flock, s_ninode = values[103:105]
+        s_inode = list(values[105:205])
+        s_ilock, s_fmod, s_ronly, s_time, bfree, files, ffree, hash, magic = values[205:]
+        return cls(s_isize=s_isize, s_fsize=s_fsize,
+                   s_nfree=s_nfree, s_free=s_free, s_flock=s_flock,
+                   s_ninode=s_ninode, s_inode=s_inode, s_ilock=s_ilock,
+                   s_fmod=s_fmod, s_ronly=s_ronly, s_time=s_time,
+                   bfree=bfree, files=files, ffree=ffree, hash=hash, magic=magic)
+
+    def pack(self) -> bytes:
+        return _SUPERBLOCK.pack(self.s_isize, self.s_fsize,
+                                self.s_nfree, *self.s_free, self.s_flock,
+                                self.s_ninode, *self.s_inode, self.s_ilock,
+                                self.s_fmod, self.s_ronly, self.s_time,
+                                self.bfree, self.files, self.ffree, self.hash, self.magic)
+
 
 class Superblock(FreeBlockInterface):
-    def __init__(self, data: Container, object_accessor: ObjectAccessor, new: bool = True):
+    def __init__(self, data: SuperblockData, object_accessor: ObjectAccessor, new: bool = True,
+                 inode_map: bytes | None = None, block_map: bytes | None = None):
+        """
+        inode_map和block_map是上次卸载时保存下来的inode分配情况和空闲盘块位图，
+        只有在超级块的hash校验通过时才会被使用，否则重新扫描
+        """
         self.data = data
         self.object_accessor = object_accessor
+        self._inode_map: Bitmap | None = None
+        self._saved_inode_map = inode_map
+        self._block_map: Bitmap | None = None
+        self._saved_block_map = block_map
+        self.checked = new
 
         # 计算hash，并根据是否是新建磁盘来决定是写入hash，还是校验hash        
         if new:  # 对新磁盘，初始化额外信息
+            self._inode_map = Bitmap(DiskParams.INODE_COUNT)
+            self._inode_map.set(C.INODE_ROOT_NO)
             self._fill_inode()
             self.data.files = DiskParams.INODE_COUNT
             self.data.ffree = DiskParams.INODE_COUNT - 1
             
             self.data.bfree = 0
-            for i in range(DiskParams.DATA_START, DiskParams.DISK_BLOCKS):
-                self.release_block(i)
+            self.release_block_range(DiskParams.DATA_START, DiskParams.DISK_BLOCKS)
                 
             self.flush()
             return
-            
-        # 对已有磁盘，校验hash
-        encoded = SuperBlockStruct.build(self.data)
-        hash = get_superblock_hash(encoded)
+
+        # 对已有磁盘，校验hash（以及可能的重新计算）推迟到第一次用到的时候，见_check
+        
+    def _check(self) -> None:
+        """
+        校验hash，如果不通过就重新计算空闲盘块数等附加信息
+        所有会读取或修改这些信息的方法都要先调用它
+        """
+        if self.checked:
+            return
+        self.checked = True
+
+        hash = get_superblock_hash(self.data.pack())
         if self.data.hash == hash:
             # 如果此磁盘上一次是用本程序读写的，那就不需要再计算空闲盘块数啥的了
             debug_print("找到附加信息。")
+            inode_map = self._saved_inode_map
+            if inode_map is not None and len(inode_map) == DiskParams.INODE_COUNT:
+                self._inode_map = Bitmap(DiskParams.INODE_COUNT, inode_map)
+            block_map = self._saved_block_map
+            if block_map is not None and len(block_map) == DiskParams.DISK_BLOCKS:
+                self._block_map = Bitmap(DiskParams.DISK_BLOCKS, block_map)
             return
         
         debug_print("未找到附加信息，将重新计算...")
@@ -44,30 +130,88 @@ class Superblock(FreeBlockInterface):
         self.recount()
         debug_print("重新计算完毕。")
         self.flush()
+
+    @property
+    def inode_map(self) -> Bitmap:
+        if self._inode_map is None:
+            self._check()
+        if self._inode_map is None:
+            self._inode_map = self._scan_inodes()
+        return self._inode_map
+
+    @property
+    def block_map(self) -> Bitmap:
+        """
+        空闲盘块位图（0为空闲），第一次用到时沿着空闲块索引链构造，之后随分配和释放一起维护
+        """
+        if self._block_map is None:
+            self._check()
+        if self._block_map is None:
+            self._block_map = self._scan_free_blocks()
+        return self._block_map
+
+    def export_inode_map(self) -> bytes | None:
+        """
+        返回可以保存到附加文件里的inode位图，
+        如果这次挂载根本没用到位图，就原样返回挂载时读进来的那份（超级块没变，所以它仍然有效）
+        """
+        if self._inode_map is not None:
+            return self._inode_map.to_bytes()
+        return self._saved_inode_map
+
+    def export_block_map(self) -> bytes | None:
+        if self._block_map is not None:
+            return self._block_map.to_bytes()
+        return self._saved_block_map
+
+    @property
+    def bfree(self) -> int:
+        self._check()
+        return self.data.bfree
+
+    @property
+    def ffree(self) -> int:
+        self._check()
+        return self.data.ffree
                 
     def recount(self) -> None:
+        self._check()
         # 计算空闲盘块数
-        self.data.bfree = self.data.s_nfree
+        bfree = self.data.s_nfree
         index = self.data.s_free[0]
         while index != 0:
-            self.data.bfree += self.object_accessor.free_index_blocks[index].s_nfree
-            index = self.object_accessor.free_index_blocks[index].s_free[0]
+            s_nfree, index = _FREE_INDEX_BLOCK.unpack_from(self.object_accessor.read_raw_block(index))[:2]
+            bfree += s_nfree
         # 最后一个索引块的最后一项是0，并不是有效的空闲块，所以bfree要减去1
-        self.data.bfree -= 1
+        self.data.bfree = bfree - 1
         
         # 写入总inode数
         self.data.files = DiskParams.INODE_COUNT
         
         # 计算空闲inode数
-        self.data.ffree = 0
-        for i in range(1, DiskParams.INODE_COUNT):
-            if not self.object_accessor.inodes[i].d_mode.IALLOC:
-                self.data.ffree += 1
+        self.data.ffree = self.inode_map.count_free(1)
+
+    def _scan_free_blocks(self) -> Bitmap:
+        block_map = Bitmap(DiskParams.DISK_BLOCKS, b"\x01" * DiskParams.DISK_BLOCKS)
+        s_nfree, s_free = self.data.s_nfree, list(self.data.s_free)
+        while True:
+            for index in s_free[1:s_nfree]:
+                block_map.clear(index)
+            if s_free[0] == 0:
+                break
+            block_map.clear(s_free[0])
+            s_nfree, *s_free = _FREE_INDEX_BLOCK.unpack(self.object_accessor.read_raw_block(s_free[0]))
+        return block_map
+
+    def _scan_inodes(self) -> Bitmap:
+        inode_map = Bitmap(DiskParams.INODE_COUNT, self.object_accessor.inode_alloc_map())
+        inode_map.set(C.INODE_ROOT_NO)
+        return inode_map
     
     
     @classmethod
     def new(cls, object_accessor: ObjectAccessor):
-        data = Container(
+        data = SuperblockData(
             s_isize = DiskParams.INODE_BLOCKS,
             s_fsize = DiskParams.DISK_BLOCKS,
             
@@ -86,23 +230,30 @@ class Superblock(FreeBlockInterface):
             bfree = 0,
             files = 0,
             ffree = 0,
-            hash = 0,
-            magic = 0,)
+            hash = bytes(8),
+            magic = bytes(8),)
         object = cls(data, object_accessor, new=True)
         return object
         
     def flush(self) -> None:
-        # 计算并写入hash
-        encoded = SuperBlockStruct.build(self.data)
+        """
+        同步点：超级块被改过时才打包一次、计算一次hash并写回，否则什么都不做。
+        只读挂载时（比如挂载时重新计算了空闲块数）改动只留在内存里
+        """
+        if not self.data.dirty or self.object_accessor.block_device.readonly:
+            return
+
+        # 计算hash，与MAGIC一起拼到打包好的数据后面
+        encoded = self.data.pack()
         hash = get_superblock_hash(encoded)
-        self.data.hash = hash
-        
-        # 写入MAGIC
-        self.data.magic = C.MAGIC
-        
-        self.object_accessor.superblock = self.data
+        self.object_accessor.write_raw_superblock(encoded[:_HASHED_BYTES] + hash + C.MAGIC)
+
+        object.__setattr__(self.data, "hash", hash)
+        object.__setattr__(self.data, "magic", C.MAGIC)
+        self.data.dirty.clear()
     
     def allocate_block(self, zero=False) -> int:
+        self._check()
         if self.data.s_nfree == 1 and self.data.s_free[0] == 0:
             raise Exception("No free block")
         
@@ -113,50 +264,234 @@ class Superblock(FreeBlockInterface):
         if self.data.s_nfree == 0:
             if self.data.s_free[0] == 0:
                 raise Exception("No free block")
-            next_block = self.object_accessor.free_index_blocks[self.data.s_free[0]]
-            self.data.s_nfree = next_block.s_nfree
-            self.data.s_free = next_block.s_free
+            next_block = _FREE_INDEX_BLOCK.unpack(self.object_accessor.read_raw_block(self.data.s_free[0]))
+            self.data.s_nfree = next_block[0]
+            self.data.s_free[:] = next_block[1:]
+            self.data.touch("s_free")
             
         if zero:  # 是否清零
             self.object_accessor.clear_data_block(index)
         
         # debug_print(f"allocate block {index}")
+        if self._block_map is not None:
+            self._block_map.set(index)
         self.data.bfree -= 1
         return index
 
+    def allocate_blocks(self, count: int, reserve: int = 0) -> list[int]:
+        """
+        一次分配count个块，空闲块不够时一个也不分配。
+        reserve是调用者随后还要分配的块数（比如挂上这些块时要新建的索引块），
+        空闲块不够count + reserve个时同样一个也不分配，免得分配了一半才失败
+        """
+        self._check()
+        if count + reserve > self.data.bfree:
+            raise Exception("No free block")
+        result: list[int] = []
+        while len(result) < count:
+            # superblock的表里除了s_free[0]（下一个索引块）以外的块可以直接整段取走，
+            # 顺序与逐个调用allocate_block相同；表空了再交给allocate_block去换下一个索引块
+            take = min(count - len(result), self.data.s_nfree - 1)
+            if take <= 0:
+                result.append(self.allocate_block())
+                continue
+            s_nfree = self.data.s_nfree - take
+            taken = self.data.s_free[s_nfree : self.data.s_nfree]
+            taken.reverse()
+            result += taken
+            self.data.s_nfree = s_nfree
+            self.data.bfree -= take
+            if self._block_map is not None:
+                for index in taken:
+                    self._block_map.set(index)
+        return result
+
     def release_block(self, block_index: int) -> None:
+        self._check()
         if self.data.s_nfree < C.FREE_INDEX_PER_BLOCK:
             self.data.s_free[self.data.s_nfree] = block_index
             self.data.s_nfree += 1
+            self.object_accessor.discard_blocks(block_index, block_index + 1)
         else:
             # 写入下一个空闲块索引块
-            new_block = Container(s_nfree=self.data.s_nfree, s_free=self.data.s_free)
-            self.object_accessor.free_index_blocks[block_index] = new_block
+            new_block = _FREE_INDEX_BLOCK.pack(self.data.s_nfree, *self.data.s_free)
+            self.object_accessor.write_raw_blocks([(block_index, new_block)])
 
             self.data.s_nfree = 1
-            self.data.s_free = [0] * C.FREE_INDEX_PER_BLOCK
+            self.data.s_free[:] = _EMPTY_FREE_LIST
             self.data.s_free[0] = block_index
+        self.data.touch("s_free")
             
         # debug_print(f"release block {block_index}")
+        if self._block_map is not None:
+            self._block_map.clear(block_index)
         self.data.bfree += 1
     
-    def _fill_inode(self) -> None:
-        assert self.data.s_ninode == 0 or self.data.s_ninode == 1 and self.data.s_inode[0] == 0
-        for index in range(1, DiskParams.INODE_COUNT):
-            if self.object_accessor.inodes[index].d_mode.IALLOC:
+    def release_block_range(self, start: int, end: int) -> None:
+        """
+        释放[start, end)中的所有块，结果与依次调用release_block完全相同，
+        但是直接计算出每个空闲块索引块的内容，打包后成批写入
+        """
+        self._check()
+        # 先全部标记为要打洞，成为空闲块索引块的那些在写入时会被取消
+        self.object_accessor.discard_blocks(start, end)
+        s_nfree: int = self.data.s_nfree
+        s_free: list[int] = list(self.data.s_free)
+        pending: list[tuple[int, bytes]] = []
+        block_index = start
+        while block_index < end:
+            if s_nfree < C.FREE_INDEX_PER_BLOCK:
+                # 先把superblock里的表填满
+                count = min(end - block_index, C.FREE_INDEX_PER_BLOCK - s_nfree)
+                s_free[s_nfree : s_nfree + count] = range(block_index, block_index + count)
+                s_nfree += count
+                block_index += count
                 continue
-            self.data.s_inode[self.data.s_ninode] = index
-            self.data.s_ninode += 1
-            if self.data.s_ninode == C.SUPERBLOCK_FREE_INODE:
+
+            # 表已满，当前块成为新的空闲块索引块
+            pending.append((block_index, _FREE_INDEX_BLOCK.pack(s_nfree, *s_free)))
+            s_nfree = 1
+            s_free = [0] * C.FREE_INDEX_PER_BLOCK
+            s_free[0] = block_index
+            block_index += 1
+
+            if len(pending) >= C.FREE_INDEX_WRITE_BATCH:
+                self.object_accessor.write_raw_blocks(pending)
+                pending.clear()
+
+        self.object_accessor.write_raw_blocks(pending)
+        self.data.s_nfree = s_nfree
+        self.data.s_free[:] = s_free
+        self.data.touch("s_free")
+        if self._block_map is not None:
+            self._block_map.clear_range(start, end)
+        self.data.bfree += end - start
+
+    def _free_list_index_blocks(self) -> set[int]:
+        # 当前空闲链表上的所有索引块
+        blocks = set()
+        index = self.data.s_free[0]
+        while index != 0 and index not in blocks:
+            blocks.add(index)
+            index = _FREE_INDEX_BLOCK.unpack(self.object_accessor.read_raw_block(index))[1]
+        return blocks
+
+    def rebuild_free_list(self, block_map: Bitmap) -> None:
+        """
+        按block_map（0为空闲）重新生成整条空闲链表，分配时会按块号从小到大依次分配。
+        新链表的索引块不会用到旧链表的索引块，所以在超级块写回之前，磁盘上的旧链表一直是完整的，
+        中途崩溃的话留下的仍然是旧的那条链表。调用者需要在之后flush超级块
+        """
+        self._check()
+        avoid = self._free_list_index_blocks()
+        free = [i for i in range(DiskParams.DATA_START, DiskParams.DISK_BLOCKS) if block_map.is_free(i)]
+        self._write_free_list(free, avoid)
+        self.data.bfree = len(free)
+        self._block_map = Bitmap(len(block_map), block_map.to_bytes())
+
+    def take_run(self, count: int) -> int:
+        """
+        沿着空闲链表从头往后找，凑出count个连续的空闲块后把它们从链表里拿掉，返回起点，没有这样的一段时返回-1。
+        只重新生成找过的那一段链表（按块号从小到大分配，末尾接回没找过的部分），代价只与要找多深有关。
+        与rebuild_free_list一样不会用到旧的索引块，调用者需要在之后flush超级块
+        """
+        self._check()
+        if self.block_map.find_free_run(count, DiskParams.DATA_START) == -1:
+            return -1
+        walked: list[int] = []
+        # 已经找过的块连成的段：起点 -> 终点，终点 -> 起点
+        starts: dict[int, int] = {}
+        ends: dict[int, int] = {}
+        found = -1
+
+        def add(block: int) -> None:
+            nonlocal found
+            walked.append(block)
+            start, end = ends.pop(block, block), starts.pop(block + 1, block + 1)
+            starts[start], ends[end] = end, start
+            if found == -1 and end - start >= count:
+                found = start
+
+        avoid: set[int] = set()
+        link, entries = self.data.s_free[0], self.data.s_free[1:self.data.s_nfree]
+        while True:
+            for block in entries:
+                add(block)
+            if found != -1:
                 break
+            if link == 0:
+                return -1
+            avoid.add(link)
+            add(link)
+            s_nfree, *s_free = _FREE_INDEX_BLOCK.unpack(self.object_accessor.read_raw_block(link))
+            link, entries = s_free[0], s_free[1:s_nfree]
+
+        end = found + count
+        self._write_free_list(sorted(block for block in walked if not found <= block < end), avoid, link)
+        self.data.bfree -= count
+        self.block_map.data[found:end] = b"\x01" * count
+        return found
+
+    def _write_free_list(self, free: list[int], avoid: set[int], link: int = 0) -> None:
+        """
+        把free（已排好序）写成一段空闲链表，末尾接到索引块link上（0表示到此为止），并让超级块指向它。
+        新的索引块尽量不用avoid里的块
+        """
+        # 分配顺序是：超级块里的99个块、第1个索引块本身、第1个索引块里的99个块、第2个索引块本身……
+        # 所以每100个块为一组，组里最后分配的那个块用来存下一组
+        groups: list[tuple[int, list[int]]] = []
+        position = 0
+        while len(free) - position >= C.FREE_INDEX_PER_BLOCK:
+            group = free[position : position + C.FREE_INDEX_PER_BLOCK]
+            position += C.FREE_INDEX_PER_BLOCK
+            index = next((i for i in reversed(range(len(group))) if group[i] not in avoid), len(group) - 1)
+            groups.append((group.pop(index), group))
+        tail = free[position:]
+
+        # 从链表末尾往前生成，每一组的内容存在前一组的索引块里
+        pending: list[tuple[int, bytes]] = []
+        s_nfree, s_free = len(tail) + 1, [link, *reversed(tail)] + [0] * (C.FREE_INDEX_PER_BLOCK - 1 - len(tail))
+        for index_block, group in reversed(groups):
+            pending.append((index_block, _FREE_INDEX_BLOCK.pack(s_nfree, *s_free)))
+            if len(pending) >= C.FREE_INDEX_WRITE_BATCH:
+                self.object_accessor.write_raw_blocks(pending)
+                pending.clear()
+            s_nfree, s_free = C.FREE_INDEX_PER_BLOCK, [index_block, *reversed(group)]
+        self.object_accessor.write_raw_blocks(pending)
+
+        self.data.s_nfree = s_nfree
+        self.data.s_free[:] = s_free
+        self.data.touch("s_free")
+
+    def _fill_inode(self) -> None:
+        """
+        从inode位图中取出编号最小的若干个空闲inode，填满空白inode表
+        """
+        assert self.data.s_ninode == 0 or self.data.s_ninode == 1 and self.data.s_inode[0] == 0
+        self.data.s_ninode = 0
+        free = self.inode_map.take_free(C.SUPERBLOCK_FREE_INODE, 1)
+        self.data.s_inode[:len(free)] = free
+        self.data.s_ninode = len(free)
+        self.data.touch("s_inode")
                 
     def allocate_inode(self) -> int:
-        self.data.s_ninode -= 1
-        index = self.data.s_inode[self.data.s_ninode]
+        self._check()
+        # 空白inode表里的inode不一定可信（比如别的系统写过的镜像），以位图为准
+        while True:
+            if self.data.s_ninode <= 0:
+                self.data.s_ninode = 0
+                self._fill_inode()
+                if self.data.s_ninode == 0:
+                    raise Exception("No free inode")
+            self.data.s_ninode -= 1
+            index = self.data.s_inode[self.data.s_ninode]
+            if index != C.INODE_ROOT_NO and self.inode_map.is_free(index):
+                break
     
         # 设置IALLOC位
         # inode = self.object_accessor.inodes[index]
         # inode.d_mode.IALLOC = 1
+        self.inode_map.set(index)
     
         # 如果用完了缓存的空白inode表，就一次性把它填充满
         if self.data.s_ninode == 0:
@@ -166,15 +501,19 @@ class Superblock(FreeBlockInterface):
         return index
     
     def release_inode(self, inode_index: int) -> None:
-        # 清除IALLOC位
-        inode = self.object_accessor.inodes[inode_index]
-        inode.d_mode.IALLOC = 0
-        self.object_accessor.inodes[inode_index] = inode
+        self._check()
+        # 清除IALLOC位（d_mode第二个字节的最高位），不用经过construct
+        block_index = DiskParams.INODE_START + inode_index // C.INODE_PER_BLOCK
+        block = bytearray(self.object_accessor.read_raw_block(block_index))
+        block[inode_index % C.INODE_PER_BLOCK * C.INODE_BYTES + 1] &= 0x7f
+        self.object_accessor.write_raw_blocks([(block_index, bytes(block))])
+        self.inode_map.clear(inode_index)
 
         # 如果缓存的空白inode表没装满，就把这个空出来的inode塞进去 
         if self.data.s_ninode < C.INODE_PER_BLOCK:
             self.data.s_inode[self.data.s_ninode] = inode_index
             self.data.s_ninode += 1
+            self.data.touch("s_inode")
         
         self.data.ffree += 1
         
\ No newline at end of file
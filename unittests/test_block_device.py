@@ -0,0 +1,114 @@
+import unittest
+import os
+import errno
+from unittest import mock
+from block_device import ClusteredBlockDevice
+from disk import Disk
+from inode import FILE_TYPE
+from fsck import fsck
+
+IMG = 'temp.img'
+DEVICE_IMG = 'temp_device.img'
+CLUSTER = 8 * 1024
+BLOCKS = 256
+
+DIR = '/unittestdir'
+F1 = '/unittestdir/newfile1'
+
+
+def _block(i):
+    return bytes([i % 256]) * 512
+
+
+class ClusteredDeviceTestCase(unittest.TestCase):
+    def setUp(self):
+        with open(DEVICE_IMG, 'wb') as f:
+            f.write(b''.join(_block(i) for i in range(BLOCKS)))
+        # 只能放下4簇，方便测试挤出缓存
+        self.device = ClusteredBlockDevice(DEVICE_IMG, cluster_bytes=CLUSTER, cache_bytes=4 * CLUSTER)
+
+    def tearDown(self):
+        self.device.close()
+        os.remove(DEVICE_IMG)
+
+    def on_disk(self, i):
+        with open(DEVICE_IMG, 'rb') as f:
+            f.seek(i * 512)
+            return f.read(512)
+
+    def test_read_whole_cluster_once(self):
+        with mock.patch('block_device.os.pread', wraps=os.pread) as pread:
+            for i in range(16):
+                self.assertEqual(self.device.read_block(i), _block(i))
+            self.assertEqual(self.device.read_block_bytes(17, 10, 3), _block(17)[10:13])
+        self.assertEqual(pread.call_count, 2)
+
+    def test_write_back(self):
+        self.device.write_block_bytes(3, 100, b'abc')
+        self.device.write_block(5, b'x' * 512)
+        self.assertEqual(self.device.read_block(3), _block(3)[:100] + b'abc' + _block(3)[103:])
+        # 还没写回，但整段读取要能读到
+        self.assertEqual(self.on_disk(5), _block(5))
+        self.assertEqual(self.device.read_block_range(4, 6), _block(4) + b'x' * 512)
+        self.device.flush()
+        self.assertEqual(self.on_disk(5), b'x' * 512)
+        self.assertEqual(self.on_disk(3)[100:103], b'abc')
+
+    def test_full_block_write_does_not_read(self):
+        with mock.patch('block_device.os.pread', wraps=os.pread) as pread:
+            self.device.write_block(20, b'y' * 512)
+            self.assertEqual(self.device.read_block(20), b'y' * 512)
+        self.assertEqual(pread.call_count, 0)
+        # 同一簇里其它的块还是镜像里的内容
+        self.assertEqual(self.device.read_block(21), _block(21))
+        self.assertEqual(self.device.read_block(20), b'y' * 512)
+
+    def test_eviction_writes_dirty_blocks(self):
+        self.device.write_block(0, b'z' * 512)
+        for i in range(1, 5):
+            self.device.read_block(i * 16)
+        self.assertNotIn(0, self.device.clusters)
+        self.assertEqual(self.on_disk(0), b'z' * 512)
+        self.assertEqual(self.device.read_block(0), b'z' * 512)
+
+    def test_direct_writes_update_cache(self):
+        self.device.read_block(32)
+        self.device.write_block(33, b'a' * 512)
+        self.device.write_block_range(32, b'b' * 1024)
+        self.assertEqual(self.device.read_block(33), b'b' * 512)
+        self.device.write_block(34, b'c' * 512)
+        self.device.write_block_vectors(34, [b'd' * 512])
+        self.assertEqual(self.device.read_block(34), b'd' * 512)
+        self.device.flush()
+        self.assertEqual(self.on_disk(33), b'b' * 512)
+        self.assertEqual(self.on_disk(34), b'd' * 512)
+
+    def test_readonly(self):
+        device = ClusteredBlockDevice(DEVICE_IMG, readonly=True, cluster_bytes=CLUSTER)
+        with self.assertRaises(OSError) as cm:
+            device.write_block_bytes(0, 0, b'x')
+        self.assertEqual(cm.exception.errno, errno.EROFS)
+        self.assertEqual(device.read_block(0), _block(0))
+        device.close()
+
+    def test_disk(self):
+        Disk.new(IMG)
+        disk = Disk(IMG, cluster_bytes=16 * 1024)
+        disk.mount()
+        disk.block_device.capacity = 8
+        disk.create(DIR, FILE_TYPE.DIR)
+        data = os.urandom(300000)
+        disk.create(F1, FILE_TYPE.FILE)
+        disk.write_file(F1, 0, data)
+        for i in range(50):
+            disk.create(f'{DIR}/f{i}', FILE_TYPE.FILE)
+            disk.write_file(f'{DIR}/f{i}', 0, str(i).encode() * 100)
+        disk.write_file(F1, 1000, b'patched')
+        disk.unmount()
+
+        self.assertTrue(fsck(IMG, workers=2).clean)
+        disk = Disk(IMG)
+        disk.mount()
+        self.assertEqual(disk.read_file(F1, 0, -1), data[:1000] + b'patched' + data[1007:])
+        self.assertEqual(disk.read_file(f'{DIR}/f42', 0, -1), b'42' * 100)
+        disk.unmount()
@@ -0,0 +1,95 @@
+import unittest
+import os
+from disk import Disk
+from inode import FILE_TYPE
+from change_tracking import enable_tracking, emit_delta, apply_deltas, cbt_path, applied_path
+
+IMG = 'temp.img'
+RESTORED = 'temp_restored.img'
+DELTAS = [f'temp_{i}.delta' for i in range(3)]
+
+DIR = '/unittestdir'
+F1 = '/unittestdir/newfile1'
+
+
+def _read_image(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+class ChangeTrackingTestCase(unittest.TestCase):
+    def setUp(self):
+        Disk.new(IMG)
+        enable_tracking(IMG)
+
+    def tearDown(self):
+        for path in [RESTORED, applied_path(RESTORED), cbt_path(IMG)] + DELTAS:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def modify(self, data):
+        disk = Disk(IMG)
+        disk.mount()
+        if not disk.exists(DIR):
+            disk.create(DIR, FILE_TYPE.DIR)
+            disk.create(F1, FILE_TYPE.FILE)
+        disk.write_file(F1, 0, data)
+        disk.unmount()
+
+    def test_incremental_chain(self):
+        self.assertEqual(emit_delta(IMG, DELTAS[0]), (0, os.path.getsize(IMG) // 512))
+        self.modify(b'x' * 3000)
+        sequence, blocks = emit_delta(IMG, DELTAS[1])
+        self.assertEqual(sequence, 1)
+        self.assertLess(blocks, 50)
+        self.modify(b'y' * 10)
+        self.assertLess(emit_delta(IMG, DELTAS[2])[1], blocks)
+        self.assertLess(os.path.getsize(DELTAS[2]), os.path.getsize(IMG) // 100)
+
+        apply_deltas(RESTORED, DELTAS)
+        self.assertEqual(_read_image(RESTORED), _read_image(IMG))
+        with self.assertRaises(ValueError):
+            apply_deltas(RESTORED, [DELTAS[0], DELTAS[2]])
+
+    def test_restore_continues_from_applied_sequence(self):
+        emit_delta(IMG, DELTAS[0])
+        self.modify(b'x' * 3000)
+        emit_delta(IMG, DELTAS[1])
+        self.modify(b'y' * 10)
+        emit_delta(IMG, DELTAS[2])
+
+        apply_deltas(RESTORED, DELTAS[:1])
+        before = _read_image(RESTORED)
+        # 跳过了增量1，镜像不能被改动
+        with self.assertRaises(ValueError):
+            apply_deltas(RESTORED, DELTAS[2:])
+        self.assertEqual(_read_image(RESTORED), before)
+        apply_deltas(RESTORED, DELTAS[1:2])
+        with self.assertRaises(ValueError):
+            apply_deltas(RESTORED, DELTAS[1:2])
+        apply_deltas(RESTORED, DELTAS[2:])
+        self.assertEqual(_read_image(RESTORED), _read_image(IMG))
+        # 完整的增量随时都可以重新应用
+        apply_deltas(RESTORED, DELTAS)
+        self.assertEqual(_read_image(RESTORED), _read_image(IMG))
+
+        # 没有序号记录的镜像只能从完整的增量开始
+        os.remove(applied_path(RESTORED))
+        with self.assertRaises(ValueError):
+            apply_deltas(RESTORED, DELTAS[2:])
+
+    def test_unclean_shutdown_makes_next_delta_full(self):
+        emit_delta(IMG, DELTAS[0])
+        disk = Disk(IMG)
+        disk.mount()
+        disk.create(DIR, FILE_TYPE.DIR)
+        disk.flush()
+        # 没有卸载，就像进程被杀掉了一样
+        with self.assertRaises(OSError):
+            emit_delta(IMG, DELTAS[1])
+        disk.block_device.image_file.close()
+
+        disk = Disk(IMG)
+        disk.mount()
+        disk.unmount()
+        self.assertEqual(emit_delta(IMG, DELTAS[1]), (1, os.path.getsize(IMG) // 512))
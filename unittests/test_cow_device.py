@@ -0,0 +1,86 @@
+import unittest
+import os
+from disk import Disk
+from inode import FILE_TYPE
+from cow_device import create_clone, commit_clone, index_path
+from fsck import fsck
+
+IMG = 'temp.img'
+CLONES = ['temp_clone1.img', 'temp_clone2.img']
+
+DIR = '/unittestdir'
+F1 = '/unittestdir/newfile1'
+F2 = '/unittestdir/newfile2'
+
+
+def _read_image(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+class CowDeviceTestCase(unittest.TestCase):
+    def setUp(self):
+        disk = Disk.new(IMG)
+        disk.mount()
+        disk.create(DIR, FILE_TYPE.DIR)
+        disk.create(F1, FILE_TYPE.FILE)
+        disk.write_file(F1, 0, b'base' * 1000)
+        disk.unmount()
+        self.base = _read_image(IMG)
+        for path in CLONES:
+            create_clone(IMG, path)
+
+    def tearDown(self):
+        for path in CLONES:
+            for name in (path, index_path(path)):
+                if os.path.exists(name):
+                    os.remove(name)
+
+    def test_clones_are_independent(self):
+        disk = Disk(CLONES[0])
+        disk.mount()
+        self.assertEqual(disk.read_file(F1, 0, -1), b'base' * 1000)
+        disk.write_file(F1, 0, b'clone')
+        disk.create(F2, FILE_TYPE.FILE)
+        disk.write_file(F2, 0, b'x' * 100000)
+        disk.unmount()
+
+        self.assertEqual(_read_image(IMG), self.base)
+        # 克隆里只存了写过的块
+        self.assertLess(os.stat(CLONES[0]).st_blocks * 512, len(self.base) // 10)
+        self.assertTrue(fsck(CLONES[0], workers=2).clean)
+
+        disk = Disk(CLONES[0])
+        disk.mount()
+        self.assertEqual(disk.read_file(F1, 0, 9), b'cloneaseb')
+        self.assertEqual(disk.read_file(F2, 0, -1), b'x' * 100000)
+        disk.unmount()
+
+        disk = Disk(CLONES[1])
+        disk.mount()
+        self.assertEqual(disk.read_file(F1, 0, 9), b'basebaseb')
+        self.assertFalse(disk.exists(F2))
+        disk.unmount()
+
+    def test_commit(self):
+        disk = Disk(CLONES[0])
+        disk.mount()
+        disk.write_file(F1, 0, b'clone')
+        disk.unmount()
+        self.assertGreater(commit_clone(CLONES[0]), 0)
+        self.assertEqual(commit_clone(CLONES[0]), 0)
+
+        disk = Disk(IMG)
+        disk.mount()
+        self.assertEqual(disk.read_file(F1, 0, 9), b'cloneaseb')
+        disk.unmount()
+        self.assertTrue(fsck(IMG, workers=2).clean)
+
+    def test_readonly_clone(self):
+        disk = Disk(CLONES[0], readonly=True)
+        disk.mount()
+        self.assertEqual(disk.read_file(F1, 0, -1), b'base' * 1000)
+        with self.assertRaises(OSError):
+            disk.write_file(F1, 0, b'clone')
+        disk.unmount()
+        self.assertEqual(os.stat(CLONES[0]).st_blocks, 0)
@@ -0,0 +1,75 @@
+import unittest
+from unittest import mock
+from disk import Disk
+from inode import FILE_TYPE
+from defrag import Defragmenter
+from fsck import fsck
+
+IMG = 'temp.img'
+
+DIR = '/unittestdir'
+
+
+class DefragTestCase(unittest.TestCase):
+    def setUp(self):
+        self.disk = Disk.new(IMG)
+        self.disk.mount()
+        self.disk.create(DIR, FILE_TYPE.DIR)
+        # 几个文件轮流追加，数据块交错在一起
+        self.files = [f'{DIR}/f{i}' for i in range(4)]
+        self.disk.create_many(self.files, FILE_TYPE.FILE)
+        self.contents = {path: b'' for path in self.files}
+        for round in range(200):
+            for i, path in enumerate(self.files):
+                chunk = bytes([round % 251, i]) * 256
+                self.disk.write_file(path, len(self.contents[path]), chunk)
+                self.contents[path] += chunk
+
+    def test_run(self):
+        defrag = Defragmenter(self.disk)
+        stats = defrag.run()
+        self.assertGreater(stats.before, 0.5)
+        self.assertEqual(stats.after, 0.0)
+        self.assertEqual(stats.files, len(self.files))
+        for path, data in self.contents.items():
+            self.assertEqual(self.disk.read_file(path, 0, -1), data)
+        self.disk.unmount()
+        self.assertTrue(fsck(IMG, workers=2).clean)
+
+        disk = Disk(IMG)
+        disk.mount()
+        for path, data in self.contents.items():
+            self.assertEqual(disk.read_file(path, 0, -1), data)
+        disk.unmount()
+
+    def test_step_budget(self):
+        defrag = Defragmenter(self.disk)
+        superblock = self.disk.superblock
+        with mock.patch.object(superblock, 'rebuild_free_list', wraps=superblock.rebuild_free_list) as rebuild, \
+                mock.patch.object(self.disk, 'load_inode', wraps=self.disk.load_inode) as load_inode:
+            # 预算比一个文件还小时也要搬一个文件
+            self.assertEqual(defrag.step(budget=1), 200 + 2)
+            self.assertEqual(defrag.moved_files, 1)
+            self.assertGreater(defrag.fragmentation(), 0.0)
+            load_inode.reset_mock()
+            while defrag.step(budget=1):
+                pass
+            # 每一轮接着上一轮往后找，不会把整理过的文件再读一遍
+            self.assertLess(load_inode.call_count, 2 * len(self.files) + 2)
+            # 只有最后一轮重建整条空闲链表
+            self.assertEqual(rebuild.call_count, 1)
+        self.assertEqual(defrag.moved_files, len(self.files))
+        self.assertEqual(defrag.fragmentation(), 0.0)
+        self.disk.unmount()
+        self.assertTrue(fsck(IMG, workers=2).clean)
+
+    def test_allocation_after_rebuild(self):
+        superblock = self.disk.superblock
+        self.disk.unlink(self.files[1])
+        superblock.rebuild_free_list(superblock.block_map)
+        blocks = superblock.allocate_blocks(50)
+        self.assertEqual(blocks, sorted(blocks))
+        for block in blocks:
+            superblock.release_block(block)
+        self.disk.unmount()
+        self.assertTrue(fsck(IMG, workers=2).clean)
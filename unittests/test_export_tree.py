@@ -0,0 +1,56 @@
+import unittest
+import os
+import tarfile
+import tempfile
+from disk import Disk
+from inode import FILE_TYPE
+from export_tree import export_tree
+import constants as C
+
+IMG = 'temp.img'
+
+
+class ExportTreeTestCase(unittest.TestCase):
+    def setUp(self):
+        self.files = {
+            'a.txt': b'hello',
+            'sub/b.bin': os.urandom(3000),
+            'sub/deeper/c.bin': os.urandom(C.EXPORT_TASK_BYTES + 1000),
+            'empty': b'',
+        }
+        disk = Disk.new(IMG, disk_blocks=200000)
+        disk.mount()
+        disk.create_many(['/sub', '/sub/deeper', '/nothing'], FILE_TYPE.DIR)
+        for name, data in self.files.items():
+            with disk.open_writer(f'/{name}') as writer:
+                writer.write(data)
+        disk.unmount()
+        self.mtime = os.stat(IMG).st_mtime_ns
+        self.host = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.host.cleanup()
+
+    def test_export_to_directory(self):
+        stats = export_tree(IMG, self.host.name, workers=2)
+        self.assertEqual((stats.files, stats.dirs), (4, 3))
+        self.assertEqual(stats.bytes, sum(len(data) for data in self.files.values()))
+        for name, data in self.files.items():
+            with open(os.path.join(self.host.name, name), 'rb') as f:
+                self.assertEqual(f.read(), data)
+        self.assertTrue(os.path.isdir(os.path.join(self.host.name, 'nothing')))
+        # 只读打开，镜像没有被改动过
+        self.assertEqual(os.stat(IMG).st_mtime_ns, self.mtime)
+
+    def test_export_to_tar(self):
+        path = os.path.join(self.host.name, 'out.tar')
+        export_tree(IMG, path, workers=2)
+        with tarfile.open(path) as tar:
+            self.assertEqual(sorted(tar.getnames()),
+                             sorted(['sub', 'sub/deeper', 'nothing', *self.files]))
+            for name, data in self.files.items():
+                self.assertEqual(tar.extractfile(name).read(), data)
+
+
+if __name__ == '__main__':
+    unittest.main()
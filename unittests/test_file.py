@@ -0,0 +1,77 @@
+import unittest
+import os
+from disk_with_handle import DiskWithHandle
+from file import File, OpenedFiles
+from inode import FILE_TYPE
+
+# MYFS_TEST_IMAGE=memory时镜像建在内存里（见memory_device）
+IMG = 'mem:temp.img' if os.environ.get('MYFS_TEST_IMAGE') == 'memory' else 'temp.img'
+
+DIR = '/unittestdir'
+FILE = '/unittestdir/unittestfile'
+
+
+class OpenedFilesTestCase(unittest.TestCase):
+    def test_index_and_reuse(self):
+        files = OpenedFiles()
+        handles = [files.add(File(f'/f{i}')) for i in range(1000)]
+        self.assertEqual(handles, list(range(1, 1001)))
+        self.assertEqual(files.find('/f500'), 501)
+        self.assertIn('/f999', files)
+
+        files.pop('/f500')
+        files.pop(10)
+        self.assertNotIn('/f500', files)
+        self.assertNotIn(10, files)
+        # 关闭的句柄号会被重新使用，先用小的
+        self.assertEqual(files.add(File('/g')), 10)
+        self.assertEqual(files.add(File('/h')), 501)
+        self.assertEqual(files.add(File('/i')), 1001)
+
+    def test_same_path_opened_twice(self):
+        files = OpenedFiles()
+        first = files.add(File('/f'))
+        second = files.add(File('/f'))
+        self.assertEqual(files.handles('/f'), [first, second])
+        files.pop(first)
+        self.assertEqual(files.find('/f'), second)
+        files.pop(second)
+        self.assertNotIn('/f', files)
+
+
+class DiskWithHandleTestCase(unittest.TestCase):
+    def setUp(self):
+        self.disk = DiskWithHandle.new(IMG)
+        self.disk.mount()
+        self.disk.create(DIR, FILE_TYPE.DIR)
+        self.disk.create(FILE, FILE_TYPE.FILE)
+
+    def tearDown(self):
+        self.disk.unmount()
+
+    def test_sequential_write_and_read(self):
+        handle = self.disk.open(FILE)
+        content = bytes(range(256)) * 20
+        for start in range(0, len(content), 700):
+            self.disk.write_file(handle, content[start:start + 700])
+        self.disk.seek(handle, 0)
+        chunks = []
+        while chunk := self.disk.read_file(handle, 300):
+            chunks.append(chunk)
+        self.assertEqual(b''.join(chunks), content)
+        self.disk.close(handle)
+
+    def test_unlink_closes_handle(self):
+        handle = self.disk.open(FILE)
+        self.disk.write_file(handle, b'abc')
+        self.disk.unlink(FILE)
+        self.assertNotIn(handle, self.disk.files)
+        self.assertEqual(self.disk.open_inodes, {})
+
+    def test_unlink_directory(self):
+        self.disk.unlink(DIR)
+        self.assertFalse(self.disk.exists(FILE))
+
+
+if __name__ == '__main__':
+    unittest.main()
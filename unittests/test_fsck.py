@@ -0,0 +1,72 @@
+import unittest
+from disk import Disk
+from inode import FILE_TYPE
+from fsck import fsck
+
+IMG = 'temp.img'
+
+DIR = '/unittestdir'
+F1 = '/unittestdir/newfile1'
+F2 = '/unittestdir/newfile2'
+
+
+class FsckTestCase(unittest.TestCase):
+    def setUp(self):
+        self.disk = Disk.new(IMG)
+        self.disk.mount()
+        self.disk.create(DIR, FILE_TYPE.DIR)
+        self.disk.create_many([F1, F2], FILE_TYPE.FILE)
+        self.disk.write_file(F1, 0, b'x' * 100000)
+        self.disk.write_file(F2, 0, b'y' * 600)
+
+    def check(self):
+        self.disk.unmount()
+        return fsck(IMG, workers=2)
+
+    def test_clean(self):
+        self.disk.create_many([f'{DIR}/f{i}' for i in range(50)], FILE_TYPE.FILE)
+        self.disk.unlink(f'{DIR}/f7')
+        self.disk.link(F2, f'{DIR}/hard')
+        self.disk.rename(F1, '/moved')
+        report = self.check()
+        self.assertTrue(report.clean, report)
+
+    def test_leaked_block(self):
+        block = self.disk.superblock.allocate_block()
+        report = self.check()
+        self.assertEqual(report.leaked, [block])
+        self.assertEqual(report.counters, [])
+
+    def test_double_allocated_block(self):
+        owner = self.disk._get_inode(F1)
+        shared = owner.peek_block(0)
+        inode = self.disk._get_inode(F2)
+        lost = inode.data.d_addr[1]
+        inode.data.d_addr[1] = shared
+        inode.flush()
+        report = self.check()
+        self.assertEqual([(block, sorted(owners)) for block, owners in report.double_allocated],
+                         [(shared, sorted([owner.index, inode.index]))])
+        self.assertEqual(report.leaked, [lost])
+
+    def test_orphan_and_dangling(self):
+        parent = self.disk._get_inode(DIR)
+        orphan = self.disk._get_inode(F1).index
+        self.disk._remove_entry(self.disk._dir_index(parent), 'newfile1')
+        dangling = self.disk._get_inode(F2).index
+        self.disk.superblock.release_inode(dangling)
+        report = self.check()
+        self.assertEqual(report.orphaned, [orphan])
+        self.assertEqual(report.dangling, [(parent.index, 'newfile2', dangling)])
+        # F2的块没有主人了
+        self.assertEqual(len(report.leaked), 2)
+
+    def test_counters(self):
+        self.disk.superblock.data.bfree += 1
+        report = self.check()
+        self.assertEqual(len(report.counters), 1)
+        self.assertIn('bfree', report.counters[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import unittest
+import os
+import tempfile
+from disk import Disk
+from inode import FILE_TYPE
+from import_tree import import_tree
+import constants as C
+
+IMG = 'temp.img'
+
+
+class ImportTreeTestCase(unittest.TestCase):
+    def setUp(self):
+        self.host = tempfile.TemporaryDirectory()
+        self.files = {
+            'a.txt': b'hello',
+            'sub/b.bin': os.urandom(3000),
+            'sub/deeper/c.bin': os.urandom(C.IMPORT_SMALL_FILE_BYTES + 1000),
+            'empty/.keep': b'',
+        }
+        for name, data in self.files.items():
+            path = os.path.join(self.host.name, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(data)
+        os.symlink('a.txt', os.path.join(self.host.name, 'link'))
+
+        self.disk = Disk.new(IMG, disk_blocks=200000)
+        self.disk.mount()
+
+    def tearDown(self):
+        self.disk.unmount()
+        self.host.cleanup()
+
+    def test_import(self):
+        stats = import_tree(self.disk, self.host.name, '/imp', workers=2)
+        self.assertEqual(stats.errors, [])
+        self.assertEqual((stats.files, stats.dirs), (4, 3))
+        self.assertEqual(stats.bytes, sum(len(data) for data in self.files.values()))
+        self.assertEqual(stats.skipped, [os.path.join(self.host.name, 'link')])
+
+        self.disk.unmount()
+        self.disk.mount()
+        for name, data in self.files.items():
+            self.assertEqual(self.disk.read_file(f'/imp/{name}', 0, -1), data)
+
+    def test_import_overwrites(self):
+        self.disk.create('/imp', FILE_TYPE.DIR)
+        self.disk.create('/imp/a.txt', FILE_TYPE.FILE)
+        self.disk.write_file('/imp/a.txt', 0, b'x' * 5000)
+        stats = import_tree(self.disk, self.host.name, '/imp')
+        self.assertEqual(stats.errors, [])
+        self.assertEqual(self.disk.read_file('/imp/a.txt', 0, -1), b'hello')
+        self.assertEqual(self.disk.superblock.bfree, self.disk.superblock._scan_free_blocks().count_free())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import unittest
+import errno
+import os
+from disk import Disk
+from inode import FILE_TYPE
+
+# MYFS_TEST_IMAGE=memory时镜像建在内存里（见memory_device）
+IMG = 'mem:temp.img' if os.environ.get('MYFS_TEST_IMAGE') == 'memory' else 'temp.img'
+
+A = '/a'
+B = '/b'
+
+
+class RenameTestCase(unittest.TestCase):
+    def setUp(self):
+        self.disk = Disk.new(IMG)
+        self.disk.mount()
+        self.disk.create(A, FILE_TYPE.DIR)
+        self.disk.create(B, FILE_TYPE.DIR)
+
+    def tearDown(self):
+        self.disk.unmount()
+
+    def test_rename_in_same_directory(self):
+        self.disk.create(f'{A}/f', FILE_TYPE.FILE)
+        self.disk.write_file(f'{A}/f', 0, b'hello')
+        self.disk.rename(f'{A}/f', f'{A}/g')
+        self.assertEqual(self.disk.dir_list(A), ['g'])
+        self.assertEqual(self.disk.read_file(f'{A}/g', 0, -1), b'hello')
+
+    def test_rename_replaces_file(self):
+        self.disk.create(f'{A}/f', FILE_TYPE.FILE)
+        self.disk.write_file(f'{A}/f', 0, b'new')
+        self.disk.create(f'{B}/g', FILE_TYPE.FILE)
+        self.disk.write_file(f'{B}/g', 0, b'old' * 1000)
+        old = self.disk._get_inode(f'{B}/g').index
+        bfree = self.disk.superblock.bfree
+
+        self.disk.rename(f'{A}/f', f'{B}/g')
+        self.assertEqual(self.disk.read_file(f'{B}/g', 0, -1), b'new')
+        self.assertFalse(self.disk.exists(f'{A}/f'))
+        # 被替换掉的文件已经释放
+        self.assertTrue(self.disk.superblock.inode_map.is_free(old))
+        self.assertEqual(self.disk.superblock.bfree, bfree + 6)
+
+    def test_rename_onto_non_empty_directory(self):
+        self.disk.create(f'{A}/d', FILE_TYPE.DIR)
+        self.disk.create(f'{B}/d', FILE_TYPE.DIR)
+        self.disk.create(f'{B}/d/f', FILE_TYPE.FILE)
+        with self.assertRaises(OSError) as context:
+            self.disk.rename(f'{A}/d', f'{B}/d')
+        self.assertEqual(context.exception.errno, errno.ENOTEMPTY)
+        with self.assertRaises(OSError) as context:
+            self.disk.rename(A, f'{A}/d/x')
+        self.assertEqual(context.exception.errno, errno.EINVAL)
+
+    def test_move_directory_tree(self):
+        tree = f'{A}/tree'
+        self.disk.create(tree, FILE_TYPE.DIR)
+        for i in range(20):
+            self.disk.create(f'{tree}/d{i}', FILE_TYPE.DIR)
+            for j in range(10):
+                self.disk.create(f'{tree}/d{i}/f{j}', FILE_TYPE.FILE)
+        # 手动加一个".."，就像V6++自己创建的目录那样
+        self.disk._add_to_dir(self.disk._get_inode(tree), '..', self.disk._get_inode(A))
+        self.disk.dir_cache = type(self.disk.dir_cache)(self.disk.dir_cache.capacity)
+
+        touched = []
+        device = self.disk.block_device
+        for name in ('read_block_bytes', 'write_block_bytes', 'read_block_range', 'write_block_range'):
+            method = getattr(device, name)
+            def traced(block, *args, method=method):
+                touched.append(block)
+                return method(block, *args)
+            setattr(device, name, traced)
+
+        self.disk.rename(tree, f'{B}/moved')
+        # 只读写了几个目录块和inode，与子树的大小无关
+        self.assertLess(len(touched), 20)
+        self.assertEqual(self.disk._dir_index(self.disk._get_inode(f'{B}/moved')).lookup('..'),
+                         self.disk._get_inode(B).index)
+        self.assertTrue(self.disk.exists(f'{B}/moved/d19/f9'))
+        self.assertFalse(self.disk.exists(tree))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,224 @@
+import unittest
+import os
+from disk import Disk
+from inode import FILE_TYPE
+from sidecar import sidecar_path
+import disk_params as DiskParams
+import constants as C
+
+IMG = 'temp.img'
+
+DIR = '/unittestdir'
+
+
+class InodeAllocationTestCase(unittest.TestCase):
+    def setUp(self):
+        Disk.new(IMG)
+        self.disk = Disk(IMG, sidecar=True)
+        self.disk.mount()
+        self.disk.create(DIR, FILE_TYPE.DIR)
+
+    def tearDown(self):
+        self.disk.unmount()
+        if os.path.exists(sidecar_path(IMG)):
+            os.remove(sidecar_path(IMG))
+
+    def test_allocate_after_refill(self):
+        # 超过空白inode表的容量，触发多次填充
+        inodes = [self.disk.create(f'{DIR}/f{i}', FILE_TYPE.FILE).index for i in range(250)]
+        self.assertEqual(len(set(inodes)), len(inodes))
+        self.assertEqual(self.disk.superblock.data.ffree, DiskParams.INODE_COUNT - 1 - 251)
+
+    def test_release_and_reuse(self):
+        inode = self.disk.create(f'{DIR}/f', FILE_TYPE.FILE).index
+        self.disk.unlink(f'{DIR}/f')
+        self.assertTrue(self.disk.superblock.inode_map.is_free(inode))
+        for i in range(250):
+            self.disk.create(f'{DIR}/g{i}', FILE_TYPE.FILE)
+        self.assertFalse(self.disk.superblock.inode_map.is_free(inode))
+
+    def test_inode_map_matches_scan(self):
+        for i in range(20):
+            self.disk.create(f'{DIR}/f{i}', FILE_TYPE.FILE)
+        self.disk.unlink(f'{DIR}/f3')
+        self.disk.flush()
+        scanned = self.disk.superblock._scan_inodes()
+        self.assertEqual(scanned.to_bytes(), self.disk.superblock.inode_map.to_bytes())
+
+    def test_sidecar_roundtrip(self):
+        for i in range(20):
+            self.disk.create(f'{DIR}/f{i}', FILE_TYPE.FILE)
+        expected = self.disk.superblock.inode_map.to_bytes()
+        self.disk.unmount()
+        self.assertTrue(os.path.exists(sidecar_path(IMG)))
+
+        self.disk.mount()
+        # 挂载时读取并删除附加文件
+        self.assertFalse(os.path.exists(sidecar_path(IMG)))
+        self.assertEqual(self.disk.superblock.inode_map.to_bytes(), expected)
+
+    def test_mount_is_deferred(self):
+        self.disk.unmount()
+        self.disk.mount()
+        # 挂载时不校验超级块、不读根目录
+        self.assertFalse(self.disk.superblock.checked)
+        self.assertIsNone(self.disk._root_inode)
+        self.assertEqual(self.disk.get_stats().f_ffree, DiskParams.INODE_COUNT - 2)
+        self.assertTrue(self.disk.superblock.checked)
+
+    def test_stale_sidecar_is_ignored(self):
+        inode = self.disk._get_inode(DIR).index
+        self.disk.unmount()
+        with open(sidecar_path(IMG), 'r+b') as f:
+            f.seek(8)
+            f.write(b'\xff' * 8)  # 破坏tag
+        self.disk.mount()
+        self.assertFalse(self.disk.superblock.inode_map.is_free(inode))
+        self.assertTrue(self.disk.superblock.inode_map.is_free(inode + 1))
+
+    def test_block_map_matches_scan(self):
+        block_map = self.disk.superblock.block_map
+        for i in range(30):
+            self.disk.create(f'{DIR}/f{i}', FILE_TYPE.FILE)
+            self.disk.write_file(f'{DIR}/f{i}', 0, b'x' * 2000)
+        self.disk.unlink(f'{DIR}/f7')
+        self.assertEqual(self.disk.superblock._scan_free_blocks().to_bytes(), block_map.to_bytes())
+        self.assertEqual(block_map.count_free(), self.disk.superblock.bfree)
+
+    def test_dir_index_survives_remount(self):
+        for i in range(40):
+            self.disk.create(f'{DIR}/f{i}', FILE_TYPE.FILE)
+        self.disk.unlink(f'{DIR}/f5')
+        block_map = self.disk.superblock.block_map.to_bytes()
+        self.disk.unmount()
+
+        self.disk.mount()
+        ino = self.disk._get_inode(DIR).index
+        self.assertIn(ino, self.disk.dir_cache)
+        self.assertEqual(self.disk.superblock.block_map.to_bytes(), block_map)
+        # 目录项的空位从附加文件里恢复，新文件应该填进f5原来的位置
+        self.disk.create(f'{DIR}/g', FILE_TYPE.FILE)
+        self.assertEqual(self.disk.dir_list(DIR)[5], 'g')
+        self.disk.dir_cache.pop(ino)
+        self.assertEqual(self.disk.dir_list(DIR)[5], 'g')
+
+    def test_modified_image_invalidates_sidecar(self):
+        self.disk.create(f'{DIR}/f', FILE_TYPE.FILE)
+        self.disk.unmount()
+        # 镜像在卸载之后被改动过（这里只改修改时间），附加文件应当作废
+        stat = os.stat(IMG)
+        os.utime(IMG, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000))
+        self.disk.mount()
+        self.assertEqual(len(self.disk.dir_cache), 0)
+        self.assertIn('f', self.disk.dir_list(DIR))
+
+
+class FormatTestCase(unittest.TestCase):
+    def tearDown(self):
+        self.disk.unmount()
+
+    def test_free_chain_covers_data_area(self):
+        # 用一个小镜像，把所有空闲块都分配出来，每个数据块应该恰好出现一次
+        self.disk = Disk.new(IMG, inode_blocks=16, disk_blocks=1000)
+        self.disk.mount()
+        self.assertEqual(self.disk.superblock.data.bfree, DiskParams.DATA_BLOCK_COUNT)
+        blocks = [self.disk.superblock.allocate_block() for _ in range(DiskParams.DATA_BLOCK_COUNT)]
+        self.assertEqual(sorted(blocks), list(range(DiskParams.DATA_START, DiskParams.DISK_BLOCKS)))
+        self.assertRaises(Exception, self.disk.superblock.allocate_block)
+
+    def test_allocate_blocks_matches_allocate_block(self):
+        self.disk = Disk.new(IMG, inode_blocks=16, disk_blocks=2000)
+        self.disk.mount()
+        superblock = self.disk.superblock
+        superblock.allocate_block()
+        expected = [superblock.allocate_block() for _ in range(450)]
+        for block in reversed(expected):
+            superblock.release_block(block)
+        self.assertEqual(superblock.allocate_blocks(450), expected)
+        self.assertRaises(Exception, superblock.allocate_blocks, DiskParams.DATA_BLOCK_COUNT)
+
+    def test_release_block_range_matches_release_block(self):
+        self.disk = Disk.new(IMG, inode_blocks=16, disk_blocks=2000)
+        self.disk.mount()
+        superblock = self.disk.superblock
+        blocks = [superblock.allocate_block() for _ in range(450)]
+        blocks.sort()
+        start, end = blocks[0], blocks[0] + 150
+        self.assertEqual(blocks[:150], list(range(start, end)))
+
+        # 分别用两种方法释放同一批块，比较superblock和写出的索引块
+        snapshot = (superblock.data.s_nfree, list(superblock.data.s_free), superblock.data.bfree)
+        for block in range(start, end):
+            superblock.release_block(block)
+        expected = (superblock.data.s_nfree, list(superblock.data.s_free), superblock.data.bfree)
+        expected_blocks = self.disk.block_device.read_block_range(start, end)
+
+        superblock.data.s_nfree, superblock.data.s_free, superblock.data.bfree = snapshot[0], list(snapshot[1]), snapshot[2]
+        self.disk.block_device.write_block_range(start, b'\x00' * (end - start) * 512)
+        superblock.release_block_range(start, end)
+        self.assertEqual((superblock.data.s_nfree, list(superblock.data.s_free), superblock.data.bfree), expected)
+        self.assertEqual(self.disk.block_device.read_block_range(start, end), expected_blocks)
+
+
+    def test_take_run(self):
+        self.disk = Disk.new(IMG, inode_blocks=16, disk_blocks=2000)
+        self.disk.mount()
+        superblock = self.disk.superblock
+        # 链表开头是隔一个放回来的块，凑不成连续的段
+        used = superblock.allocate_blocks(300)
+        for block in used[::2]:
+            superblock.release_block(block)
+        bfree = superblock.data.bfree
+        self.assertEqual(superblock.take_run(DiskParams.DATA_BLOCK_COUNT), -1)
+        self.assertEqual(superblock.data.bfree, bfree)
+
+        start = superblock.take_run(250)
+        self.assertNotEqual(start, -1)
+        self.assertEqual(superblock.data.bfree, bfree - 250)
+        # 剩下的空闲块加上拿走的段和没放回的块，每个数据块恰好出现一次
+        rest = [superblock.allocate_block() for _ in range(superblock.data.bfree)]
+        self.assertRaises(Exception, superblock.allocate_block)
+        blocks = rest + list(range(start, start + 250)) + used[1::2]
+        self.assertEqual(sorted(blocks), list(range(DiskParams.DATA_START, DiskParams.DISK_BLOCKS)))
+
+
+class SuperblockSyncTestCase(unittest.TestCase):
+    def setUp(self):
+        self.disk = Disk.new(IMG)
+        self.disk.mount()
+        self.superblock = self.disk.superblock
+
+    def tearDown(self):
+        self.disk.unmount()
+
+    def test_clean_superblock_is_not_written(self):
+        self.assertEqual(self.superblock.bfree, DiskParams.DATA_BLOCK_COUNT)
+        self.assertEqual(self.superblock.data.dirty, set())
+        writes = []
+        self.disk.object_accessor.write_raw_superblock = writes.append
+        self.superblock.flush()
+        self.assertEqual(writes, [])
+
+    def test_sync_writes_once(self):
+        self.superblock.allocate_block()
+        self.superblock.allocate_inode()
+        self.assertTrue({'s_nfree', 'bfree', 's_ninode', 'ffree'} <= self.superblock.data.dirty)
+        self.superblock.flush()
+        self.superblock.flush()
+        self.assertEqual(self.superblock.data.dirty, set())
+        raw = self.disk.object_accessor.read_raw_superblock()
+        self.assertEqual(raw, self.superblock.data.pack())
+        self.assertEqual(raw[-8:], C.MAGIC)
+
+    def test_refill_across_index_blocks(self):
+        # 分配超过一个空闲块索引块的块数，再全部释放，空闲块数应该复原
+        blocks = [self.superblock.allocate_block() for _ in range(350)]
+        self.assertEqual(len(set(blocks)), 350)
+        for block in reversed(blocks):
+            self.superblock.release_block(block)
+        self.assertEqual(self.superblock.bfree, DiskParams.DATA_BLOCK_COUNT)
+        self.assertEqual(self.superblock._scan_free_blocks().count_free(), DiskParams.DATA_BLOCK_COUNT)
+
+
+if __name__ == '__main__':
+    unittest.main()
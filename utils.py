@@ -1,15 +1,12 @@
 import constants as C
 import time
-from datetime import datetime
-import hashlib
-from structures import SuperBlockStruct
-from construct import Container
-from rich import print as rprint
+import structures as S
 
 def timestamp() -> int:
     return int(time.time())
 
 def timestr(timestamp: int) -> str:
+    from datetime import datetime
     return datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
 
 def get_disk_start(block: bytes) -> int:
@@ -20,15 +17,17 @@ def get_disk_start(block: bytes) -> int:
         return 0
 
 def get_disk_params(data: bytes) -> tuple[int, int]:
-    superblock = SuperBlockStruct.parse(data)
+    superblock = S.SuperBlockStruct.parse(data)
     inode_block_size = superblock.s_isize
     disk_block_size = superblock.s_fsize
     return inode_block_size, disk_block_size
     
 def bytes_or(b1: bytes, b2: bytes) -> bytes:
-    return bytes(b1[i] | b2[i] for i in range(len(b1)))
+    result = int.from_bytes(b1, 'little') | int.from_bytes(b2, 'little')
+    return result.to_bytes(len(b1), 'little')
 
 def get_superblock_hash(superblock: bytes) -> bytes:
+    import hashlib
     data = superblock[:C.SUPERBLOCK_BYTES - 16]
     hash = hashlib.sha256(data).digest()
     return bytes_or(hash[:8], C.MAGIC)
@@ -36,5 +35,6 @@ def get_superblock_hash(superblock: bytes) -> bytes:
 start_time = time.time()
 def debug_print(*args):
     if C.OUTPUT_LOG:
+        from rich import print as rprint  # rich只在调试时才用得到，用到时再导入
         text = " ".join(str(arg) for arg in args)
         rprint(f"[yellow]{time.time() - start_time:.2f}[/yellow] : {text}")
\ No newline at end of file